@@ -0,0 +1,256 @@
+# backfill.py
+# Bulk re-processing of course archives after a model update: transcribes lecture videos with
+# Whisper and/or segments transcripts with SEGBOT across a process pool, appending every result
+# to a JSONL file that doubles as the checkpoint, so an interrupted backfill resumes where it
+# stopped and finished items are never processed twice.
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+TASKS = ("transcribe", "segment", "transcribe+segment")
+MEDIA_EXTENSIONS = (".mp4", ".mkv", ".webm", ".mov", ".avi", ".mp3", ".wav", ".m4a", ".flac", ".ogg")
+TRANSCRIPT_EXTENSIONS = (".json",)
+
+def discover_items(source, task):
+    """
+    Returns the items to process as {"id", "path"} dicts. source is a directory, searched
+    recursively for media files (or transcript JSON for the segment task), or a manifest:
+    a .jsonl file of {"path", optional "id"} objects or a text file with one path per line.
+    Ids default to the path relative to the directory or manifest.
+    """
+    if os.path.isdir(source):
+        extensions = TRANSCRIPT_EXTENSIONS if task == "segment" else MEDIA_EXTENSIONS
+        items = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for file_name in sorted(files):
+                if file_name.lower().endswith(extensions):
+                    path = os.path.join(root, file_name)
+                    items.append({"id": os.path.relpath(path, source).replace(os.sep, "/"), "path": path})
+        return items
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    items = []
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line) if source.endswith(".jsonl") else {"path": line}
+            path = entry["path"] if os.path.isabs(entry["path"]) else os.path.join(base_dir, entry["path"])
+            items.append({"id": str(entry.get("id", entry["path"])), "path": path})
+    return items
+
+def model_version(task, whisper_dir, segmenter_file_path, vad):
+    """
+    Digest of everything that changes the results: the model files the task uses (with
+    their external data), the featurizer version and the VAD setting. Records made with a
+    different version are not counted as done, so a model update re-processes everything.
+    """
+    from onnx_export_cache import file_digest
+
+    files = []
+    if task != "segment":
+        files += [os.path.join(whisper_dir, name) for name in ("encoder_model.onnx", "decoder_model_merged.onnx")]
+    if task != "transcribe":
+        files.append(segmenter_file_path)
+    digest = hashlib.sha256()
+    for path in files:
+        for part in (path, f"{os.path.splitext(path)[0]}.onnx_data"):
+            if os.path.isfile(part):
+                digest.update(f"{os.path.basename(part)}:{file_digest(part)}\n".encode())
+    if task != "transcribe":
+        from segbot_features import FEATURIZER_VERSION
+        digest.update(f"featurizer:{FEATURIZER_VERSION}\n".encode())
+    if task != "segment":
+        digest.update(f"vad:{vad}\n".encode())
+    return digest.hexdigest()[:16]
+
+def open_checkpoint(output_path, version):
+    """
+    Opens the JSONL output for appending and returns (file, ids already done). An item is
+    done when it has an "ok" record of the current model version; failed items are retried.
+    A line cut short by a crash is dropped, so the next record starts on a line of its own.
+    """
+    done = set()
+    if os.path.exists(output_path):
+        with open(output_path, "rb") as f:
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        if len(complete) != len(data):
+            with open(output_path, "r+b") as f:
+                f.truncate(len(complete))
+        for line in complete.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == "ok" and record.get("model_version") == version:
+                done.add(record["id"])
+            else:
+                done.discard(record.get("id"))
+    return open(output_path, "a"), done
+
+def write_record(f, record):
+    # One line per item, flushed to disk before the next is written, so every finished item survives a crash
+    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+# Per-process models, created once by _init_worker
+_worker = {}
+
+def _init_worker(task, whisper_dir, segmenter_file_path, vad, threads):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    _worker["task"] = task
+    if task != "segment":
+        from whisper_transcribe import WhisperOnnxTranscriber
+        detector = None
+        if vad:
+            from whisper_vad import VoiceActivityDetector
+            detector = VoiceActivityDetector()
+        _worker["transcriber"] = WhisperOnnxTranscriber(whisper_dir, session_options=options, vad=detector)
+    if task != "transcribe":
+        from segbot_inference import SegbotBatchSegmenter
+        _worker["segmenter"] = SegbotBatchSegmenter(segmenter_file_path, session_options=options)
+
+def check_models(task, whisper_dir, segmenter_file_path, vad):
+    """
+    Loads the task's models once in this process and releases them again. A pool respawns a
+    worker whose initializer raises without end, so a missing or unreadable model has to
+    fail here, before any worker starts.
+    """
+    try:
+        _init_worker(task, whisper_dir, segmenter_file_path, vad, 1)
+    except Exception as e:
+        raise RuntimeError(f"Could not load the models for {task}: {type(e).__name__}: {e}") from e
+    finally:
+        _worker.clear()
+
+def _segment(transcript):
+    from segbot_boundaries import segment_map
+    from segbot_features import featurize_transcript, unit_end_times
+
+    features = featurize_transcript(transcript)
+    if len(features) == 0:
+        return {"boundaries": [], "segmentationMap": []}
+    boundaries = _worker["segmenter"].segment([features])[0]
+    return {"boundaries": [int(b) for b in boundaries], "segmentationMap": segment_map(boundaries, unit_end_times(transcript))}
+
+def process_item(item):
+    """
+    Runs the worker's task on one item and returns its record; errors are recorded rather
+    than raised so one bad file does not stop the backfill.
+    """
+    started = time.perf_counter()
+    record = {"id": item["id"], "path": item["path"]}
+    try:
+        if _worker["task"] == "segment":
+            with open(item["path"]) as f:
+                record.update(_segment(json.load(f)))
+        else:
+            transcript, stats = _worker["transcriber"].transcribe_file(item["path"])
+            record["transcript"] = transcript
+            record["audio_seconds"] = stats["audio_seconds"]
+            if _worker["task"] == "transcribe+segment":
+                record.update(_segment(transcript))
+        record["status"] = "ok"
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+def run_backfill(items, output_path, task="transcribe", workers=None, whisper_dir="whisper_onnx",
+                 segmenter_file_path="segbot_segmenter.onnx", vad=False, threads_per_worker=1, report_every=5.0):
+    """
+    Processes every item not yet done in output_path with `workers` processes, each holding
+    its own ONNX sessions, and appends one record per item as it finishes. Items are handed
+    out largest file first so no worker is left with a long video at the end. Returns
+    counts of processed, failed and skipped items; raises RuntimeError if the models cannot
+    be loaded.
+    """
+    workers = workers or os.cpu_count() or 1
+    version = model_version(task, whisper_dir, segmenter_file_path, vad)
+    output, done = open_checkpoint(output_path, version)
+    pending = [item for item in items if item["id"] not in done]
+    pending.sort(key=lambda item: os.path.getsize(item["path"]) if os.path.exists(item["path"]) else 0, reverse=True)
+    print(f"{len(items)} item(s), {len(items) - len(pending)} already done with model version {version}, "
+          f"{len(pending)} to {task} with {workers} worker(s)", file=sys.stderr)
+    counts = {"processed": 0, "failed": 0, "skipped": len(items) - len(pending)}
+    if not pending:
+        output.close()
+        return counts
+
+    check_models(task, whisper_dir, segmenter_file_path, vad)
+    context = multiprocessing.get_context("spawn")
+    started = time.perf_counter()
+    last_report = started
+    pool = context.Pool(workers, initializer=_init_worker,
+                        initargs=(task, whisper_dir, segmenter_file_path, vad, threads_per_worker))
+    try:
+        for record in pool.imap_unordered(process_item, pending, chunksize=1):
+            record["task"] = task
+            record["model_version"] = version
+            write_record(output, record)
+            counts["processed"] += 1
+            if record["status"] != "ok":
+                counts["failed"] += 1
+                print(f"Failed {record['id']}: {record['error']}", file=sys.stderr)
+
+            now = time.perf_counter()
+            if now - last_report >= report_every or counts["processed"] == len(pending):
+                last_report = now
+                rate = counts["processed"] / (now - started)
+                eta = (len(pending) - counts["processed"]) / rate if rate else 0.0
+                print(f"[{counts['processed']}/{len(pending)}] {rate:.2f} items/s, ETA {format_duration(eta)}, "
+                      f"{counts['failed']} failed", file=sys.stderr)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        print(f"Interrupted after {counts['processed']} item(s); run again to resume", file=sys.stderr)
+        raise
+    finally:
+        pool.join()
+        output.close()
+    return counts
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe and/or segment a course archive, resumably, on all cores")
+    parser.add_argument("source", help="Directory to search, or a manifest (.jsonl of {\"path\", \"id\"} or one path per line)")
+    parser.add_argument("--task", choices=TASKS, default="transcribe",
+                        help="transcribe media, segment transcript JSON, or both for media")
+    parser.add_argument("--output", help="Results JSONL, also the checkpoint (default: backfill_<task>.jsonl)")
+    parser.add_argument("--workers", type=int, help="Worker processes, one set of ONNX sessions each (default: number of CPU cores)")
+    parser.add_argument("--threads-per-worker", type=int, default=1)
+    parser.add_argument("--whisper-dir", default="whisper_onnx")
+    parser.add_argument("--segmenter", default="segbot_segmenter.onnx")
+    parser.add_argument("--vad", action="store_true", help="Only transcribe the speech regions of each recording")
+    args = parser.parse_args()
+
+    output_path = args.output or f"backfill_{args.task.replace('+', '_')}.jsonl"
+    try:
+        counts = run_backfill(discover_items(args.source, args.task), output_path, args.task, args.workers,
+                              args.whisper_dir, args.segmenter, args.vad, args.threads_per_worker)
+    except KeyboardInterrupt:
+        sys.exit(130)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        sys.exit(2)
+    print(f"Processed {counts['processed']} item(s), {counts['failed']} failed, {counts['skipped']} skipped; "
+          f"results in {output_path}", file=sys.stderr)
+    if counts["failed"]:
+        sys.exit(1)
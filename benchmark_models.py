@@ -0,0 +1,261 @@
+# benchmark_models.py
+# Latency/throughput/memory benchmark for the SEGBOT and Whisper ONNX exports.
+# Uses randomly initialised weights and synthetic audio, so it runs without network access.
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+
+SEGBOT_MODELS = ("segbot", "segbot_segmenter")
+WHISPER_MODELS = ("whisper_encoder", "whisper_decoder")
+# Whisper-base dimensions, so a random model costs the same as the real one
+WHISPER_BASE_CONFIG = dict(d_model=512, encoder_layers=6, decoder_layers=6, encoder_attention_heads=8,
+                           decoder_attention_heads=8, encoder_ffn_dim=2048, decoder_ffn_dim=2048)
+# Lower is better for these metrics, higher is better for throughput
+REGRESSION_METRICS = {"p50_ms": "lower", "p95_ms": "lower", "peak_rss_mb": "lower",
+                      "session_load_ms": "lower", "throughput": "higher"}
+
+def export_models(work_dir, models):
+    """
+    Exports every model the benchmark needs into work_dir, skipping files already there.
+    Returns the model file paths by name.
+    """
+    paths = {
+        "segbot": os.path.join(work_dir, "segbot.onnx"),
+        "segbot_segmenter": os.path.join(work_dir, "segbot_segmenter.onnx"),
+        "whisper": os.path.join(work_dir, "whisper_onnx"),
+    }
+    if "segbot" in models and not os.path.exists(paths["segbot"]):
+        from convert_segbot_to_onnx import create_segbot_onnx
+        create_segbot_onnx(paths["segbot"])
+    if "segbot_segmenter" in models and not os.path.exists(paths["segbot_segmenter"]):
+        from convert_segbot_to_onnx import create_segbot_segmenter_onnx
+        create_segbot_segmenter_onnx(paths["segbot_segmenter"])
+    if any(model in WHISPER_MODELS for model in models) and not os.path.exists(os.path.join(paths["whisper"], "decoder_model_merged.onnx")):
+        import torch
+        from transformers import WhisperConfig, WhisperForConditionalGeneration
+        from convert_whisper_to_onnx import create_whisper_onnx
+        torch.manual_seed(0)
+        model_dir = os.path.join(work_dir, "whisper_random")
+        WhisperForConditionalGeneration(WhisperConfig(**WHISPER_BASE_CONFIG)).save_pretrained(model_dir)
+        create_whisper_onnx(model_dir, paths["whisper"])
+    return paths
+
+def _peak_rss_mb():
+    # VmHWM belongs to this process's own address space. ru_maxrss would be no good on Linux:
+    # it survives fork and exec, so a worker would report the peak of the parent that exported the models
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError: # Not Linux
+        pass
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+def _segbot_case(case, paths, options):
+    import numpy as np
+    import onnxruntime as ort
+
+    started = time.perf_counter()
+    session = ort.InferenceSession(paths[case["model"]], sess_options=options, providers=["CPUExecutionProvider"])
+    load_seconds = time.perf_counter() - started
+
+    rng = np.random.RandomState(0)
+    feeds = {
+        "input_x": rng.randn(case["batch_size"], case["sequence_length"], 128).astype(np.float32),
+        "start_units": np.array(0, dtype=np.int64),
+        "lengths": np.full(case["batch_size"], case["sequence_length"], dtype=np.int64),
+    }
+    return load_seconds, lambda: session.run(None, feeds), case["batch_size"] * case["sequence_length"]
+
+def _whisper_case(case, paths, options):
+    import numpy as np
+    import onnxruntime as ort
+    from transformers import WhisperFeatureExtractor
+    from convert_whisper_to_onnx import synthetic_clip
+
+    model_dir = paths["whisper"]
+    started = time.perf_counter()
+    encoder = ort.InferenceSession(os.path.join(model_dir, "encoder_model.onnx"), sess_options=options, providers=["CPUExecutionProvider"])
+    decoder = None
+    if case["model"] == "whisper_decoder":
+        decoder = ort.InferenceSession(os.path.join(model_dir, "decoder_model_merged.onnx"), sess_options=options, providers=["CPUExecutionProvider"])
+    load_seconds = time.perf_counter() - started
+
+    clips = [synthetic_clip(30.0)] * case["batch_size"]
+    input_features = WhisperFeatureExtractor()(clips, sampling_rate=16000, return_tensors="np").input_features.astype(np.float32)
+    if decoder is None:
+        # Throughput in seconds of audio encoded per second
+        return load_seconds, lambda: encoder.run(None, {"input_features": input_features}), case["batch_size"] * 30.0
+
+    encoder_hidden_states = encoder.run(None, {"input_features": input_features})[0]
+    past_inputs = [i for i in decoder.get_inputs() if i.name.startswith("past_key_values.")]
+    present_outputs = [i.name.replace("past_key_values.", "present.") for i in past_inputs]
+    steps = case["sequence_length"]
+
+    def decode():
+        # Greedy decoding of `steps` tokens with the key/value cache; throughput in tokens per second
+        batch_size = encoder_hidden_states.shape[0]
+        feeds = {"input_ids": np.full((batch_size, 1), 50258, dtype=np.int64), # <|startoftranscript|>
+                 "encoder_hidden_states": encoder_hidden_states, "use_cache_branch": np.array([False])}
+        for past in past_inputs:
+            feeds[past.name] = np.zeros((batch_size, past.shape[1], 0, past.shape[3]), dtype=np.float32)
+        encoder_cache = {}
+        for step in range(steps):
+            outputs = decoder.run(["logits"] + present_outputs, feeds)
+            presents = dict(zip(present_outputs, outputs[1:]))
+            if step == 0:
+                # Cross-attention keys/values are only produced by the first (no-cache) step
+                encoder_cache = {name: value for name, value in presents.items() if ".encoder." in name}
+            next_tokens = outputs[0][:, -1, :].argmax(axis=-1)[:, np.newaxis].astype(np.int64)
+            feeds = {"input_ids": next_tokens, "encoder_hidden_states": encoder_hidden_states, "use_cache_branch": np.array([True])}
+            for past, present in zip(past_inputs, present_outputs):
+                feeds[past.name] = encoder_cache[present] if ".encoder." in present else presents[present]
+
+    return load_seconds, decode, case["batch_size"] * steps
+
+def run_case(case, paths, warmup, repeats):
+    """
+    Runs one benchmark configuration. Called in a fresh process so peak RSS and session
+    load time belong to this configuration alone.
+    """
+    import numpy as np
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = case["intra_op_threads"]
+    options.inter_op_num_threads = 1
+    if case["model"] in SEGBOT_MODELS:
+        load_seconds, run, work = _segbot_case(case, paths, options)
+    else:
+        load_seconds, run, work = _whisper_case(case, paths, options)
+
+    for _ in range(warmup):
+        run()
+    latencies = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - started)
+
+    p50 = float(np.percentile(latencies, 50))
+    return dict(case,
+                session_load_ms=round(load_seconds * 1000, 2),
+                p50_ms=round(p50 * 1000, 2),
+                p95_ms=round(float(np.percentile(latencies, 95)) * 1000, 2),
+                throughput=round(work / p50, 2),
+                peak_rss_mb=_peak_rss_mb())
+
+def build_cases(models, batch_sizes, sequence_lengths, thread_counts, decode_steps):
+    cases = []
+    for model, batch_size, threads in itertools.product(models, batch_sizes, thread_counts):
+        if model in SEGBOT_MODELS:
+            lengths = sequence_lengths
+        elif model == "whisper_decoder":
+            lengths = [decode_steps]
+        else:
+            lengths = [3000] # Mel frames in one 30 s window
+        for sequence_length in lengths:
+            cases.append({"model": model, "batch_size": batch_size, "sequence_length": sequence_length, "intra_op_threads": threads})
+    return cases
+
+def run_benchmarks(cases, paths, warmup=2, repeats=10):
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for case in cases:
+        print(f"Benchmarking {case}...", file=sys.stderr)
+        with context.Pool(1) as pool:
+            results.append(pool.apply(run_case, (case, paths, warmup, repeats)))
+    return results
+
+def environment():
+    import onnxruntime as ort
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "onnxruntime": ort.__version__,
+    }
+
+def _case_key(result):
+    return (result["model"], result["batch_size"], result["sequence_length"], result["intra_op_threads"])
+
+def compare(current, baseline, tolerance=0.1):
+    """
+    Returns the regressions of `current` against `baseline` (both benchmark reports): every
+    metric of a configuration present in both that is worse by more than `tolerance`.
+    """
+    baseline_results = {_case_key(result): result for result in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        reference = baseline_results.get(_case_key(result))
+        if reference is None:
+            continue
+        for metric, better in REGRESSION_METRICS.items():
+            old, new = reference.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            if (better == "lower" and change > tolerance) or (better == "higher" and change < -tolerance):
+                regressions.append({"case": dict(zip(("model", "batch_size", "sequence_length", "intra_op_threads"), _case_key(result))),
+                                    "metric": metric, "baseline": old, "current": new, "change": round(change, 4)})
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the SEGBOT and Whisper ONNX exports")
+    parser.add_argument("--models", nargs="+", default=list(SEGBOT_MODELS + WHISPER_MODELS),
+                        choices=SEGBOT_MODELS + WHISPER_MODELS)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8])
+    parser.add_argument("--sequence-lengths", nargs="+", type=int, default=[50, 500, 2000, 10000],
+                        help="SEGBOT units per sequence")
+    parser.add_argument("--threads", nargs="+", type=int, default=[1, os.cpu_count() or 1],
+                        help="ONNX Runtime intra-op thread counts")
+    parser.add_argument("--decode-steps", type=int, default=32, help="Whisper decoder tokens per run")
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--work-dir", help="Where exported models are kept between runs (default: a temporary directory)")
+    parser.add_argument("--output", help="Write the JSON report here (default: stdout)")
+    parser.add_argument("--compare", metavar="BASELINE", help="Flag regressions against a stored report")
+    parser.add_argument("--current", metavar="REPORT", help="With --compare, compare this stored report instead of running")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed relative change before a metric counts as a regression")
+    args = parser.parse_args()
+
+    if args.current:
+        with open(args.current) as f:
+            report = json.load(f)
+    else:
+        work_dir = args.work_dir or tempfile.mkdtemp(prefix="vibe-bench-")
+        os.makedirs(work_dir, exist_ok=True)
+        paths = export_models(work_dir, args.models)
+        cases = build_cases(args.models, args.batch_sizes, args.sequence_lengths, args.threads, args.decode_steps)
+        report = {"environment": environment(), "results": run_benchmarks(cases, paths, args.warmup, args.repeats)}
+
+    if args.compare:
+        with open(args.compare) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    for regression in report.get("regressions", []):
+        print(f"REGRESSION {regression['case']} {regression['metric']}: "
+              f"{regression['baseline']} -> {regression['current']} ({regression['change']:+.1%})", file=sys.stderr)
+    if report.get("regressions"):
+        sys.exit(1)
@@ -1,9 +1,17 @@
+import argparse
+import inspect
+import os
+import sys
+from typing import Optional
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-# numpy and scipy.signal are not strictly needed for the model definition itself for ONNX export
-# import numpy as np
-# from scipy.signal import find_peaks
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+from onnx_external_data import save_external_data
+from onnx_quantization import PRECISIONS, QuantizationDriftError, check_drift, describe_quantization, quantize_model, variant_path
+# Boundary extraction from the exported attention_weights lives in segbot_boundaries.py
 
 class Encoder(nn.Module):
     def __init__(self, input_dim, hidden_dim):
@@ -11,8 +19,14 @@ class Encoder(nn.Module):
         self.hidden_dim = hidden_dim
         self.bigru = nn.GRU(input_dim, hidden_dim, bidirectional=True, batch_first=True)
 
-    def forward(self, x):
-        h, _ = self.bigru(x)
+    def forward(self, x, lengths: Optional[torch.Tensor] = None):
+        if lengths is None:
+            h, _ = self.bigru(x)
+            return h
+        # Pack so the backward direction starts at each sequence's last real unit instead of the padding
+        packed = pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+        h, _ = self.bigru(packed)
+        h, _ = pad_packed_sequence(h, batch_first=True, total_length=x.size(1))
         return h
 
 class Decoder(nn.Module):
@@ -32,12 +46,24 @@ class Pointer(nn.Module):
         self.W2 = nn.Linear(decoder_hidden_dim, decoder_hidden_dim)
         self.v = nn.Linear(decoder_hidden_dim, 1, bias=False)
 
-    def forward(self, encoder_outputs, decoder_state): # decoder_state shape: (batch_size, decoder_hidden_dim)
-        # self.W1(encoder_outputs) shape: (batch_size, seq_len, decoder_hidden_dim)
+    def project(self, encoder_outputs):
+        # Shape: (batch_size, seq_len, decoder_hidden_dim)
+        # Depends only on the encoder outputs, so a decode loop computes it once per document
+        return self.W1(encoder_outputs)
+
+    def scores_from_projection(self, encoder_projection, decoder_state): # decoder_state shape: (batch_size, decoder_hidden_dim)
         # self.W2(decoder_state) shape: (batch_size, decoder_hidden_dim)
-        # Unsqueeze and expand W2 output to allow broadcasted addition
-        expanded_decoder_state = self.W2(decoder_state).unsqueeze(1).expand_as(self.W1(encoder_outputs))
-        scores = self.v(torch.tanh(self.W1(encoder_outputs) + expanded_decoder_state))
+        # Unsqueeze W2 output to (batch_size, 1, decoder_hidden_dim) so it broadcasts over seq_len
+        return self.v(torch.tanh(encoder_projection + self.W2(decoder_state).unsqueeze(1))) # Shape: (batch_size, seq_len, 1)
+
+    def scores(self, encoder_outputs, decoder_state):
+        return self.scores_from_projection(self.project(encoder_outputs), decoder_state)
+
+    def forward(self, encoder_outputs, decoder_state, mask: Optional[torch.Tensor] = None):
+        scores = self.scores(encoder_outputs, decoder_state)
+        if mask is not None:
+            # mask shape: (batch_size, seq_len), False at padded positions so they get no attention weight
+            scores = scores.masked_fill(~mask.unsqueeze(2), float("-inf"))
         attention_weights = F.softmax(scores, dim=1) # Softmax over sequence dimension
         return attention_weights
 
@@ -48,18 +74,17 @@ class SEGBOT(nn.Module):
         self.decoder = Decoder(hidden_dim) # Decoder hidden_dim is the same as Encoder's hidden_dim (not *2)
         self.pointer = Pointer(hidden_dim * 2, hidden_dim) # encoder_hidden_dim is hidden_dim * 2
 
-    def forward(self, input_x, start_units_tensor):
-        encoder_outputs = self.encoder(input_x) # Shape: (batch_size, seq_len, hidden_dim * 2)
+    def forward(self, input_x, start_units_tensor, lengths: Optional[torch.Tensor] = None):
+        # lengths shape: (batch_size,), number of real units in each padded sequence
+        encoder_outputs = self.encoder(input_x, lengths) # Shape: (batch_size, seq_len, hidden_dim * 2)
         
         batch_size = input_x.size(0)
         # Initial decoder hidden state: (1, batch_size, decoder_hidden_dim)
         decoder_hidden = torch.zeros(1, batch_size, self.decoder.hidden_dim).to(input_x.device)
         
-        # Get start_index as Python scalar for slicing, assuming start_units_tensor is 0-D
-        # This makes start_index a constant during tracing for ONNX export, which is required for slicing.
-        start_index = start_units_tensor.item() 
+        # Gather the start unit with a tensor index so start_units stays a runtime input in the exported graph
         # Decoder input: (batch_size, 1, hidden_dim * 2)
-        decoder_inputs = encoder_outputs[:, start_index:start_index+1, :] 
+        decoder_inputs = gather_units(encoder_outputs, start_units_tensor.reshape(1).expand(batch_size))
 
         # decoder_outputs shape: (batch_size, 1, decoder_hidden_dim)
         # hidden_state shape: (1, batch_size, decoder_hidden_dim)
@@ -68,24 +93,152 @@ class SEGBOT(nn.Module):
         # Squeeze decoder_outputs to (batch_size, decoder_hidden_dim) for Pointer network
         squeezed_decoder_outputs = decoder_outputs.squeeze(1)
         
-        attention_weights = self.pointer(encoder_outputs, squeezed_decoder_outputs) # attention_weights shape: (batch_size, seq_len, 1)
+        mask = None
+        if lengths is not None:
+            mask = length_mask(lengths, encoder_outputs.size(1))
+        attention_weights = self.pointer(encoder_outputs, squeezed_decoder_outputs, mask) # attention_weights shape: (batch_size, seq_len, 1)
         return attention_weights
 
+def length_mask(lengths, seq_len: int):
+    # Returns a (batch_size, seq_len) bool mask that is True for the real units of each sequence
+    positions = torch.arange(seq_len, device=lengths.device).unsqueeze(0)
+    return positions < lengths.to(torch.long).unsqueeze(1)
+
+def gather_units(encoder_outputs, unit_indices):
+    # encoder_outputs shape: (batch_size, seq_len, features), unit_indices shape: (batch_size,)
+    # Returns the selected unit of every sequence, shape: (batch_size, 1, features)
+    index = unit_indices.reshape(-1, 1, 1).expand(encoder_outputs.size(0), 1, encoder_outputs.size(2))
+    return torch.gather(encoder_outputs, 1, index)
+
+class SEGBOTSegmenter(nn.Module):
+    """
+    Runs the full SEGBOT pointing loop (boundary -> next start -> next boundary) so a
+    whole document is segmented in one call. Scripted before export so the loop becomes
+    an ONNX Loop and the encoder runs once per document.
+    """
+    def __init__(self, segbot):
+        super(SEGBOTSegmenter, self).__init__()
+        self.encoder = segbot.encoder
+        self.decoder = segbot.decoder
+        self.pointer = segbot.pointer
+        self.decoder_hidden_dim = segbot.decoder.hidden_dim
+
+    def forward(self, input_x, start_units_tensor, lengths):
+        batch_size = input_x.size(0)
+        seq_len = input_x.size(1)
+        # End of every sequence, shape: (batch_size,). Units past the end are padding.
+        end = lengths.to(torch.long)
+
+        encoder_outputs = self.encoder(input_x, end) # Shape: (batch_size, seq_len, hidden_dim * 2)
+        decoder_hidden = torch.zeros(1, batch_size, self.decoder_hidden_dim, dtype=input_x.dtype, device=input_x.device)
+        encoder_projection = self.pointer.project(encoder_outputs) # Reused by every pointer step below
+        positions = torch.arange(seq_len, device=encoder_outputs.device).unsqueeze(0) # Shape: (1, seq_len)
+
+        # Current start unit of every sequence, shape: (batch_size,)
+        start = start_units_tensor.reshape(1).expand(batch_size).to(torch.long)
+        no_boundary = torch.full_like(start, -1)
+        boundaries = []
+
+        # Every step points at a boundary at or after the current start, so each active
+        # sequence advances by at least one unit and the loop ends after at most seq_len steps.
+        while bool((start < end).any()):
+            active = start < end
+            # Finished sequences re-read unit 0; their results are discarded below
+            current = torch.where(active, start, torch.zeros_like(start))
+
+            decoder_outputs, next_hidden = self.decoder(gather_units(encoder_outputs, current), decoder_hidden)
+            scores = self.pointer.scores_from_projection(encoder_projection, decoder_outputs.squeeze(1)).squeeze(2) # Shape: (batch_size, seq_len)
+            # A boundary can never lie before the unit the segment starts at, nor in the padding
+            outside = (positions < current.unsqueeze(1)) | (positions >= end.unsqueeze(1))
+            scores = scores.masked_fill(outside, float("-inf"))
+            boundary = torch.where(active, scores.argmax(dim=1), no_boundary)
+
+            # Finished sequences keep their state while the rest of the batch keeps decoding
+            decoder_hidden = torch.where(active.reshape(1, batch_size, 1), next_hidden, decoder_hidden)
+            start = torch.where(active, boundary + 1, start)
+            boundaries.append(boundary)
+
+        # No sequence had units left after start_units: nothing to stack
+        if len(boundaries) == 0:
+            return no_boundary.reshape(batch_size, 1)[:, :0]
+        # Shape: (batch_size, num_boundaries), padded with -1 once a sequence is fully segmented
+        return torch.stack(boundaries, dim=1)
+
+class SEGBOTEncoderStage(nn.Module):
+    """
+    First half of the staged export: encodes a document once and returns the encoder
+    outputs together with the cached pointer projection W1(encoder_outputs).
+    """
+    def __init__(self, segbot):
+        super(SEGBOTEncoderStage, self).__init__()
+        self.encoder = segbot.encoder
+        self.pointer = segbot.pointer
+
+    def forward(self, input_x, lengths):
+        encoder_outputs = self.encoder(input_x, lengths) # Shape: (batch_size, seq_len, hidden_dim * 2)
+        return encoder_outputs, self.pointer.project(encoder_outputs)
+
+class SEGBOTPointerStep(nn.Module):
+    """
+    Second half of the staged export: one decoder/pointer step that reads the cached
+    projection instead of recomputing it, so a runtime-driven decode loop stays
+    O(seq_len * hidden_dim) per boundary.
+    """
+    def __init__(self, segbot):
+        super(SEGBOTPointerStep, self).__init__()
+        self.decoder = segbot.decoder
+        self.pointer = segbot.pointer
+
+    def forward(self, encoder_outputs, encoder_projection, start_units_tensor, decoder_hidden, lengths):
+        # start_units_tensor shape: (batch_size,), decoder_hidden shape: (1, batch_size, decoder_hidden_dim)
+        decoder_outputs, next_hidden = self.decoder(gather_units(encoder_outputs, start_units_tensor), decoder_hidden)
+        scores = self.pointer.scores_from_projection(encoder_projection, decoder_outputs.squeeze(1))
+        scores = scores.masked_fill(~length_mask(lengths, encoder_outputs.size(1)).unsqueeze(2), float("-inf"))
+        attention_weights = F.softmax(scores, dim=1) # Shape: (batch_size, seq_len, 1)
+        return attention_weights, next_hidden
+
+def script_segmenter(model, example_x, example_lengths):
+    """
+    Scripts SEGBOTSegmenter for export. The GRUs are traced first because the packed
+    encoder GRU only converts to ONNX from a trace, and a traced decoder keeps its types
+    known inside the loop; the decode loop around them stays scripted.
+    """
+    segmenter = SEGBOTSegmenter(model)
+    segmenter.encoder = torch.jit.trace(model.encoder, (example_x, example_lengths))
+    batch_size = example_x.size(0)
+    example_step = torch.zeros(batch_size, 1, model.decoder.hidden_dim * 2)
+    example_hidden = torch.zeros(1, batch_size, model.decoder.hidden_dim)
+    segmenter.decoder = torch.jit.trace(model.decoder, (example_step, example_hidden))
+    return torch.jit.script(segmenter)
+
+def _export_kwargs():
+    # torch>=2.9 defaults to the dynamo exporter, which cannot export the scripted pointing loop
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        return {"dynamo": False}
+    return {}
+
+# Largest allowed |attention_weights(variant) - attention_weights(fp32)| on the fixed gate inputs
+SEGBOT_MAX_ATTENTION_DEVIATION = {"int8": 1e-3, "fp16": 1e-4}
+
 # --- Conversion part of the script ---
-def create_segbot_onnx(onnx_file_path="segbot.onnx"):
+def create_segbot_onnx(onnx_file_path="segbot.onnx", precision="fp32", model=None, opset_version=11, external_data=False):
     input_dim = 128
     hidden_dim = 256
-    model = SEGBOT(input_dim, hidden_dim)
+    if model is None:
+        model = SEGBOT(input_dim, hidden_dim)
     model.eval() # Set model to evaluation mode
+    input_dim = model.encoder.bigru.input_size
 
     # Dummy inputs matching the forward method signature (input_x, start_units_tensor)
     # batch_size=1, sequence_length=50 (arbitrary sequence length for dummy input)
     dummy_x = torch.randn(1, 50, input_dim) 
     
-    # start_units_tensor should be a 0-D tensor for .item() to work and for scalar-like input
+    # start_units_tensor is a 0-D tensor shared by every sequence in the batch
     dummy_start_units = torch.tensor(0, dtype=torch.long) 
+    # Number of real units per sequence; padded positions are masked out of the pointer softmax
+    dummy_lengths = torch.tensor([50], dtype=torch.long)
 
-    input_names = ["input_x", "start_units"]
+    input_names = ["input_x", "start_units", "lengths"]
     output_names = ["attention_weights"]
     
     # Define dynamic axes for batch_size and sequence_length
@@ -94,35 +247,442 @@ def create_segbot_onnx(onnx_file_path="segbot.onnx"):
     dynamic_axes = {
         "input_x": {0: "batch_size", 1: "sequence_length"},
         "start_units": {}, # Scalar, no dynamic axes
+        "lengths": {0: "batch_size"},
         "attention_weights": {0: "batch_size", 1: "sequence_length"}
     }
 
     print(f"Exporting SEGBOT model to {onnx_file_path}...")
     torch.onnx.export(
         model,
-        (dummy_x, dummy_start_units), # Tuple of inputs
+        (dummy_x, dummy_start_units, dummy_lengths), # Tuple of inputs
         onnx_file_path,
         export_params=True, # Store learned parameters in the ONNX file
-        opset_version=11,   # A commonly used opset version
+        opset_version=opset_version, # 11 by default, a commonly used opset version
         do_constant_folding=True, # Optimize by folding constants
         input_names=input_names,
         output_names=output_names,
         dynamic_axes=dynamic_axes,
+        **_export_kwargs(),
     )
     print(f"SEGBOT ONNX export complete. Model saved to {onnx_file_path}")
+    if external_data:
+        save_external_data(onnx_file_path)
+
+    if precision != "fp32":
+        quantize_segbot_onnx(onnx_file_path, precision)
+    return model
+
+def _save_optimized_onnx(export, optimized_file_path, opset_version):
+    # export(path, opset_version) writes the graph; ONNX Runtime saves it after its offline optimisations
+    import tempfile
+
+    import onnxruntime as ort
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        raised_file_path = os.path.join(work_dir, os.path.basename(optimized_file_path))
+        export(raised_file_path, opset_version)
+        options = ort.SessionOptions()
+        # Extended rather than all: layout optimisations are specific to the machine that runs them
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+        options.optimized_model_filepath = optimized_file_path
+        ort.InferenceSession(raised_file_path, sess_options=options, providers=["CPUExecutionProvider"])
+    print(f"Optimised graph (opset {opset_version}) saved to {optimized_file_path}")
+
+def _median_latency_ms(session, feeds, runs):
+    import time
+
+    import numpy as np
+
+    session.run(None, feeds) # Warm-up
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        session.run(None, feeds)
+        timings.append(time.perf_counter() - started)
+    return round(float(np.median(timings)) * 1000, 2)
+
+def _op_counts(onnx_file_path):
+    # Op types of the graph including its Loop/If bodies, where the segmenter's decode step lives
+    from collections import Counter
+
+    import onnx
+
+    counts = Counter()
+    graphs = [onnx.load(onnx_file_path, load_external_data=False).graph]
+    while graphs:
+        graph = graphs.pop()
+        for node in graph.node:
+            counts[node.op_type] += 1
+            graphs.extend(attribute.g for attribute in node.attribute if attribute.type == onnx.AttributeProto.GRAPH)
+    return counts
+
+def _report_optimization(report, onnx_file_path, optimized_file_path, sequence_lengths, deviation_label):
+    # Fills in and prints the op counts of both graphs next to the per-length latencies and parity
+    before_ops = _op_counts(onnx_file_path)
+    after_ops = _op_counts(optimized_file_path)
+    report["op_counts"] = {"before": dict(before_ops), "after": dict(after_ops)}
+
+    print(f"{'op':<24}{'before':>8}{'after':>8}")
+    for op_type in sorted(set(before_ops) | set(after_ops)):
+        print(f"{op_type:<24}{before_ops[op_type]:>8}{after_ops[op_type]:>8}")
+    print(f"{'total':<24}{sum(before_ops.values()):>8}{sum(after_ops.values()):>8}")
+    for sequence_length in sequence_lengths:
+        latencies = report["latency_ms"][sequence_length]
+        print(f"seq_len={sequence_length}: {latencies['before']} ms -> {latencies['after']} ms, "
+              f"{deviation_label} {report['parity'][sequence_length]:.3g}")
+    return report
+
+def optimize_segbot_onnx(model, onnx_file_path="segbot.onnx", optimized_file_path="segbot.optimized.onnx",
+                         opset_version=17, sequence_lengths=(50, 500, 2000), atol=1e-5, runs=5):
+    """
+    Post-export optimisation of segbot.onnx. Re-exports `model` at a newer opset, applies
+    ONNX Runtime's offline graph optimisations (mostly folding the shape and constant
+    subgraphs around the GRUs) and saves the result to optimized_file_path.
+
+    The optimised graph must match the PyTorch model within atol on random inputs at every
+    length in sequence_lengths, otherwise RuntimeError is raised and the file is removed.
+    Op counts and p50 latency of onnx_file_path versus the optimised graph are printed and
+    returned.
+    """
+    import numpy as np
+    import onnxruntime as ort
+
+    _save_optimized_onnx(lambda path, opset: create_segbot_onnx(path, model=model, opset_version=opset),
+                         optimized_file_path, opset_version)
+    baseline = ort.InferenceSession(onnx_file_path, providers=["CPUExecutionProvider"])
+    optimized = ort.InferenceSession(optimized_file_path, providers=["CPUExecutionProvider"])
+    input_dim = model.encoder.bigru.input_size
+    rng = np.random.RandomState(0)
+    report = {"parity": {}, "latency_ms": {}, "op_counts": {}}
+
+    for sequence_length in sequence_lengths:
+        input_x = rng.randn(2, sequence_length, input_dim).astype(np.float32)
+        lengths = np.array([sequence_length, max(sequence_length // 2, 1)], dtype=np.int64)
+        start_units = np.array(0, dtype=np.int64)
+        feeds = {"input_x": input_x, "start_units": start_units, "lengths": lengths}
+        with torch.no_grad():
+            expected = model(torch.from_numpy(input_x), torch.from_numpy(start_units), torch.from_numpy(lengths)).numpy()
+        deviation = float(np.abs(optimized.run(["attention_weights"], feeds)[0] - expected).max())
+        report["parity"][sequence_length] = deviation
+        if deviation > atol:
+            os.remove(optimized_file_path)
+            raise RuntimeError(f"Optimised SEGBOT graph deviates from PyTorch by {deviation:.3g} at sequence length {sequence_length}")
+        report["latency_ms"][sequence_length] = {"before": _median_latency_ms(baseline, feeds, runs),
+                                                 "after": _median_latency_ms(optimized, feeds, runs)}
+    return _report_optimization(report, onnx_file_path, optimized_file_path, sequence_lengths, "max deviation from PyTorch")
+
+def optimize_segbot_segmenter_onnx(model, onnx_file_path="segbot_segmenter.onnx",
+                                   optimized_file_path="segbot_segmenter.optimized.onnx", opset_version=17,
+                                   sequence_lengths=(50, 500, 2000), runs=5):
+    """
+    The same optimisation for segbot_segmenter.onnx, the graph SegbotBatchSegmenter and the
+    runtimes load. Its boundaries must equal those of the PyTorch SEGBOTSegmenter exactly at
+    every length in sequence_lengths, otherwise RuntimeError is raised and the file is
+    removed. Point the runtimes' --segmenter option at optimized_file_path to use it.
+    """
+    import numpy as np
+    import onnxruntime as ort
+
+    _save_optimized_onnx(lambda path, opset: create_segbot_segmenter_onnx(path, model=model, opset_version=opset),
+                         optimized_file_path, opset_version)
+    baseline = ort.InferenceSession(onnx_file_path, providers=["CPUExecutionProvider"])
+    optimized = ort.InferenceSession(optimized_file_path, providers=["CPUExecutionProvider"])
+    segmenter = SEGBOTSegmenter(model).eval()
+    input_dim = model.encoder.bigru.input_size
+    rng = np.random.RandomState(0)
+    report = {"parity": {}, "latency_ms": {}, "op_counts": {}}
+
+    for sequence_length in sequence_lengths:
+        input_x = rng.randn(2, sequence_length, input_dim).astype(np.float32)
+        lengths = np.array([sequence_length, max(sequence_length // 2, 1)], dtype=np.int64)
+        start_units = np.array(0, dtype=np.int64)
+        feeds = {"input_x": input_x, "start_units": start_units, "lengths": lengths}
+        with torch.no_grad():
+            expected = segmenter(torch.from_numpy(input_x), torch.from_numpy(start_units), torch.from_numpy(lengths)).numpy()
+        actual = optimized.run(["boundaries"], feeds)[0]
+        mismatches = int((actual != expected).sum()) if actual.shape == expected.shape else max(actual.size, expected.size)
+        report["parity"][sequence_length] = mismatches
+        if mismatches:
+            os.remove(optimized_file_path)
+            raise RuntimeError(f"Optimised SEGBOT segmenter differs from PyTorch in {mismatches} boundaries at sequence length {sequence_length}")
+        report["latency_ms"][sequence_length] = {"before": _median_latency_ms(baseline, feeds, runs),
+                                                 "after": _median_latency_ms(optimized, feeds, runs)}
+    return _report_optimization(report, onnx_file_path, optimized_file_path, sequence_lengths, "boundaries differing from PyTorch")
+
+def quantize_segbot_onnx(onnx_file_path="segbot.onnx", precision="int8", max_deviation=None):
+    """
+    Writes the INT8/FP16 variant of an exported segbot.onnx next to it, then gates it on
+    the largest attention-weight deviation from the FP32 model over fixed, seeded inputs.
+    The variant is deleted and QuantizationDriftError raised if the deviation is too large.
+
+    INT8 quantizes the pointer's MatMuls dynamically and stores the GRU weights as INT8,
+    but ONNX Runtime has no integer GRU kernel, so both GRUs still compute in FP32; what
+    was quantized and the size ratio are printed.
+    """
+    import numpy as np
+    import onnxruntime as ort
+
+    if max_deviation is None:
+        max_deviation = SEGBOT_MAX_ATTENTION_DEVIATION[precision]
+    output_path = variant_path(onnx_file_path, precision)
+
+    print(f"Writing {precision.upper()} SEGBOT variant to {output_path}...")
+    quantize_model(onnx_file_path, output_path, precision)
+    if precision == "int8":
+        describe_quantization(onnx_file_path, output_path)
+
+    reference = ort.InferenceSession(onnx_file_path, providers=["CPUExecutionProvider"])
+    variant = ort.InferenceSession(output_path, providers=["CPUExecutionProvider"])
+    input_dim = reference.get_inputs()[0].shape[2]
+    rng = np.random.RandomState(0)
+    feeds = {
+        "input_x": rng.randn(2, 200, input_dim).astype(np.float32),
+        "start_units": np.array(0, dtype=np.int64),
+        "lengths": np.array([200, 120], dtype=np.int64),
+    }
+    expected = reference.run(["attention_weights"], feeds)[0]
+    actual = variant.run(["attention_weights"], feeds)[0]
+
+    print(f"Checking {precision.upper()} SEGBOT variant against FP32...")
+    try:
+        check_drift("max attention-weight deviation", float(np.abs(actual - expected).max()), max_deviation)
+    except QuantizationDriftError:
+        os.remove(output_path)
+        raise
+    print(f"SEGBOT {precision.upper()} variant saved to {output_path}")
+    return output_path
+
+def create_segbot_segmenter_onnx(onnx_file_path="segbot_segmenter.onnx", model=None, opset_version=11, external_data=False):
+    """
+    Exports the full autoregressive segmenter: start_units is a runtime input and every
+    boundary of the document comes back from a single inference call. Pass the `model`
+    returned by create_segbot_onnx() so both graphs carry the same weights.
+    """
+    input_dim = 128
+    hidden_dim = 256
+    if model is None:
+        model = SEGBOT(input_dim, hidden_dim)
+    model.eval()
+    input_dim = model.encoder.bigru.input_size
+
+    # Two sequences of different lengths so the trace keeps the padding-aware path
+    dummy_x = torch.randn(2, 50, input_dim)
+    dummy_start_units = torch.tensor(0, dtype=torch.long)
+    dummy_lengths = torch.tensor([50, 30], dtype=torch.long)
+    segmenter = script_segmenter(model, dummy_x, dummy_lengths)
+
+    input_names = ["input_x", "start_units", "lengths"]
+    output_names = ["boundaries"]
+    dynamic_axes = {
+        "input_x": {0: "batch_size", 1: "sequence_length"},
+        "start_units": {},
+        "lengths": {0: "batch_size"},
+        "boundaries": {0: "batch_size", 1: "num_boundaries"}
+    }
+
+    print(f"Exporting SEGBOT segmenter to {onnx_file_path}...")
+    torch.onnx.export(
+        segmenter,
+        (dummy_x, dummy_start_units, dummy_lengths),
+        onnx_file_path,
+        export_params=True,
+        opset_version=opset_version, # Sequence ops used to collect the boundaries need opset 11 or later
+        do_constant_folding=True,
+        input_names=input_names,
+        output_names=output_names,
+        dynamic_axes=dynamic_axes,
+        **_export_kwargs(),
+    )
+    print(f"SEGBOT segmenter ONNX export complete. Model saved to {onnx_file_path}")
+    if external_data:
+        save_external_data(onnx_file_path)
+    return model
+
+def create_segbot_stages_onnx(encoder_file_path="segbot_encoder.onnx", step_file_path="segbot_step.onnx", model=None,
+                              external_data=False):
+    """
+    Exports SEGBOT as an encoder graph and a single-step pointer graph. The encoder graph
+    exposes the cached W1 projection so runtimes that drive their own decode loop can
+    feed it back into every step. Pass the same `model` as to create_segbot_segmenter_onnx()
+    so streaming and one-shot segmentation agree.
+    """
+    input_dim = 128
+    hidden_dim = 256
+    if model is None:
+        model = SEGBOT(input_dim, hidden_dim)
+    model.eval()
+    input_dim = model.encoder.bigru.input_size
+    hidden_dim = model.decoder.hidden_dim
+
+    dummy_x = torch.randn(2, 50, input_dim)
+    dummy_lengths = torch.tensor([50, 30], dtype=torch.long)
+
+    print(f"Exporting SEGBOT encoder stage to {encoder_file_path}...")
+    torch.onnx.export(
+        SEGBOTEncoderStage(model),
+        (dummy_x, dummy_lengths),
+        encoder_file_path,
+        export_params=True,
+        opset_version=11,
+        do_constant_folding=True,
+        input_names=["input_x", "lengths"],
+        output_names=["encoder_outputs", "encoder_projection"],
+        dynamic_axes={
+            "input_x": {0: "batch_size", 1: "sequence_length"},
+            "lengths": {0: "batch_size"},
+            "encoder_outputs": {0: "batch_size", 1: "sequence_length"},
+            "encoder_projection": {0: "batch_size", 1: "sequence_length"}
+        },
+        **_export_kwargs(),
+    )
+
+    with torch.no_grad():
+        dummy_encoder_outputs, dummy_projection = SEGBOTEncoderStage(model)(dummy_x, dummy_lengths)
+    dummy_start_units = torch.zeros(2, dtype=torch.long)
+    dummy_hidden = torch.zeros(1, 2, hidden_dim)
+
+    print(f"Exporting SEGBOT pointer step to {step_file_path}...")
+    torch.onnx.export(
+        SEGBOTPointerStep(model),
+        (dummy_encoder_outputs, dummy_projection, dummy_start_units, dummy_hidden, dummy_lengths),
+        step_file_path,
+        export_params=True,
+        opset_version=11,
+        do_constant_folding=True,
+        input_names=["encoder_outputs", "encoder_projection", "start_units", "decoder_hidden", "lengths"],
+        output_names=["attention_weights", "next_decoder_hidden"],
+        dynamic_axes={
+            "encoder_outputs": {0: "batch_size", 1: "sequence_length"},
+            "encoder_projection": {0: "batch_size", 1: "sequence_length"},
+            "start_units": {0: "batch_size"},
+            "decoder_hidden": {1: "batch_size"},
+            "lengths": {0: "batch_size"},
+            "attention_weights": {0: "batch_size", 1: "sequence_length"},
+            "next_decoder_hidden": {1: "batch_size"}
+        },
+        **_export_kwargs(),
+    )
+    print(f"SEGBOT staged ONNX export complete. Models saved to {encoder_file_path} and {step_file_path}")
+    if external_data:
+        save_external_data(encoder_file_path)
+        save_external_data(step_file_path)
+    return model
+
+# Exporter scopes of the SEGBOT submodules; everything else (masking, gathers) is glue. The
+# scripted segmenter calls the pointer's layers directly, so they appear as /W1, /W2 and /v
+SEGBOT_MODULE_RULES = ((r"/encoder(/|$)", "Encoder"), (r"/decoder(/|$)", "Decoder"), (r"/pointer(/|$)", "Pointer"),
+                       (r"(?=/(W1|W2|v)(/|$))", "Pointer"))
+
+def profile_segbot_onnx(onnx_file_path="segbot.onnx", features=None, batch_size=1, sequence_length=500, runs=5,
+                        trace_path="segbot_profile.json"):
+    """
+    Profiles segbot.onnx or segbot_segmenter.onnx per operator with ONNX Runtime and
+    attributes every kernel to the Encoder, Decoder or Pointer module it was exported from.
+
+    features is a list of (seq_len, 128) unit-feature arrays to segment; without it,
+    batch_size random sequences of sequence_length units are used. Prints the summary
+    table, writes a Chrome trace to trace_path and returns the summary.
+    """
+    import numpy as np
+    from onnx_profiling import aggregate_profile, print_profile_summary, profile_session, write_chrome_trace
+    from segbot_inference import pad_batch
+
+    if features is None:
+        rng = np.random.RandomState(0)
+        features = [rng.randn(sequence_length, 128).astype(np.float32) for _ in range(batch_size)]
+    input_x, lengths = pad_batch(features)
+    feeds = {"input_x": input_x, "start_units": np.array(0, dtype=np.int64), "lengths": lengths}
+
+    print(f"Profiling {onnx_file_path} on input_x of shape {input_x.shape}...")
+    events, scopes = profile_session(onnx_file_path, lambda session: session.run(None, feeds), runs=runs)
+    summary = aggregate_profile([(events, scopes, SEGBOT_MODULE_RULES, "Other")], runs)
+    print_profile_summary(summary)
+    write_chrome_trace(trace_path, {os.path.basename(onnx_file_path): events})
+    return summary
+
+def load_profile_features(path):
+    """
+    Reads the profiling input: a .npy array of unit features, or a transcript JSON that is
+    featurized with segbot_features.py.
+    """
+    import numpy as np
+    if path.endswith(".npy"):
+        return [np.load(path)]
+    from segbot_features import featurize_transcript
+    return [featurize_transcript(path)]
+
+def compare_pointer_cache_latency(seq_len=5000, steps=20, input_dim=128, hidden_dim=256):
+    """
+    Times `steps` pointer steps over one seq_len-unit document, recomputing the W1
+    projection per step (before) versus reusing the cached projection (after).
+    """
+    import time
+
+    model = SEGBOT(input_dim, hidden_dim)
+    model.eval()
+    with torch.no_grad():
+        encoder_outputs = model.encoder(torch.randn(1, seq_len, input_dim))
+        decoder_states = torch.randn(steps, 1, hidden_dim)
+
+        start = time.perf_counter()
+        for step in range(steps):
+            model.pointer.scores(encoder_outputs, decoder_states[step])
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        encoder_projection = model.pointer.project(encoder_outputs)
+        for step in range(steps):
+            model.pointer.scores_from_projection(encoder_projection, decoder_states[step])
+        after = time.perf_counter() - start
+
+    print(f"Pointer latency over {steps} steps at seq_len={seq_len}: "
+          f"{before * 1000:.1f} ms recomputed, {after * 1000:.1f} ms cached ({before / after:.2f}x)")
+    return before, after
 
 if __name__ == "__main__":
     # This part is for making the script runnable
     # It requires torch to be installed in the environment where it's run.
+    parser = argparse.ArgumentParser(description="Export SEGBOT to ONNX")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32",
+                        help="Also write a quantized segbot.onnx variant and check it against FP32")
+    parser.add_argument("--optimize", action="store_true",
+                        help="Also write segbot.optimized.onnx and segbot_segmenter.optimized.onnx "
+                             "(newer opset, ONNX Runtime graph optimisations)")
+    parser.add_argument("--external-data", action="store_true",
+                        help="Store weights in page-aligned .onnx_data files that worker processes share")
+    parser.add_argument("--profile", nargs="?", const="", metavar="INPUT",
+                        help="Only profile the existing segbot.onnx and segbot_segmenter.onnx per operator, "
+                             "optionally on a .npy feature array or transcript JSON")
+    args = parser.parse_args()
+    if args.profile is not None:
+        features = load_profile_features(args.profile) if args.profile else None
+        profile_segbot_onnx("segbot.onnx", features)
+        profile_segbot_onnx("segbot_segmenter.onnx", features, trace_path="segbot_segmenter_profile.json")
+        sys.exit(0)
     try:
         # Re-importing torch, nn, F here is not strictly necessary as they are imported at the top.
         # However, it's kept as per the prompt's structure.
         import torch
         import torch.nn as nn
         import torch.nn.functional as F
-        create_segbot_onnx()
+        if args.optimize:
+            # The optimisation reports compare against the PyTorch model, so export from it directly
+            model = create_segbot_onnx(precision=args.precision, external_data=args.external_data)
+            optimize_segbot_onnx(model)
+            create_segbot_segmenter_onnx(model=model, external_data=args.external_data)
+            optimize_segbot_segmenter_onnx(model)
+            create_segbot_stages_onnx(model=model, external_data=args.external_data)
+        else:
+            # Cached exports, rebuilt only when the model code, options or libraries change
+            from onnx_export_cache import SEGBOT_TARGETS, export_segbot
+            for target in SEGBOT_TARGETS:
+                export_segbot(target, precision=args.precision if target == "segbot" else "fp32",
+                              external_data=args.external_data)
     except ImportError:
         print("PyTorch is not installed. This script requires PyTorch to run.")
         print("Please install PyTorch and try again.")
+    except QuantizationDriftError as e:
+        print(f"Quantized SEGBOT export rejected: {e}")
+        sys.exit(1)
     except Exception as e:
         print(f"An error occurred during SEGBOT ONNX conversion: {e}")
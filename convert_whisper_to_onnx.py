@@ -1,8 +1,28 @@
 # convert_whisper_to_onnx.py
+import argparse
+import json
+import os
+import shutil
+import sys
 
-def create_whisper_onnx():
+from onnx_external_data import save_external_data
+from onnx_quantization import PRECISIONS, QuantizationDriftError, check_drift, quantize_model
+
+SAMPLING_RATE = 16000
+
+# Gates for quantized variants, measured on synthetic_clip() against the FP32 export:
+# word error rate of the greedy transcript, and the largest logit difference relative
+# to the largest FP32 logit over the teacher-forced FP32 transcript.
+WHISPER_MAX_WER = {"int8": 0.2, "fp16": 0.1}
+WHISPER_MAX_LOGIT_DRIFT = {"int8": 0.1, "fp16": 0.01}
+
+def create_whisper_onnx(model_name="openai/whisper-base", output_dir="whisper_onnx", precision="fp32", external_data=False):
     """
     Converts the openai/whisper-base model to ONNX format using Hugging Face Optimum.
+    With precision "int8" or "fp16" a quantized copy is also written to
+    f"{output_dir}_{precision}" and checked against the FP32 export.
+    With external_data the weights of every exported model move to page-aligned
+    .onnx_data files, so worker processes share them.
     """
     try:
         from optimum.exporters.onnx import main_export
@@ -11,9 +31,9 @@ def create_whisper_onnx():
         print("pip install optimum[exporters]")
         return
 
-    model_name = "openai/whisper-base"
-    output_dir = "whisper_onnx" # Directory to save the ONNX model files
-    task = "automatic-speech-recognition"
+    # The -with-past task also exports the decoder that takes the key/value cache; Optimum's
+    # post-processing merges both decoders into decoder_model_merged.onnx (used by whisper_transcribe.py)
+    task = "automatic-speech-recognition-with-past"
 
     print(f"Starting ONNX export for model: {model_name}...")
     print(f"Output directory: {output_dir}")
@@ -24,7 +44,7 @@ def create_whisper_onnx():
             model_name_or_path=model_name,
             output=output_dir,
             task=task,
-            no_post_process=False, # Default, but explicit for clarity
+            no_post_process=False, # Post-processing merges the decoders, keep it on
             trust_remote_code=False # Default, but explicit for security
             # Other parameters can be added if needed, e.g., opset, device
         )
@@ -34,6 +54,285 @@ def create_whisper_onnx():
         # For more detailed debugging, one might add:
         # import traceback
         # print(traceback.format_exc())
+        return
+
+    if external_data:
+        for file_name in sorted(os.listdir(output_dir)):
+            if file_name.endswith(".onnx"):
+                save_external_data(os.path.join(output_dir, file_name))
+    if precision != "fp32":
+        quantize_whisper_onnx(output_dir, precision)
+
+def synthetic_clip(seconds=8.0, sampling_rate=SAMPLING_RATE):
+    """
+    Deterministic speech-like test clip: harmonic "vowels" with a syllable-rate envelope
+    over low-level noise. Generated rather than shipped as audio so the gate needs no
+    download and always sees identical input.
+    """
+    import numpy as np
+
+    t = np.arange(int(seconds * sampling_rate)) / sampling_rate
+    pitch = 140.0 + 30.0 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sampling_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4.0 * t), 0.0, None) ** 2
+    noise = np.random.RandomState(0).randn(t.size) * 0.01
+    return (0.3 * voiced * envelope + noise).astype(np.float32)
+
+def _error_rate(reference, hypothesis):
+    # Levenshtein distance between two word (or token) lists, divided by the reference length
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_word in enumerate(hypothesis, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ref_word != hyp_word)))
+        previous = current
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    return previous[-1] / len(reference)
+
+def _decoder_logits(decoder_session, tokens, encoder_hidden_states):
+    import numpy as np
+    return decoder_session.run(["logits"], {
+        "input_ids": np.array([tokens], dtype=np.int64),
+        "encoder_hidden_states": encoder_hidden_states,
+    })[0][0]
+
+def _greedy_decode(decoder_session, encoder_hidden_states, prefix, eos_token_id, max_new_tokens=32):
+    tokens = list(prefix)
+    for _ in range(max_new_tokens):
+        next_token = int(_decoder_logits(decoder_session, tokens, encoder_hidden_states)[-1].argmax())
+        tokens.append(next_token)
+        if next_token == eos_token_id:
+            break
+    return tokens
+
+def _merged_greedy_decode(decoder_session, encoder_hidden_states, prefix, eos_token_id, max_new_tokens=32):
+    # The merged decoder always runs max_new_tokens cached steps; the transcript ends at the first EOS
+    tokens = list(prefix)
+    for logits in _decode_steps(decoder_session, encoder_hidden_states, prefix, max_new_tokens):
+        tokens.append(int(logits[0].argmax()))
+        if tokens[-1] == eos_token_id:
+            break
+    return tokens
+
+def _transcribe_for_gate(model_dir, input_features, prefix, eos_token_id):
+    """
+    Greedy transcripts of the gate clip with decoder_model.onnx and, when exported, with
+    decoder_model_merged.onnx and its key/value cache, the decoder the runtimes load.
+    Returns {"encoder_hidden_states", "decoder", "tokens", "merged_decoder", "merged_tokens"}.
+    """
+    import onnxruntime as ort
+    encoder = ort.InferenceSession(os.path.join(model_dir, "encoder_model.onnx"), providers=["CPUExecutionProvider"])
+    decoder = ort.InferenceSession(os.path.join(model_dir, "decoder_model.onnx"), providers=["CPUExecutionProvider"])
+    encoder_hidden_states = encoder.run(["last_hidden_state"], {"input_features": input_features})[0]
+    result = {"encoder_hidden_states": encoder_hidden_states, "decoder": decoder,
+              "tokens": _greedy_decode(decoder, encoder_hidden_states, prefix, eos_token_id),
+              "merged_decoder": None, "merged_tokens": None}
+    merged_file_path = os.path.join(model_dir, "decoder_model_merged.onnx")
+    if os.path.exists(merged_file_path):
+        result["merged_decoder"] = ort.InferenceSession(merged_file_path, providers=["CPUExecutionProvider"])
+        result["merged_tokens"] = _merged_greedy_decode(result["merged_decoder"], encoder_hidden_states, prefix, eos_token_id)
+    return result
+
+def _merge_fp16_decoders(variant_dir):
+    """
+    Builds the FP16 decoder_model_merged.onnx from the converted decoder_model.onnx and
+    decoder_with_past_model.onnx, the way Optimum merged the FP32 pair. Converting the
+    merged graph itself yields a model ONNX Runtime rejects, because the FP16 converter
+    mis-wires the values that cross into and out of its If branches.
+    """
+    import onnx
+    from optimum.onnx import merge_decoders
+
+    halves = []
+    for file_name in ("decoder_model.onnx", "decoder_with_past_model.onnx"):
+        model = onnx.load(os.path.join(variant_dir, file_name))
+        # The converter appends the Casts of the FP32 inputs after their consumers, which a branch must not have
+        casts, others = [], []
+        for node in model.graph.node:
+            (casts if any(name.startswith("graph_input_cast") for name in node.output) else others).append(node)
+        del model.graph.node[:]
+        model.graph.node.extend(casts + others)
+        halves.append(model)
+    # Not strict: the cached decoder does not output the encoder key/values again
+    merge_decoders(halves[0], halves[1], save_path=os.path.join(variant_dir, "decoder_model_merged.onnx"), strict=False)
+
+def quantize_whisper_onnx(output_dir="whisper_onnx", precision="int8", max_wer=None, max_logit_drift=None):
+    """
+    Writes an INT8/FP16 copy of every ONNX file in output_dir to f"{output_dir}_{precision}"
+    (configs and tokenizer files are copied as-is), then gates it against the FP32 export
+    on synthetic_clip(): WER of the greedy transcript and relative logit drift, for
+    decoder_model.onnx and for the KV-cache decoder_model_merged.onnx the runtimes load.
+    The variant directory is deleted and QuantizationDriftError raised if any is too large.
+    """
+    import numpy as np
+    from transformers import AutoTokenizer, WhisperFeatureExtractor
+
+    if max_wer is None:
+        max_wer = WHISPER_MAX_WER[precision]
+    if max_logit_drift is None:
+        max_logit_drift = WHISPER_MAX_LOGIT_DRIFT[precision]
+    variant_dir = f"{output_dir}_{precision}"
+    os.makedirs(variant_dir, exist_ok=True)
+
+    print(f"Writing {precision.upper()} Whisper variant to {variant_dir}...")
+    merge_fp16 = precision == "fp16" and os.path.exists(os.path.join(output_dir, "decoder_model_merged.onnx"))
+    for file_name in sorted(os.listdir(output_dir)):
+        source = os.path.join(output_dir, file_name)
+        if merge_fp16 and file_name == "decoder_model_merged.onnx":
+            continue
+        if file_name.endswith(".onnx"):
+            quantize_model(source, os.path.join(variant_dir, file_name), precision)
+        elif os.path.isfile(source) and not file_name.endswith(".onnx_data"):
+            shutil.copy2(source, os.path.join(variant_dir, file_name))
+    if merge_fp16:
+        _merge_fp16_decoders(variant_dir)
+
+    with open(os.path.join(output_dir, "config.json")) as f:
+        config = json.load(f)
+    prefix = [config["decoder_start_token_id"]]
+    eos_token_id = config["eos_token_id"]
+    feature_extractor = WhisperFeatureExtractor.from_pretrained(output_dir)
+    input_features = feature_extractor(synthetic_clip(), sampling_rate=SAMPLING_RATE, return_tensors="np").input_features
+
+    reference = _transcribe_for_gate(output_dir, input_features, prefix, eos_token_id)
+    try:
+        variant = _transcribe_for_gate(variant_dir, input_features, prefix, eos_token_id)
+    except Exception as e:
+        shutil.rmtree(variant_dir)
+        raise QuantizationDriftError(f"{precision.upper()} Whisper variant cannot be run: {e}") from e
+
+    # Compare words when a tokenizer was exported alongside the model, otherwise raw tokens
+    tokenizer = None
+    if os.path.exists(os.path.join(output_dir, "tokenizer_config.json")):
+        tokenizer = AutoTokenizer.from_pretrained(output_dir)
+
+    def words(tokens):
+        if tokenizer is None:
+            return tokens[len(prefix):]
+        return tokenizer.decode(tokens, skip_special_tokens=True).split()
+
+    def relative_drift(actual, expected):
+        return float(np.abs(actual - expected).max() / np.abs(expected).max())
+
+    # Teacher-force both decoders with the FP32 transcript so the logits line up position by position
+    checks = [
+        ("WER on synthetic clip", _error_rate(words(reference["tokens"]), words(variant["tokens"])), max_wer),
+        ("relative logit drift", relative_drift(_decoder_logits(variant["decoder"], reference["tokens"], variant["encoder_hidden_states"]),
+                                                _decoder_logits(reference["decoder"], reference["tokens"], reference["encoder_hidden_states"])),
+         max_logit_drift),
+    ]
+    if reference["merged_decoder"] is not None:
+        forced = reference["merged_tokens"][len(prefix):]
+        expected = np.stack(list(_decode_steps(reference["merged_decoder"], reference["encoder_hidden_states"], prefix, len(forced), forced)))
+        actual = np.stack(list(_decode_steps(variant["merged_decoder"], variant["encoder_hidden_states"], prefix, len(forced), forced)))
+        checks += [
+            ("WER on synthetic clip (merged decoder)", _error_rate(words(reference["merged_tokens"]), words(variant["merged_tokens"])), max_wer),
+            ("relative logit drift (merged decoder)", relative_drift(actual, expected), max_logit_drift),
+        ]
+
+    print(f"Checking {precision.upper()} Whisper variant against FP32...")
+    try:
+        for name, value, limit in checks:
+            check_drift(name, value, limit)
+    except QuantizationDriftError:
+        shutil.rmtree(variant_dir)
+        raise
+    print(f"Whisper {precision.upper()} variant saved in {variant_dir}")
+    return variant_dir
+
+# Exporter scopes inside the merged decoder's branches, which Optimum wraps in /model/decoder
+WHISPER_DECODER_RULES = ((r"/model/decoder(/|$)", "Decoder"), (r"(?=/proj_out(/|$))", "Decoder"))
+
+def _decode_steps(decoder_session, encoder_hidden_states, prefix, steps, forced_tokens=None):
+    # Greedy decoding with decoder_model_merged.onnx and its key/value cache, as whisper_transcribe.py runs it.
+    # Always `steps` tokens so every profiled run does the same work. Yields the (batch, vocab) logits of
+    # every step; with forced_tokens those are fed back instead of the greedy choice (teacher forcing).
+    import numpy as np
+    past_inputs = [i for i in decoder_session.get_inputs() if i.name.startswith("past_key_values.")]
+    present_outputs = [i.name.replace("past_key_values.", "present.") for i in past_inputs]
+    batch_size = encoder_hidden_states.shape[0]
+    feeds = {"input_ids": np.tile(np.array(prefix, dtype=np.int64), (batch_size, 1)),
+             "encoder_hidden_states": encoder_hidden_states, "use_cache_branch": np.array([False])}
+    for past in past_inputs:
+        feeds[past.name] = np.zeros((batch_size, past.shape[1], 0, past.shape[3]), dtype=np.float32)
+    encoder_cache = {}
+    for step in range(steps):
+        outputs = decoder_session.run(["logits"] + present_outputs, feeds)
+        presents = dict(zip(present_outputs, outputs[1:]))
+        if step == 0:
+            encoder_cache = {name: value for name, value in presents.items() if ".encoder." in name}
+        yield outputs[0][:, -1, :]
+        if forced_tokens is not None:
+            next_tokens = np.full((batch_size, 1), forced_tokens[step], dtype=np.int64)
+        else:
+            next_tokens = outputs[0][:, -1, :].argmax(axis=-1)[:, np.newaxis].astype(np.int64)
+        feeds = {"input_ids": next_tokens, "encoder_hidden_states": encoder_hidden_states, "use_cache_branch": np.array([True])}
+        for past, present in zip(past_inputs, present_outputs):
+            feeds[past.name] = encoder_cache[present] if ".encoder." in present else presents[present]
+
+def profile_whisper_onnx(output_dir="whisper_onnx", audio=None, decode_steps=32, runs=3, trace_path="whisper_profile.json"):
+    """
+    Profiles the Whisper export per operator with ONNX Runtime: one encoder pass over a 30 s
+    window of `audio` (mono 16 kHz samples, synthetic_clip() by default) and decode_steps
+    greedy decoder steps with the key/value cache. Kernels are attributed to the encoder or
+    decoder and to their layers' submodules (self_attn, encoder_attn, fc1, ...).
+    Prints the summary table, writes a Chrome trace to trace_path and returns the summary.
+    """
+    import numpy as np
+    import onnxruntime as ort
+    from transformers import WhisperFeatureExtractor
+    from onnx_profiling import aggregate_profile, print_profile_summary, profile_session, write_chrome_trace
+
+    if audio is None:
+        audio = synthetic_clip()
+    with open(os.path.join(output_dir, "config.json")) as f:
+        config = json.load(f)
+    feature_extractor = WhisperFeatureExtractor.from_pretrained(output_dir)
+    input_features = feature_extractor(audio[:30 * SAMPLING_RATE], sampling_rate=SAMPLING_RATE, return_tensors="np").input_features.astype(np.float32)
+    encoder_file_path = os.path.join(output_dir, "encoder_model.onnx")
+    decoder_file_path = os.path.join(output_dir, "decoder_model_merged.onnx")
+
+    print(f"Profiling {encoder_file_path}...")
+    encoder_events, encoder_scopes = profile_session(
+        encoder_file_path, lambda session: session.run(["last_hidden_state"], {"input_features": input_features}), runs=runs)
+    encoder_hidden_states = ort.InferenceSession(encoder_file_path, providers=["CPUExecutionProvider"]).run(
+        ["last_hidden_state"], {"input_features": input_features})[0]
+    print(f"Profiling {decoder_file_path} over {decode_steps} decoding steps...")
+    prefix = [config["decoder_start_token_id"]]
+    decoder_events, decoder_scopes = profile_session(
+        decoder_file_path, lambda session: list(_decode_steps(session, encoder_hidden_states, prefix, decode_steps)), runs=runs)
+
+    summary = aggregate_profile([(encoder_events, encoder_scopes, (), "Encoder"),
+                                 (decoder_events, decoder_scopes, WHISPER_DECODER_RULES, "Decoder (other)")], runs)
+    print_profile_summary(summary)
+    write_chrome_trace(trace_path, {"encoder_model.onnx": encoder_events, "decoder_model_merged.onnx": decoder_events})
+    return summary
 
 if __name__ == "__main__":
-    create_whisper_onnx()
+    parser = argparse.ArgumentParser(description="Export openai/whisper-base to ONNX")
+    parser.add_argument("--precision", choices=PRECISIONS, default="fp32",
+                        help="Also write a quantized copy of the export and check it against FP32")
+    parser.add_argument("--external-data", action="store_true",
+                        help="Store weights in page-aligned .onnx_data files that worker processes share")
+    parser.add_argument("--profile", nargs="?", const="", metavar="AUDIO",
+                        help="Only profile the existing export per operator, optionally on an audio file")
+    args = parser.parse_args()
+    if args.profile is not None:
+        audio = None
+        if args.profile:
+            from whisper_transcribe import load_audio
+            audio = load_audio(args.profile)
+        profile_whisper_onnx(audio=audio)
+        sys.exit(0)
+    try:
+        # Cached export, rebuilt only when the model, the export code, options or libraries change
+        from onnx_export_cache import export_whisper
+        export_whisper(precision=args.precision, external_data=args.external_data)
+    except QuantizationDriftError as e:
+        print(f"Quantized Whisper export rejected: {e}")
+        sys.exit(1)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,388 @@
+# inference_server.py
+# Long-running segmentation/transcription service for the GenAI pipeline. Keeps warm ONNX
+# Runtime sessions for the SEGBOT and Whisper exports, batches requests that arrive close
+# together, and reports finished jobs to the backend's webhook (POST /genAI/webhook).
+import argparse
+import asyncio
+import json
+import os
+import queue
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+JOB_TASKS = ("SEGMENTATION", "TRANSCRIPT_GENERATION")
+
+class ModelPool:
+    """
+    A fixed set of warm model instances, one per worker thread. ONNX Runtime releases the
+    GIL while a session runs, so `size` batches can execute in parallel.
+    """
+    def __init__(self, factory, size):
+        self.size = size
+        self.models = queue.Queue()
+        for _ in range(size):
+            self.models.put(factory())
+        self.executor = ThreadPoolExecutor(max_workers=size)
+
+    async def run(self, function, *args):
+        # Runs function(model, *args) on a worker thread with a model nobody else is using
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, function, args)
+
+    def _call(self, function, args):
+        model = self.models.get()
+        try:
+            return function(model, *args)
+        finally:
+            self.models.put(model)
+
+class DynamicBatcher:
+    """
+    Collects requests for one model and hands them to `handler` in batches. A batch is
+    dispatched once it holds max_batch_size requests or max_wait_ms after its first request
+    arrived, whichever comes first. handler(model, items) must return one result per item;
+    an exception returned as a result fails only its own request. If the handler raises for
+    a whole batch, its items are run again one by one on the same model, so a malformed
+    request the handler did not catch still does not fail the requests batched with it.
+    """
+    def __init__(self, name, pool, handler, max_batch_size=8, max_wait_ms=10.0):
+        self.name = name
+        self.pool = pool
+        self.handler = handler
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.batches = 0
+        self.batched_items = 0
+        # Recent per-request timings in seconds, for percentiles
+        self.latencies = deque(maxlen=1024)
+        self.queue_waits = deque(maxlen=1024)
+
+    async def submit(self, item):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        # At most one batch per pooled model executes; the rest wait here and keep growing
+        slots = asyncio.Semaphore(self.pool.size)
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await slots.acquire()
+            asyncio.ensure_future(self._dispatch(batch, slots))
+
+    async def _dispatch(self, batch, slots):
+        started = time.perf_counter()
+        self.in_flight += len(batch)
+        self.batches += 1
+        self.batched_items += len(batch)
+        items = [item for item, _, _ in batch]
+        try:
+            try:
+                results = await self.pool.run(self.handler, items)
+            except Exception as e:
+                results = [e] if len(batch) == 1 else await self.pool.run(self._run_each, items)
+            for (_, future, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    self.failures += 1
+                    if not future.done():
+                        future.set_exception(result)
+                elif not future.done():
+                    future.set_result(result)
+        finally:
+            slots.release()
+            self.in_flight -= len(batch)
+            finished = time.perf_counter()
+            for _, _, submitted in batch:
+                self.requests += 1
+                self.queue_waits.append(started - submitted)
+                self.latencies.append(finished - submitted)
+
+    def _run_each(self, model, items):
+        results = []
+        for item in items:
+            try:
+                results.append(self.handler(model, [item])[0])
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def metrics(self):
+        def percentile(values, q):
+            return round(float(np.percentile(values, q)) * 1000, 2) if values else None
+        return {
+            "queue_depth": self.queue.qsize(),
+            "in_flight": self.in_flight,
+            "pool_size": self.pool.size,
+            "requests": self.requests,
+            "failures": self.failures,
+            "batches": self.batches,
+            "mean_batch_size": round(self.batched_items / self.batches, 2) if self.batches else None,
+            "latency_p50_ms": percentile(self.latencies, 50),
+            "latency_p95_ms": percentile(self.latencies, 95),
+            "queue_wait_p50_ms": percentile(self.queue_waits, 50),
+            "queue_wait_p95_ms": percentile(self.queue_waits, 95),
+        }
+
+def _session_options(threads):
+    import onnxruntime as ort
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    return options
+
+def _segment_batch(segmenter, items):
+    # Malformed feature matrices are answered with their own error and kept out of the batch
+    input_dim = segmenter.session.get_inputs()[0].shape[2]
+    results, features = [], []
+    for item in items:
+        try:
+            item = np.asarray(item, dtype=np.float32)
+            if item.ndim != 2 or len(item) == 0 or item.shape[1] != input_dim:
+                raise ValueError(f"features must be a non-empty (units, {input_dim}) matrix, got shape {item.shape}")
+            results.append(None)
+            features.append(item)
+        except (TypeError, ValueError) as e:
+            results.append(e)
+    segmented = iter(segmenter.segment(features) if features else [])
+    return [next(segmented).tolist() if result is None else result for result in results]
+
+def _fetch(location):
+    # Jobs from the backend carry storage URLs; local paths are used as they are
+    if not location.startswith(("http://", "https://")):
+        return location, False
+    suffix = os.path.splitext(location.split("?")[0])[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f, urllib.request.urlopen(location) as response:
+        f.write(response.read())
+    return f.name, True
+
+def _transcribe_batch(transcriber, items):
+    # A recording that cannot be fetched or decoded fails alone; the rest are transcribed together
+    from whisper_transcribe import load_audio
+    results, audios = [], []
+    for location in items:
+        try:
+            path, downloaded = _fetch(location)
+            try:
+                audios.append(load_audio(path))
+                results.append(None)
+            finally:
+                if downloaded:
+                    os.remove(path)
+        except Exception as e:
+            results.append(e)
+    transcripts = iter(transcriber.transcribe_many(audios) if audios else [])
+    return [next(transcripts) if result is None else result for result in results]
+
+class InferenceServer:
+    """
+    Serves the SEGBOT and Whisper exports over HTTP:
+
+      GET  /            health check (the backend's AIServerCheck)
+      GET  /metrics     queue depth, batch sizes and latency percentiles per model
+      POST /segment     {"features": [[...], ...]} -> {"boundaries": [...]}
+      POST /transcribe  {"audio": path or URL} -> {"chunks": [...]}
+      POST /jobs        {"jobId", "task", ...} -> 202; the result is posted to webhook_url
+      GET  /jobs/<id>   status of a running job or one of the last max_finished_jobs finished
+
+    A model whose export is missing is not loaded and its endpoints answer 503.
+    """
+    def __init__(self, segmenter_file_path="segbot_segmenter.onnx", whisper_dir="whisper_onnx", workers=None,
+                 threads_per_session=1, max_batch_size=8, max_wait_ms=10.0, webhook_url=None, max_finished_jobs=1000):
+        workers = workers or os.cpu_count() or 1
+        self.webhook_url = webhook_url
+        self.batchers = {}
+        self.jobs = {}
+        # Finished job ids, oldest first; only the last max_finished_jobs keep their status
+        self.finished_jobs = deque()
+        self.max_finished_jobs = max_finished_jobs
+        if os.path.exists(segmenter_file_path):
+            from segbot_inference import SegbotBatchSegmenter
+            pool = ModelPool(lambda: SegbotBatchSegmenter(segmenter_file_path, session_options=_session_options(threads_per_session)), workers)
+            self.batchers["segbot"] = DynamicBatcher("segbot", pool, _segment_batch, max_batch_size, max_wait_ms)
+            print(f"Loaded {workers} SEGBOT sessions from {segmenter_file_path}")
+        if os.path.exists(os.path.join(whisper_dir, "decoder_model_merged.onnx")):
+            from whisper_transcribe import WhisperOnnxTranscriber
+            pool = ModelPool(lambda: WhisperOnnxTranscriber(whisper_dir, session_options=_session_options(threads_per_session)), workers)
+            self.batchers["whisper"] = DynamicBatcher("whisper", pool, _transcribe_batch, max_batch_size, max_wait_ms)
+            print(f"Loaded {workers} Whisper sessions from {whisper_dir}")
+        if not self.batchers:
+            print("Warning: no ONNX exports found, every inference request will be rejected")
+
+    async def serve(self, host="127.0.0.1", port=9017):
+        for batcher in self.batchers.values():
+            asyncio.ensure_future(batcher.run())
+        server = await asyncio.start_server(self._handle_connection, host, port)
+        print(f"Inference server listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            method, path, body = await read_request(reader)
+            status, response = await self._route(method, path, body)
+        except ValueError as e:
+            status, response = 400, {"error": str(e)}
+        except Exception as e:
+            status, response = 500, {"error": str(e)}
+        await write_response(writer, status, response)
+
+    async def _route(self, method, path, body):
+        if method == "GET" and path == "/":
+            return 200, {"status": "ok", "models": sorted(self.batchers)}
+        if method == "GET" and path == "/metrics":
+            return 200, {name: batcher.metrics() for name, batcher in self.batchers.items()}
+        if method == "GET" and path.startswith("/jobs/"):
+            job_id = path[len("/jobs/"):]
+            if job_id not in self.jobs:
+                return 404, {"error": f"Unknown job {job_id}"}
+            return 200, self.jobs[job_id]
+        if method == "POST" and path == "/segment":
+            return await self._infer("segbot", _required(body, "features"), lambda boundaries: {"boundaries": boundaries})
+        if method == "POST" and path == "/transcribe":
+            return await self._infer("whisper", _required(body, "audio"), lambda transcript: transcript)
+        if method == "POST" and path == "/jobs":
+            return self._start_job(body)
+        return 404, {"error": f"No route for {method} {path}"}
+
+    async def _infer(self, model, item, respond):
+        if model not in self.batchers:
+            return 503, {"error": f"The {model} export is not loaded"}
+        return 200, respond(await self.batchers[model].submit(item))
+
+    def _start_job(self, body):
+        job_id, task = _required(body, "jobId"), _required(body, "task")
+        if task not in JOB_TASKS:
+            raise ValueError(f"task must be one of {', '.join(JOB_TASKS)}")
+        model = "segbot" if task == "SEGMENTATION" else "whisper"
+        if model not in self.batchers:
+            return 503, {"error": f"The {model} export is not loaded"}
+        item = _required(body, "features" if model == "segbot" else "audio")
+        self.jobs[job_id] = {"jobId": job_id, "task": task, "status": "RUNNING"}
+        asyncio.ensure_future(self._run_job(job_id, task, model, item, body.get("unit_end_times")))
+        return 202, self.jobs[job_id]
+
+    async def _run_job(self, job_id, task, model, item, unit_end_times):
+        try:
+            result = await self.batchers[model].submit(item)
+            if task == "SEGMENTATION":
+                # The backend's segmentationMap holds segment end times when the units have them
+                data = {"status": "COMPLETED",
+                        "segmentationMap": [unit_end_times[b] for b in result] if unit_end_times else result}
+            else:
+                data = {"status": "COMPLETED", "transcript": result}
+        except Exception as e:
+            data = {"status": "FAILED", "error": str(e)}
+        self.jobs[job_id] = {"jobId": job_id, "task": task, "status": data["status"]}
+        self.finished_jobs.append(job_id)
+        while len(self.finished_jobs) > self.max_finished_jobs:
+            evicted = self.finished_jobs.popleft()
+            # The same id may have been submitted again and still be running
+            if self.jobs.get(evicted, {}).get("status") != "RUNNING":
+                self.jobs.pop(evicted, None)
+        if self.webhook_url:
+            payload = {"task": task, "jobId": job_id, "data": data}
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, post_json, self.webhook_url, payload)
+            except Exception as e:
+                print(f"Could not deliver webhook for job {job_id}: {e}")
+
+def _required(body, key):
+    if not isinstance(body, dict) or key not in body:
+        raise ValueError(f"Missing '{key}' in request body")
+    return body[key]
+
+async def read_request(reader):
+    """
+    Reads one HTTP/1.1 request and returns (method, path, parsed JSON body or None).
+    """
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) < 2:
+        raise ValueError("Malformed request line")
+    headers = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = json.loads(await reader.readexactly(length)) if length else None
+    return request_line[0].upper(), request_line[1].split("?")[0], body
+
+async def write_response(writer, status, payload):
+    reasons = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {reasons.get(status, '')}\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+    writer.write(head.encode() + body)
+    await writer.drain()
+    writer.close()
+
+def post_json(url, payload, timeout=30):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"}, method="POST")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status
+
+async def run_webhook_stub(host="127.0.0.1", port=9018, received=None):
+    """
+    Stands in for the backend's POST /genAI/webhook: prints every callback body and answers
+    200. Bodies are also appended to `received` when a list is given.
+    """
+    async def handle(reader, writer):
+        try:
+            method, path, body = await read_request(reader)
+            print(f"Webhook {method} {path}: {json.dumps(body)}")
+            if received is not None:
+                received.append(body)
+            await write_response(writer, 200, {})
+        except Exception as e:
+            await write_response(writer, 400, {"error": str(e)})
+    server = await asyncio.start_server(handle, host, port)
+    print(f"Webhook stub listening on http://{host}:{port}/genAI/webhook")
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the SEGBOT and Whisper ONNX exports")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9017, help="The backend's AI_SERVER_PORT")
+    parser.add_argument("--segmenter", default="segbot_segmenter.onnx")
+    parser.add_argument("--whisper-dir", default="whisper_onnx")
+    parser.add_argument("--workers", type=int, help="Warm sessions per model (default: number of CPU cores)")
+    parser.add_argument("--threads-per-session", type=int, default=1)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-wait-ms", type=float, default=10.0, help="How long a batch waits for more requests")
+    parser.add_argument("--webhook-url", help="Where finished jobs are reported, e.g. http://localhost:4001/api/genAI/webhook")
+    parser.add_argument("--max-finished-jobs", type=int, default=1000, help="Finished jobs whose status GET /jobs/<id> still reports")
+    parser.add_argument("--webhook-stub", action="store_true", help="Only run a local stub of the webhook on --port")
+    args = parser.parse_args()
+
+    try:
+        if args.webhook_stub:
+            asyncio.run(run_webhook_stub(args.host, args.port))
+        else:
+            server = InferenceServer(args.segmenter, args.whisper_dir, args.workers, args.threads_per_session,
+                                     args.max_batch_size, args.max_wait_ms, args.webhook_url, args.max_finished_jobs)
+            asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("Shutting down")
+        sys.exit(0)
@@ -0,0 +1,324 @@
+# onnx_export_cache.py
+# Content-addressed cache for the SEGBOT and Whisper ONNX exports. An export is keyed by a
+# fingerprint of everything that shapes its bytes, so converting again with unchanged inputs
+# reuses the stored artifact instead of rebuilding the model. torch and Optimum are only
+# imported when an export actually has to run. This is the supported way to export; the
+# convert_*_to_onnx.py CLIs go through it as well.
+import argparse
+import ast
+import hashlib
+import importlib.metadata
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+CACHE_DIR = "onnx_cache"
+# Bump when the fingerprint or manifest layout changes so older entries are not reused
+FINGERPRINT_VERSION = 1
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Definitions in convert_segbot_to_onnx.py that every SEGBOT export depends on, and the ones
+# specific to each target
+SEGBOT_MODEL_SOURCE = ("Encoder", "Decoder", "Pointer", "SEGBOT", "length_mask", "gather_units", "_export_kwargs")
+SEGBOT_TARGETS = {
+    "segbot": ("create_segbot_onnx", "quantize_segbot_onnx", "SEGBOT_MAX_ATTENTION_DEVIATION"),
+    "segbot_segmenter": ("SEGBOTSegmenter", "script_segmenter", "create_segbot_segmenter_onnx"),
+    "segbot_stages": ("SEGBOTEncoderStage", "SEGBOTPointerStep", "create_segbot_stages_onnx"),
+}
+SEGBOT_LIBRARIES = ("torch", "onnx", "onnxruntime", "numpy")
+WHISPER_LIBRARIES = ("optimum", "transformers", "torch", "onnx", "onnxruntime", "numpy")
+
+def library_versions(names):
+    # Read from the installed package metadata, which is much faster than importing the packages
+    versions = {}
+    for name in names:
+        try:
+            versions[name] = importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            versions[name] = "missing"
+    return versions
+
+def source_digests(file_name, names=None):
+    """
+    Digests of the top-level definitions `names` in one of the repo's modules, or of the
+    whole module when names is None. The parsed syntax tree is hashed rather than the text,
+    so comment and formatting changes do not invalidate exports.
+    """
+    with open(os.path.join(HERE, file_name)) as f:
+        module = ast.parse(f.read())
+    if names is None:
+        return {file_name: hashlib.sha256(ast.dump(module).encode()).hexdigest()}
+    definitions = {}
+    for node in module.body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+            definitions[node.name] = node
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                if isinstance(target, ast.Name):
+                    definitions[target.id] = node
+    missing = [name for name in names if name not in definitions]
+    if missing:
+        raise ValueError(f"{file_name} no longer defines {', '.join(missing)}")
+    return {f"{file_name}:{name}": hashlib.sha256(ast.dump(definitions[name]).encode()).hexdigest() for name in names}
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def directory_digest(path):
+    # Digest of every file below path, by relative name
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file_name in sorted(files):
+            full_path = os.path.join(root, file_name)
+            digest.update(f"{os.path.relpath(full_path, path)}:{file_digest(full_path)}\n".encode())
+    return digest.hexdigest()
+
+def hub_revision(model_name):
+    """
+    Commit of the main branch of a Hugging Face model in the local hub cache, read from the
+    cache's refs file without importing huggingface_hub. None before the first download.
+    """
+    hub_cache = os.environ.get("HF_HUB_CACHE") or os.path.join(
+        os.environ.get("HF_HOME") or os.path.join(os.path.expanduser("~"), ".cache", "huggingface"), "hub")
+    ref_path = os.path.join(hub_cache, "models--" + model_name.replace("/", "--"), "refs", "main")
+    if not os.path.isfile(ref_path):
+        return None
+    with open(ref_path) as f:
+        return f.read().strip()
+
+def latest_hub_revision(model_name):
+    """
+    Commit the hub currently serves for the main branch of a model, which is what an export
+    of a model missing from the local hub cache downloads. None when offline.
+    """
+    try:
+        from huggingface_hub import model_info
+        return model_info(model_name).sha
+    except Exception: # Offline, unknown model or huggingface_hub missing; the export itself reports it
+        return None
+
+def fingerprint(inputs):
+    payload = json.dumps({"version": FINGERPRINT_VERSION, **inputs}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _manifest_files(directory):
+    files = {}
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            full_path = os.path.join(root, file_name)
+            relative = os.path.relpath(full_path, directory).replace(os.sep, "/")
+            files[relative] = {"sha256": file_digest(full_path), "bytes": os.path.getsize(full_path)}
+    return dict(sorted(files.items()))
+
+def manifest_path(output_dir, name):
+    return os.path.join(output_dir, f"{name}.manifest.json")
+
+def _up_to_date(output_dir, name, key):
+    # The outputs of a previous restore are still in place; sizes are checked, digests only by verify_manifest()
+    path = manifest_path(output_dir, name)
+    if not os.path.isfile(path):
+        return False
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("fingerprint") != key:
+        return False
+    return all(os.path.isfile(os.path.join(output_dir, relative)) and os.path.getsize(os.path.join(output_dir, relative)) == entry["bytes"]
+               for relative, entry in manifest["files"].items())
+
+def verify_manifest(output_dir, name):
+    """
+    Re-hashes the files of an export against its manifest. Returns the relative paths
+    whose contents differ or are missing, so an empty list means a byte-identical export.
+    """
+    with open(manifest_path(output_dir, name)) as f:
+        manifest = json.load(f)
+    mismatched = []
+    for relative, entry in manifest["files"].items():
+        path = os.path.join(output_dir, relative)
+        if not os.path.isfile(path) or file_digest(path) != entry["sha256"]:
+            mismatched.append(relative)
+    return mismatched
+
+def cached_export(name, inputs, export, output_dir=".", cache_dir=CACHE_DIR):
+    """
+    Returns the manifest of the export identified by `inputs`, writing its files into
+    output_dir. `export(directory)` is only called when neither output_dir nor the cache
+    holds an export with the same fingerprint; it must write every output file under
+    `directory`, which becomes the cache entry.
+
+    The manifest lists the fingerprint, the inputs it was computed from and the SHA-256 of
+    every file, and is also written to output_dir as <name>.manifest.json.
+    """
+    started = time.perf_counter()
+    key = fingerprint(inputs)
+    entry_dir = os.path.join(cache_dir, key)
+    if _up_to_date(output_dir, name, key):
+        with open(manifest_path(output_dir, name)) as f:
+            manifest = json.load(f)
+        print(f"{name} export is up to date ({key[:12]}, {(time.perf_counter() - started) * 1000:.1f} ms)")
+        return manifest
+
+    if os.path.isfile(os.path.join(entry_dir, "manifest.json")):
+        print(f"Reusing cached {name} export {key[:12]}")
+    else:
+        os.makedirs(cache_dir, exist_ok=True)
+        build_dir = tempfile.mkdtemp(prefix=f"{name}-", dir=cache_dir)
+        try:
+            export(build_dir)
+            manifest = {"name": name, "fingerprint": key, "inputs": inputs, "files": _manifest_files(build_dir)}
+            with open(os.path.join(build_dir, "manifest.json"), "w") as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            # Publish the entry in one step so concurrent builds never see a partial export
+            try:
+                os.rename(build_dir, entry_dir)
+            except OSError: # Another build stored the same fingerprint first
+                shutil.rmtree(build_dir)
+        except BaseException:
+            shutil.rmtree(build_dir, ignore_errors=True)
+            raise
+
+    with open(os.path.join(entry_dir, "manifest.json")) as f:
+        manifest = json.load(f)
+    for relative in manifest["files"]:
+        destination = os.path.join(output_dir, relative)
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        partial = f"{destination}.partial"
+        shutil.copyfile(os.path.join(entry_dir, relative), partial)
+        os.replace(partial, destination)
+    with open(manifest_path(output_dir, name), "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    print(f"{name} export {key[:12]} written to {output_dir} ({(time.perf_counter() - started) * 1000:.1f} ms)")
+    return manifest
+
+def export_segbot(target="segbot", output_dir=".", precision="fp32", opset_version=11, external_data=False,
+                  checkpoint=None, seed=0, cache_dir=CACHE_DIR):
+    """
+    Cached create_segbot_onnx(), create_segbot_segmenter_onnx() or create_segbot_stages_onnx(),
+    chosen by target, writing the usual file names into output_dir.
+
+    The fingerprint covers the source of the SEGBOT, Encoder, Decoder and Pointer modules and
+    of the target's export code (whose hard-coded dims and opsets it therefore includes), the
+    options, the weights and the torch/onnx/onnxruntime versions. Weights come from a
+    state_dict checkpoint when given, otherwise from a random initialisation seeded with
+    `seed`, which keeps repeated exports byte-identical.
+    """
+    if target not in SEGBOT_TARGETS:
+        raise ValueError(f"Unknown SEGBOT target {target!r}, expected one of {', '.join(SEGBOT_TARGETS)}")
+    if target != "segbot" and (precision != "fp32" or opset_version != 11):
+        raise ValueError(f"{target} is exported at FP32 with opset 11 only")
+
+    source = source_digests("convert_segbot_to_onnx.py", SEGBOT_MODEL_SOURCE + SEGBOT_TARGETS[target])
+    source.update(source_digests("onnx_quantization.py"))
+    source.update(source_digests("onnx_external_data.py"))
+    inputs = {
+        "target": target,
+        "source": source,
+        "options": {"precision": precision, "opset_version": opset_version, "external_data": external_data},
+        "weights": f"checkpoint:{file_digest(checkpoint)}" if checkpoint else f"random:seed={seed}",
+        "libraries": library_versions(SEGBOT_LIBRARIES),
+        "python": platform.python_version(),
+    }
+
+    def export(directory):
+        import torch
+        import convert_segbot_to_onnx as converter
+
+        torch.manual_seed(seed)
+        model = None
+        if checkpoint:
+            model = converter.SEGBOT(128, 256)
+            model.load_state_dict(torch.load(checkpoint, map_location="cpu"))
+        if target == "segbot":
+            converter.create_segbot_onnx(os.path.join(directory, "segbot.onnx"), precision=precision, model=model,
+                                         opset_version=opset_version, external_data=external_data)
+        elif target == "segbot_segmenter":
+            converter.create_segbot_segmenter_onnx(os.path.join(directory, "segbot_segmenter.onnx"), model=model,
+                                                   external_data=external_data)
+        else:
+            converter.create_segbot_stages_onnx(os.path.join(directory, "segbot_encoder.onnx"),
+                                                os.path.join(directory, "segbot_step.onnx"), model=model,
+                                                external_data=external_data)
+
+    return cached_export(target, inputs, export, output_dir, cache_dir)
+
+def export_whisper(model_name="openai/whisper-base", output_dir="whisper_onnx", precision="fp32", external_data=False,
+                   cache_dir=CACHE_DIR):
+    """
+    Cached create_whisper_onnx(). The export (and its f"{output_dir}_{precision}" variant)
+    is written next to output_dir as usual.
+
+    The fingerprint covers convert_whisper_to_onnx.py and the helpers it uses, the options,
+    the Optimum/transformers/torch/onnx versions and the weights: the files of a local model
+    directory, or for a hub model its commit. The commit is read from the local hub cache,
+    or for a model that was never downloaded asked from the hub, so the first export is
+    keyed the same way as the ones after the download. Offline and without a cached copy
+    the export cannot download the model anyway.
+    """
+    if os.path.isdir(model_name):
+        weights = f"directory:{directory_digest(model_name)}"
+    else:
+        revision = hub_revision(model_name) or latest_hub_revision(model_name)
+        weights = f"hub:{model_name}@{revision or 'unresolved'}"
+    source = source_digests("convert_whisper_to_onnx.py")
+    source.update(source_digests("onnx_quantization.py"))
+    source.update(source_digests("onnx_external_data.py"))
+    inputs = {
+        "target": "whisper",
+        "source": source,
+        "options": {"precision": precision, "external_data": external_data},
+        "weights": weights,
+        "libraries": library_versions(WHISPER_LIBRARIES),
+        "python": platform.python_version(),
+    }
+    base_dir, name = os.path.split(os.path.normpath(output_dir))
+
+    def export(directory):
+        from convert_whisper_to_onnx import create_whisper_onnx
+        export_dir = os.path.join(directory, name)
+        create_whisper_onnx(model_name, export_dir, precision, external_data)
+        # create_whisper_onnx() reports export errors instead of raising them
+        if not os.path.isfile(os.path.join(export_dir, "decoder_model_merged.onnx")):
+            raise RuntimeError(f"Whisper export of {model_name} did not complete")
+
+    return cached_export(name, inputs, export, base_dir or ".", cache_dir)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export SEGBOT and Whisper to ONNX, reusing cached exports when nothing changed")
+    parser.add_argument("targets", nargs="+", choices=tuple(SEGBOT_TARGETS) + ("whisper",))
+    parser.add_argument("--precision", default="fp32", help="Precision of the segbot and whisper targets")
+    parser.add_argument("--external-data", action="store_true",
+                        help="Store weights in page-aligned .onnx_data files that worker processes share")
+    parser.add_argument("--checkpoint", help="SEGBOT state_dict to export instead of random weights")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random SEGBOT weights")
+    parser.add_argument("--whisper-model", default="openai/whisper-base")
+    parser.add_argument("--output-dir", default=".", help="Where the SEGBOT files and the whisper_onnx directory are written")
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--verify", action="store_true", help="Re-hash the written files against their manifests")
+    args = parser.parse_args()
+
+    mismatched = []
+    for target in args.targets:
+        if target == "whisper":
+            export_whisper(args.whisper_model, os.path.join(args.output_dir, "whisper_onnx"), args.precision,
+                           args.external_data, args.cache_dir)
+            name = "whisper_onnx"
+        else:
+            export_segbot(target, args.output_dir, args.precision if target == "segbot" else "fp32",
+                          external_data=args.external_data, checkpoint=args.checkpoint,
+                          seed=args.seed, cache_dir=args.cache_dir)
+            name = target
+        if args.verify:
+            mismatched += [f"{name}: {relative}" for relative in verify_manifest(args.output_dir, name)]
+    for entry in mismatched:
+        print(f"Differs from manifest: {entry}")
+    if mismatched:
+        sys.exit(1)
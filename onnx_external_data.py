@@ -0,0 +1,166 @@
+# onnx_external_data.py
+# Page-aligned external-data copies of the ONNX exports, so worker processes memory-map one
+# shared copy of the weights instead of each parsing and holding its own.
+import argparse
+import mmap
+import multiprocessing
+import os
+import time
+
+# Offsets are aligned to the mapping granularity (4 KiB on Linux, 64 KiB on Windows)
+ALIGNMENT = max(mmap.ALLOCATIONGRANULARITY, mmap.PAGESIZE)
+SIZE_THRESHOLD = 1024 # Smaller tensors stay inside the .onnx file
+
+def external_data_path(onnx_file_path):
+    """
+    Returns where the weights of a model file are written, e.g. segbot.onnx -> segbot.onnx_data
+    (the name Optimum uses too).
+    """
+    root, _ = os.path.splitext(onnx_file_path)
+    return f"{root}.onnx_data"
+
+def _graph_tensors(graph):
+    # Initializers of the graph and of every subgraph (If/Loop bodies, as in the merged Whisper decoder)
+    import onnx
+    yield from graph.initializer
+    for node in graph.node:
+        for attribute in node.attribute:
+            if attribute.type == onnx.AttributeProto.GRAPH:
+                yield from _graph_tensors(attribute.g)
+            elif attribute.type == onnx.AttributeProto.GRAPHS:
+                for subgraph in attribute.graphs:
+                    yield from _graph_tensors(subgraph)
+
+def save_external_data(onnx_file_path, size_threshold=SIZE_THRESHOLD):
+    """
+    Rewrites a model in place so every tensor of at least size_threshold bytes lives in
+    external_data_path(onnx_file_path), each starting on an ALIGNMENT boundary. ONNX
+    Runtime maps aligned external initializers straight from the page cache.
+    """
+    import onnx
+    from onnx import numpy_helper
+
+    model = onnx.load(onnx_file_path) # Also pulls in weights that are already external
+    data_path = external_data_path(onnx_file_path)
+    location = os.path.basename(data_path)
+    with open(data_path, "wb") as f:
+        for tensor in _graph_tensors(model.graph):
+            if not tensor.HasField("raw_data"):
+                # Typed fields (float_data, int64_data, ...) are converted to raw bytes first
+                array = numpy_helper.to_array(tensor)
+                if array.nbytes < size_threshold:
+                    continue
+                tensor.CopyFrom(numpy_helper.from_array(array, tensor.name))
+            if len(tensor.raw_data) < size_threshold:
+                continue
+            offset = f.tell()
+            padding = -offset % ALIGNMENT
+            f.write(b"\0" * padding)
+            f.write(tensor.raw_data)
+            del tensor.external_data[:]
+            for key, value in (("location", location), ("offset", str(offset + padding)), ("length", str(len(tensor.raw_data)))):
+                entry = tensor.external_data.add()
+                entry.key = key
+                entry.value = value
+            tensor.data_location = onnx.TensorProto.EXTERNAL
+            tensor.ClearField("raw_data")
+    onnx.save(model, onnx_file_path)
+    print(f"Weights of {onnx_file_path} moved to page-aligned {data_path}")
+
+def create_shared_session(onnx_file_path, session_options=None, providers=("CPUExecutionProvider",)):
+    """
+    Creates an InferenceSession that keeps external weights shared between processes.
+
+    ONNX Runtime memory-maps aligned external initializers read-only, but weight
+    pre-packing would copy them into private memory again, so it is turned off for models
+    with external data. Models with embedded weights load as usual.
+    """
+    import onnxruntime as ort
+    if session_options is None:
+        session_options = ort.SessionOptions()
+    if os.path.exists(external_data_path(onnx_file_path)):
+        session_options.add_session_config_entry("session.disable_prepacking", "1")
+    return ort.InferenceSession(onnx_file_path, sess_options=session_options, providers=list(providers))
+
+def _memory_mb():
+    # Resident, proportional (shared pages split between their users) and private memory, Linux only for the latter two
+    usage = {}
+    if os.path.exists("/proc/self/smaps_rollup"):
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[1].isdigit():
+                    usage[parts[0].rstrip(":")] = int(parts[1]) / 1024
+        return {"rss_mb": usage.get("Rss"), "pss_mb": usage.get("Pss"),
+                "private_mb": usage.get("Private_Clean", 0) + usage.get("Private_Dirty", 0)}
+    import resource
+    return {"rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, "pss_mb": None, "private_mb": None}
+
+def _load_worker(onnx_file_path, shared, barrier, results):
+    started = time.perf_counter()
+    if shared:
+        session = create_shared_session(onnx_file_path)
+    else:
+        import onnxruntime as ort
+        session = ort.InferenceSession(onnx_file_path, providers=["CPUExecutionProvider"])
+    load_seconds = time.perf_counter() - started
+    barrier.wait() # Measure while every process holds its session
+    results.put(dict(_memory_mb(), load_seconds=load_seconds))
+    barrier.wait()
+    del session
+
+def memory_report(onnx_file_path, process_counts=(1, 4, 16), shared=True):
+    """
+    Starts each number of processes in process_counts at once, has each create a session
+    for onnx_file_path, and returns per count the mean session-creation time, RSS per
+    process and the total proportional and private memory across the processes.
+    """
+    context = multiprocessing.get_context("spawn")
+    report = []
+    for count in process_counts:
+        barrier = context.Barrier(count)
+        results = context.Queue()
+        processes = [context.Process(target=_load_worker, args=(onnx_file_path, shared, barrier, results)) for _ in range(count)]
+        for process in processes:
+            process.start()
+        measurements = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+        def total(key):
+            values = [m[key] for m in measurements]
+            return round(sum(values), 1) if None not in values else None
+        report.append({
+            "processes": count,
+            "session_load_ms": round(sum(m["load_seconds"] for m in measurements) / count * 1000, 1),
+            "rss_mb_per_process": round(sum(m["rss_mb"] for m in measurements) / count, 1),
+            "pss_mb_total": total("pss_mb"),
+            "private_mb_total": total("private_mb"),
+        })
+    return report
+
+def print_memory_report(label, report):
+    print(f"{label}:")
+    print(f"  {'processes':>9} {'load ms':>9} {'RSS MB/proc':>12} {'PSS MB total':>13} {'private MB total':>17}")
+    for row in report:
+        print(f"  {row['processes']:>9} {row['session_load_ms']:>9} {row['rss_mb_per_process']:>12} "
+              f"{row['pss_mb_total'] if row['pss_mb_total'] is not None else '-':>13} "
+              f"{row['private_mb_total'] if row['private_mb_total'] is not None else '-':>17}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move ONNX weights to page-aligned external data and compare memory use")
+    parser.add_argument("models", nargs="+", help="ONNX files with embedded weights")
+    parser.add_argument("--output-dir", default="shared_onnx", help="Where the external-data copies are written")
+    parser.add_argument("--processes", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--no-report", action="store_true", help="Only convert")
+    args = parser.parse_args()
+
+    import shutil
+    os.makedirs(args.output_dir, exist_ok=True)
+    for model in args.models:
+        converted = os.path.join(args.output_dir, os.path.basename(model))
+        shutil.copy2(model, converted)
+        save_external_data(converted)
+        if not args.no_report:
+            print_memory_report(f"{model} (embedded weights)", memory_report(model, args.processes, shared=False))
+            print_memory_report(f"{converted} (shared external data)", memory_report(converted, args.processes, shared=True))
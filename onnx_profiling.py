@@ -0,0 +1,164 @@
+# onnx_profiling.py
+# Per-operator ONNX Runtime profiling for the SEGBOT and Whisper exports, shared by both
+# converters: runs a workload with profiling on, attributes every kernel to the model
+# submodule it was exported from, and writes a summary table and a Chrome trace.
+import json
+import os
+import re
+import shutil
+import tempfile
+
+# Control-flow kernels time their subgraph, whose nodes are profiled as well
+CONTAINER_OPS = ("If", "Loop", "Scan")
+OTHER_MODULE = "Other"
+
+def _graph_nodes(graph):
+    # Nodes of the graph and of every subgraph (If/Loop bodies)
+    import onnx
+    for node in graph.node:
+        yield node
+        for attribute in node.attribute:
+            if attribute.type == onnx.AttributeProto.GRAPH:
+                yield from _graph_nodes(attribute.g)
+            elif attribute.type == onnx.AttributeProto.GRAPHS:
+                for subgraph in attribute.graphs:
+                    yield from _graph_nodes(subgraph)
+
+def _scope(name):
+    # "/encoder/bigru/GRU" -> "/encoder/bigru"; None at the top level ("/Shape")
+    return name.rsplit("/", 1)[0] or None
+
+def node_scopes(graph):
+    """
+    Maps every node name of an (optimized) graph to the PyTorch module scope it came from.
+
+    The exporters name nodes after their module path (e.g. /pointer/W1/MatMul). Nodes that
+    ONNX Runtime fused (e.g. BiasGelu_token_9) lose that name, so they take the scope of
+    their output tensors, or failing that of their inputs, which keep the original names.
+    """
+    scopes = {}
+    for node in _graph_nodes(graph):
+        if node.name.startswith("/"):
+            scopes[node.name] = _scope(node.name)
+            continue
+        for name in [*node.output, *node.input]:
+            if name.startswith("/"):
+                scopes[node.name] = _scope(name)
+                break
+    return scopes
+
+def classify(scope, module_rules, default_module):
+    """
+    Returns (module, submodule) for a scope. module_rules is an ordered sequence of
+    (regex, module name) matched at the start of the scope; the submodule is the rest of the
+    scope with layer indices folded together (layers.3 -> layers.*), so repeated layers add up.
+    """
+    if scope is None:
+        return default_module, ""
+    for pattern, module in module_rules:
+        match = re.match(pattern, scope)
+        if match:
+            rest = scope[match.end():]
+            break
+    else:
+        module, rest = default_module, scope
+    return module, re.sub(r"\.\d+(?=/|$)", ".*", rest.strip("/"))
+
+def profile_session(onnx_file_path, workload, warmup=1, runs=5, session_options=None):
+    """
+    Creates a profiling session for onnx_file_path and calls workload(session) warmup + runs
+    times. Returns the Chrome-trace events of the measured runs only, and the scopes of the
+    optimized graph's nodes, which are the ones the profile names.
+    """
+    import onnx
+    import onnxruntime as ort
+
+    options = session_options or ort.SessionOptions()
+    work_dir = tempfile.mkdtemp(prefix="onnx-profile-")
+    try:
+        options.enable_profiling = True
+        options.profile_file_prefix = os.path.join(work_dir, "profile")
+        options.optimized_model_filepath = os.path.join(work_dir, "optimized.onnx")
+        options.log_severity_level = 3 # Saving the optimized graph warns about machine-specific layouts
+        session = ort.InferenceSession(onnx_file_path, sess_options=options, providers=["CPUExecutionProvider"])
+        for _ in range(warmup + runs):
+            workload(session)
+        with open(session.end_profiling()) as f:
+            events = json.load(f)
+        scopes = node_scopes(onnx.load(options.optimized_model_filepath).graph)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # model_run spans one session.run(); node events before the first measured run belong to the warm-up
+    run_starts = sorted(event["ts"] for event in events if event.get("name") == "model_run")
+    workload_runs = len(run_starts) // (warmup + runs)
+    measured_from = run_starts[warmup * workload_runs] if warmup and run_starts else 0
+    return [event for event in events if event.get("ts", 0) >= measured_from], scopes
+
+def aggregate_profile(profiles, runs=1):
+    """
+    Sums kernel times by module, by module and submodule, and by module and op type, in ms
+    per workload run. profiles is a list of (events, scopes, module_rules, default_module),
+    one per model, as profile_session() returns them plus the rules classify() applies.
+    Every event's args gain its module and submodule, for the Chrome trace.
+    """
+    modules, submodules, ops = {}, {}, {}
+    total = 0.0
+    for events, scopes, module_rules, default_module in profiles:
+        for event in events:
+            if event.get("cat") != "Node" or not event["name"].endswith("_kernel_time"):
+                continue
+            op_type = event["args"].get("op_name", "")
+            node_name = event["name"][:-len("_kernel_time")]
+            module, submodule = classify(scopes.get(node_name), module_rules, default_module)
+            event["args"]["module"] = module
+            event["args"]["submodule"] = submodule
+            if op_type in CONTAINER_OPS:
+                continue
+            ms = event["dur"] / 1000 / runs
+            total += ms
+            modules[module] = modules.get(module, 0.0) + ms
+            submodules[(module, submodule)] = submodules.get((module, submodule), 0.0) + ms
+            calls = ops.setdefault((module, op_type), [0.0, 0])
+            calls[0] += ms
+            calls[1] += 1
+
+    def share(ms):
+        return round(ms / total, 4) if total else 0.0
+    return {
+        "total_ms": round(total, 3),
+        "modules": [{"module": module, "ms": round(ms, 3), "share": share(ms)}
+                    for module, ms in sorted(modules.items(), key=lambda item: -item[1])],
+        "submodules": [{"module": module, "submodule": submodule, "ms": round(ms, 3), "share": share(ms)}
+                       for (module, submodule), ms in sorted(submodules.items(), key=lambda item: -item[1])],
+        "ops": [{"module": module, "op": op_type, "ms": round(ms, 3), "share": share(ms), "calls": round(count / runs, 1)}
+                for (module, op_type), (ms, count) in sorted(ops.items(), key=lambda item: -item[1][0])],
+    }
+
+def write_chrome_trace(trace_path, traces):
+    """
+    Writes the events of one or more profiled models as a single Chrome trace (open it in
+    chrome://tracing or ui.perfetto.dev). traces maps a label to its events; each label
+    becomes its own process row.
+    """
+    trace_events = []
+    for pid, (label, events) in enumerate(traces.items(), 1):
+        trace_events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": label}})
+        trace_events.extend(dict(event, pid=pid) for event in events)
+    with open(trace_path, "w") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+    print(f"Chrome trace written to {trace_path}")
+
+def print_profile_summary(summary, top=10):
+    print(f"{'module':<20}{'ms/run':>10}{'share':>8}")
+    for row in summary["modules"]:
+        print(f"{row['module']:<20}{row['ms']:>10.2f}{row['share']:>8.1%}")
+    print(f"{'total':<20}{summary['total_ms']:>10.2f}")
+    print()
+    print(f"{'module':<20}{'submodule':<32}{'ms/run':>10}{'share':>8}")
+    for row in summary["submodules"][:top]:
+        print(f"{row['module']:<20}{row['submodule'] or '-':<32}{row['ms']:>10.2f}{row['share']:>8.1%}")
+    print()
+    print(f"{'module':<20}{'op':<24}{'calls':>8}{'ms/run':>10}{'share':>8}")
+    for row in summary["ops"][:top]:
+        print(f"{row['module']:<20}{row['op']:<24}{row['calls']:>8}{row['ms']:>10.2f}{row['share']:>8.1%}")
@@ -0,0 +1,122 @@
+# onnx_quantization.py
+# INT8/FP16 variants of the FP32 ONNX exports, shared by the SEGBOT and Whisper converters.
+import os
+
+PRECISIONS = ("fp32", "int8", "fp16")
+
+class QuantizationDriftError(RuntimeError):
+    """
+    Raised when a quantized variant drifts further from the FP32 model than its gate allows.
+    """
+
+def variant_path(onnx_file_path, precision):
+    """
+    Returns where the variant of an FP32 model file is written, e.g. segbot.onnx -> segbot.int8.onnx.
+    """
+    root, ext = os.path.splitext(onnx_file_path)
+    return f"{root}.{precision}{ext}"
+
+def quantize_model(onnx_file_path, output_path, precision):
+    """
+    Writes an INT8 (dynamic, weights quantized ahead of time and activations at runtime)
+    or FP16 copy of an FP32 ONNX model. Inputs and outputs keep their FP32 types so
+    callers do not change.
+
+    Dynamic quantization only covers ops with an integer kernel in ONNX Runtime (MatMul,
+    Gemm, ...), not GRU; INT8 GRU weights are stored by quantize_gru_weights() instead.
+    """
+    if precision == "int8":
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(onnx_file_path, output_path, weight_type=QuantType.QInt8)
+        quantize_gru_weights(output_path)
+    elif precision == "fp16":
+        import onnx
+        from onnxruntime.transformers.float16 import convert_float_to_float16
+        model = onnx.load(onnx_file_path)
+        onnx.save(convert_float_to_float16(model, keep_io_types=True), output_path)
+    else:
+        raise ValueError(f"Unsupported precision '{precision}'. Expected one of: int8, fp16")
+
+def quantize_gru_weights(onnx_file_path):
+    """
+    Stores the input and recurrent weights (W, R) of every top-level GRU in an ONNX file as
+    INT8 with one scale per gate row, rewriting the file in place. ONNX Runtime has no
+    integer GRU kernel, so a Cast and Mul in front of each GRU restore FP32 weights; the
+    session folds them at load time. The file shrinks, but the GRUs still compute in FP32.
+    Returns the names of the quantized weights.
+    """
+    import numpy as np
+    import onnx
+    from onnx import helper, numpy_helper
+
+    model = onnx.load(onnx_file_path)
+    graph = model.graph
+    initializers = {initializer.name: initializer for initializer in graph.initializer}
+    dequantized = {} # FP32 weight name -> name of its dequantized value
+    dequantize_nodes = []
+    for node in graph.node:
+        if node.op_type != "GRU":
+            continue
+        for position in (1, 2): # W and R; the bias is small and stays FP32
+            name = node.input[position]
+            if name not in dequantized and name in initializers:
+                weight = numpy_helper.to_array(initializers[name]).astype(np.float32)
+                # Shape (num_directions, 3 * hidden_size, input_size): one scale per gate row
+                scale = np.abs(weight).max(axis=(0, 2), keepdims=True) / 127.0
+                scale[scale == 0] = 1.0
+                quantized = np.clip(np.round(weight / scale), -127, 127).astype(np.int8)
+                graph.initializer.remove(initializers[name])
+                graph.initializer.extend([numpy_helper.from_array(quantized, f"{name}_int8"),
+                                          numpy_helper.from_array(scale.astype(np.float32), f"{name}_scale")])
+                dequantize_nodes += [
+                    helper.make_node("Cast", [f"{name}_int8"], [f"{name}_int8_float"], to=onnx.TensorProto.FLOAT, name=f"{name}_Cast"),
+                    helper.make_node("Mul", [f"{name}_int8_float", f"{name}_scale"], [f"{name}_dequantized"], name=f"{name}_Dequantize"),
+                ]
+                dequantized[name] = f"{name}_dequantized"
+            if name in dequantized:
+                node.input[position] = dequantized[name]
+    if dequantized:
+        # Ahead of every other node, so the graph stays topologically sorted
+        nodes = dequantize_nodes + list(graph.node)
+        del graph.node[:]
+        graph.node.extend(nodes)
+        onnx.save(model, onnx_file_path)
+    return list(dequantized)
+
+def describe_quantization(onnx_file_path, variant_file_path):
+    """
+    Prints what an INT8 variant actually quantized: the integer ops dynamic quantization
+    inserted, the GRU weights stored as INT8, and the file size against the FP32 model.
+    Returns the summary as a dict.
+    """
+    from collections import Counter
+
+    import onnx
+
+    def model_bytes(path):
+        # The graph plus its external weights, when it has them
+        data_path = f"{os.path.splitext(path)[0]}.onnx_data"
+        return os.path.getsize(path) + (os.path.getsize(data_path) if os.path.exists(data_path) else 0)
+
+    nodes = onnx.load(variant_file_path, load_external_data=False).graph.node
+    ops = Counter(node.op_type for node in nodes)
+    summary = {
+        "integer_ops": {op: count for op, count in sorted(ops.items()) if op in ("MatMulInteger", "ConvInteger", "DynamicQuantizeLSTM")},
+        "int8_gru_weights": sum(1 for node in nodes if node.op_type == "Cast" and node.input[0].endswith("_int8")),
+        "fp32_bytes": model_bytes(onnx_file_path),
+        "variant_bytes": model_bytes(variant_file_path),
+    }
+    integer_ops = ", ".join(f"{count} {op}" for op, count in summary["integer_ops"].items()) or "none"
+    print(f"  Quantized ops: {integer_ops}; INT8 GRU weights: {summary['int8_gru_weights']}")
+    print(f"  File size: {summary['fp32_bytes'] / 1e6:.2f} MB -> {summary['variant_bytes'] / 1e6:.2f} MB "
+          f"({summary['fp32_bytes'] / summary['variant_bytes']:.2f}x smaller)")
+    return summary
+
+def check_drift(name, value, threshold):
+    """
+    Prints a drift measurement and raises QuantizationDriftError if it exceeds threshold.
+    """
+    status = "OK" if value <= threshold else "FAILED"
+    print(f"  {name}: {value:.6g} (threshold {threshold:g}) {status}")
+    if value > threshold:
+        raise QuantizationDriftError(f"{name} {value:.6g} exceeds threshold {threshold:g}")
@@ -0,0 +1,115 @@
+# segbot_boundaries.py
+# Turns SEGBOT's attention_weights output into segment boundaries and segment maps, for a
+# whole batch at once. Replaces the scipy.signal.find_peaks idea noted in convert_segbot_to_onnx.py.
+import numpy as np
+
+def _shift_left(x, k):
+    # x[..., i + k], padded with -inf past the end
+    if k == 0:
+        return x
+    padding = np.full(x.shape[:-1] + (k,), -np.inf)
+    return np.concatenate([x[..., k:], padding], axis=-1)
+
+def window_max(x, radius):
+    """
+    Maximum of x[..., i - radius:i + radius + 1] for every i along the last axis, in
+    O(log radius) vectorized passes.
+    """
+    if radius <= 0:
+        return x
+    padding = np.full(x.shape[:-1] + (radius,), -np.inf)
+    padded = np.concatenate([padding, x, padding], axis=-1)
+    width = 2 * radius + 1
+    # Doubling: after each pass, result[i] = max(padded[i:i + size])
+    result = padded
+    size = 1
+    while size * 2 <= width:
+        result = np.maximum(result, _shift_left(result, size))
+        size *= 2
+    # Two overlapping windows of `size` cover the full width
+    result = np.maximum(result, _shift_left(result, width - size))
+    return result[..., :x.shape[-1]]
+
+def decode_boundaries(attention_weights, lengths=None, threshold=0.0, min_segment_length=1, max_segment_length=None):
+    """
+    Extracts boundary units from SEGBOT attention_weights of shape (batch, seq_len, 1) or
+    (batch, seq_len). Returns one sorted int64 array per row with the last unit of every
+    segment; the final unit of each document always closes the last segment.
+
+    A unit is a candidate when its weight is a local peak of at least `threshold`.
+    Non-maximum suppression keeps a candidate only if it is the highest weight within
+    min_segment_length - 1 units on either side (ties go to the earlier unit), so kept
+    boundaries are at least min_segment_length apart; candidates that would leave a first
+    or last segment shorter than that are dropped as well. Segments still longer than
+    max_segment_length are then split into equal parts. max_segment_length must be at least
+    2 * min_segment_length - 1, otherwise a segment just over the maximum could only be split
+    into parts below the minimum.
+
+    Suppression compares each peak with its whole neighbourhood rather than greedily, so
+    a peak next to a stronger, itself suppressed peak is also dropped.
+    """
+    scores = np.asarray(attention_weights, dtype=np.float64)
+    if scores.ndim == 3:
+        scores = scores[..., 0]
+    batch_size, seq_len = scores.shape
+    if lengths is None:
+        lengths = np.full(batch_size, seq_len, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if max_segment_length is not None and max_segment_length < 2 * min_segment_length - 1:
+        raise ValueError("max_segment_length must be at least 2 * min_segment_length - 1")
+    if batch_size == 0:
+        return []
+
+    positions = np.arange(seq_len)
+    valid = positions < lengths[:, np.newaxis]
+    # A tiny index penalty breaks ties towards the earlier unit without reordering distinct weights
+    scale = max(float(np.abs(scores[valid]).max()) if valid.any() else 1.0, 1e-30)
+    keyed = np.where(valid, scores - positions * scale * 1e-12, -np.inf)
+
+    left = np.concatenate([np.full((batch_size, 1), -np.inf), keyed[:, :-1]], axis=1)
+    right = np.concatenate([keyed[:, 1:], np.full((batch_size, 1), -np.inf)], axis=1)
+    candidates = valid & (keyed > left) & (keyed > right) & (scores >= threshold)
+
+    radius = min_segment_length - 1
+    if radius > 0:
+        candidates &= keyed >= window_max(np.where(candidates, keyed, -np.inf), radius)
+        # The first segment is units 0..b and the last one b+1..length-1
+        last = (lengths - 1)[:, np.newaxis]
+        candidates &= (positions >= radius) & (positions <= last - min_segment_length)
+    # Every document ends with a boundary at its last unit
+    candidates[np.arange(batch_size)[lengths > 0], lengths[lengths > 0] - 1] = True
+
+    rows, ends = np.nonzero(candidates) # Row-major, so sorted by row and then by unit
+    if max_segment_length is not None and len(ends):
+        first_in_row = np.concatenate([[True], rows[1:] != rows[:-1]])
+        starts = np.where(first_in_row, 0, np.concatenate([[0], ends[:-1] + 1]))
+        segment_lengths = ends - starts + 1
+        parts = -(-segment_lengths // max_segment_length) # Ceiling division
+        splits = parts - 1
+        if splits.any():
+            # Boundary j (1-based) of a split segment closes its j-th equal part
+            split_segment = np.repeat(np.arange(len(ends)), splits)
+            j = np.arange(splits.sum()) - np.repeat(np.cumsum(splits) - splits, splits) + 1
+            split_ends = starts[split_segment] + (segment_lengths[split_segment] * j) // parts[split_segment] - 1
+            rows = np.concatenate([rows, rows[split_segment]])
+            ends = np.concatenate([ends, split_ends])
+            order = np.lexsort((ends, rows))
+            rows, ends = rows[order], ends[order]
+
+    counts = np.bincount(rows, minlength=batch_size)
+    return np.split(ends.astype(np.int64), np.cumsum(counts)[:-1])
+
+def segment_map(boundaries, unit_end_times):
+    """
+    Converts boundary units to the segment map the GenAI backend stores (segmentationMap,
+    edited through editSegmentMap): the end time in seconds of every segment.
+    """
+    return [float(t) for t in np.asarray(unit_end_times, dtype=np.float64)[np.asarray(boundaries, dtype=np.int64)]]
+
+def decode_segment_maps(attention_weights, unit_end_times_list, lengths=None, **kwargs):
+    """
+    decode_boundaries() followed by segment_map() for every row. unit_end_times_list holds
+    each document's per-unit end times, e.g. the chunk end timestamps of its transcript.
+    """
+    boundaries = decode_boundaries(attention_weights, lengths, **kwargs)
+    return [segment_map(row, end_times) for row, end_times in zip(boundaries, unit_end_times_list)]
@@ -0,0 +1,208 @@
+# segbot_features.py
+# Unit features for SEGBOT: turns a GenAI transcript ({"chunks": [{"timestamp": [start, end], "text": ...}]})
+# into the (seq_len, 128) float32 array create_segbot_onnx() exports for, one row per chunk.
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import zlib
+
+import numpy as np
+
+UNIT_FEATURE_DIM = 128 # input_dim of the exported SEGBOT
+TEXT_FEATURE_DIM = 112 # Hashed word and word-pair counts; the remaining 16 columns describe timing and layout
+CONTEXT_UNITS = 5 # Units on each side compared with a unit for the lexical-cohesion features
+# Bump when the features change so stale cache entries are not reused
+FEATURIZER_VERSION = 1
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9']+")
+# Openers that often start a new topic in a lecture
+DISCOURSE_MARKERS = ("so", "now", "next", "okay", "ok", "alright", "let's", "today", "first", "finally")
+
+def transcript_chunks(transcript):
+    """
+    Returns the chunk list of a transcript given as a dict, a JSON string or a file path.
+    """
+    if isinstance(transcript, str):
+        if transcript.lstrip().startswith("{"):
+            transcript = json.loads(transcript)
+        else:
+            with open(transcript) as f:
+                transcript = json.load(f)
+    return transcript["chunks"]
+
+def transcript_hash(transcript):
+    """
+    Content hash of the chunk texts and timestamps, independent of JSON formatting or of
+    other keys (segment maps, edits), so re-segmenting the same transcript reuses its features.
+    """
+    chunks = [[chunk.get("timestamp"), chunk.get("text", "")] for chunk in transcript_chunks(transcript)]
+    payload = json.dumps({"version": FEATURIZER_VERSION, "chunks": chunks}, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def _cosine(a, b):
+    norms = np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1)
+    return np.where(norms > 0, (a * b).sum(axis=1) / np.maximum(norms, 1e-12), 0.0)
+
+def _window_sums(vectors, width, after):
+    # Sum of the `width` rows before (or after) every row, excluding the row itself
+    padded = np.concatenate([np.zeros((1, vectors.shape[1]), dtype=vectors.dtype), np.cumsum(vectors, axis=0)])
+    index = np.arange(len(vectors))
+    if after:
+        return padded[np.minimum(index + 1 + width, len(vectors))] - padded[index + 1]
+    return padded[index] - padded[np.maximum(index - width, 0)]
+
+def _unit_times(chunks):
+    # Missing end timestamps (the last chunk of a pipeline transcript) fall back to the next start
+    num_units = len(chunks)
+    timestamps = np.array([[np.nan if value is None else value for value in (chunk.get("timestamp") or [None, None])] for chunk in chunks],
+                          dtype=np.float64).reshape(num_units, 2)
+    starts = timestamps[:, 0]
+    starts = np.where(np.isnan(starts), np.concatenate([[0.0], timestamps[:-1, 1]]), starts)
+    starts = np.nan_to_num(starts)
+    next_starts = np.concatenate([starts[1:], [np.nan]])
+    ends = np.where(np.isnan(timestamps[:, 1]), next_starts, timestamps[:, 1])
+    ends = np.where(np.isnan(ends), starts, np.maximum(ends, starts))
+    return starts, ends
+
+def unit_end_times(transcript):
+    """
+    End time in seconds of every chunk, with the same fallbacks the features use; what
+    segbot_boundaries.segment_map() turns boundaries into segment end times with.
+    """
+    chunks = transcript_chunks(transcript)
+    if not chunks:
+        return np.zeros(0, dtype=np.float64)
+    return _unit_times(chunks)[1]
+
+def featurize_transcript(transcript):
+    """
+    Featurizes every chunk of a transcript. Returns a (num_chunks, 128) float32 array:
+
+      0-111    signed feature hashing of the chunk's words and word pairs, L2-normalised
+      112-116  log duration, log pause before, log pause after, speaking rate, log word count
+      117      position in the lecture (chunk start / lecture end)
+      118-121  ends a sentence, ends with a question, starts capitalised, starts with a discourse marker
+      122-125  lexical cohesion: cosine with the previous and next chunk, and with the
+               CONTEXT_UNITS chunks before and after
+      126-127  share of numeric tokens, mean word length / 10
+
+    Only tokenisation touches chunks one at a time; hashing, counting and every other
+    feature are computed for the whole transcript at once.
+    """
+    chunks = transcript_chunks(transcript)
+    num_units = len(chunks)
+    features = np.zeros((num_units, UNIT_FEATURE_DIM), dtype=np.float32)
+    if num_units == 0:
+        return features
+
+    texts = [chunk.get("text", "").strip() for chunk in chunks]
+    tokens = [TOKEN_PATTERN.findall(text.lower()) for text in texts]
+    counts = np.array([len(unit_tokens) for unit_tokens in tokens])
+
+    # Word pairs within a chunk hash like words, so "machine learning" differs from its parts
+    terms = [unit_tokens + [f"{a} {b}" for a, b in zip(unit_tokens, unit_tokens[1:])] for unit_tokens in tokens]
+    term_counts = np.array([len(unit_terms) for unit_terms in terms])
+    flat_terms = np.array([term for unit_terms in terms for term in unit_terms], dtype=object)
+    if len(flat_terms):
+        # Hash each distinct term once, then scatter every occurrence into its chunk's row
+        vocabulary, inverse = np.unique(flat_terms, return_inverse=True)
+        hashes = np.array([zlib.crc32(term.encode()) for term in vocabulary], dtype=np.uint32)
+        columns = (hashes % TEXT_FEATURE_DIM).astype(np.int64)[inverse]
+        signs = np.where((hashes >> 31) & 1, -1.0, 1.0).astype(np.float32)[inverse]
+        rows = np.repeat(np.arange(num_units), term_counts)
+        np.add.at(features, (rows, columns), signs)
+    words = features[:, :TEXT_FEATURE_DIM]
+    words /= np.maximum(np.linalg.norm(words, axis=1, keepdims=True), 1e-12)
+
+    starts, ends = _unit_times(chunks)
+    durations = ends - starts
+    pause_before = np.maximum(starts - np.concatenate([[starts[0]], ends[:-1]]), 0.0)
+    pause_after = np.maximum(np.concatenate([starts[1:], [ends[-1]]]) - ends, 0.0)
+    lecture_end = max(float(ends.max()), 1e-6)
+
+    layout = features[:, TEXT_FEATURE_DIM:]
+    layout[:, 0] = np.log1p(durations)
+    layout[:, 1] = np.log1p(pause_before)
+    layout[:, 2] = np.log1p(pause_after)
+    layout[:, 3] = np.where(durations > 0, counts / np.maximum(durations, 1e-6), 0.0) / 5.0 # ~1 at typical speech rates
+    layout[:, 4] = np.log1p(counts)
+    layout[:, 5] = starts / lecture_end
+    layout[:, 6] = [text.endswith((".", "!", "?")) for text in texts]
+    layout[:, 7] = [text.endswith("?") for text in texts]
+    layout[:, 8] = [text[:1].isupper() for text in texts]
+    layout[:, 9] = [bool(unit_tokens) and unit_tokens[0] in DISCOURSE_MARKERS for unit_tokens in tokens]
+
+    previous = np.concatenate([np.zeros((1, TEXT_FEATURE_DIM), dtype=np.float32), words[:-1]])
+    following = np.concatenate([words[1:], np.zeros((1, TEXT_FEATURE_DIM), dtype=np.float32)])
+    layout[:, 10] = _cosine(words, previous)
+    layout[:, 11] = _cosine(words, following)
+    layout[:, 12] = _cosine(words, _window_sums(words, CONTEXT_UNITS, after=False))
+    layout[:, 13] = _cosine(words, _window_sums(words, CONTEXT_UNITS, after=True))
+
+    flat_tokens = np.array([token for unit_tokens in tokens for token in unit_tokens], dtype=object)
+    if len(flat_tokens):
+        token_rows = np.repeat(np.arange(num_units), counts)
+        numeric = np.array([token.isdigit() for token in flat_tokens], dtype=np.float64)
+        lengths = np.array([len(token) for token in flat_tokens], dtype=np.float64)
+        safe_counts = np.maximum(counts, 1)
+        layout[:, 14] = np.bincount(token_rows, weights=numeric, minlength=num_units) / safe_counts
+        layout[:, 15] = np.bincount(token_rows, weights=lengths, minlength=num_units) / safe_counts / 10.0
+    return features
+
+class FeatureCache:
+    """
+    On-disk cache of featurize_transcript() results, one .npy file per transcript content
+    hash. Hits are memory-mapped read-only, so re-segmenting a transcript (for example after
+    its segment boundaries were edited) neither recomputes nor copies its features.
+    """
+    def __init__(self, cache_dir="segbot_features"):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def features(self, transcript):
+        key = transcript_hash(transcript)
+        path = self.path(key)
+        if os.path.exists(path):
+            self.hits += 1
+            return np.load(path, mmap_mode="r")
+        self.misses += 1
+        features = featurize_transcript(transcript)
+        # Write to a temporary file first so concurrent readers never see a partial entry
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix=".npy.tmp", delete=False) as f:
+            np.save(f, features)
+        os.replace(f.name, path)
+        return np.load(path, mmap_mode="r")
+
+def featurize_batch(transcripts, cache=None):
+    """
+    Returns the (batch, seq_len, 128) float32 input_x and int64 lengths SEGBOT takes for
+    several transcripts, zero-padded to the longest one.
+    """
+    from segbot_inference import pad_batch
+    features_list = [cache.features(t) if cache is not None else featurize_transcript(t) for t in transcripts]
+    return pad_batch(features_list)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Featurize GenAI transcripts for SEGBOT")
+    parser.add_argument("transcripts", nargs="+", help="Transcript JSON files")
+    parser.add_argument("--cache-dir", default="segbot_features")
+    parser.add_argument("--no-cache", action="store_true", help="Always recompute features")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else FeatureCache(args.cache_dir)
+    started = time.perf_counter()
+    input_x, lengths = featurize_batch(args.transcripts, cache)
+    elapsed = time.perf_counter() - started
+    print(f"Featurized {len(args.transcripts)} transcript(s) into {input_x.shape} in {elapsed * 1000:.1f} ms", file=sys.stderr)
+    if cache is not None:
+        print(f"Cache {args.cache_dir}: {cache.hits} hit(s), {cache.misses} miss(es)", file=sys.stderr)
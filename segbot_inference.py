@@ -0,0 +1,160 @@
+# segbot_inference.py
+# Batched SEGBOT segmentation on top of the ONNX export from convert_segbot_to_onnx.py.
+import numpy as np
+
+from onnx_external_data import create_shared_session
+
+def pad_batch(features_list):
+    """
+    Packs variable-length (seq_len, input_dim) feature arrays into one zero-padded
+    (batch_size, max_len, input_dim) float32 array plus the int64 lengths the model masks with.
+    """
+    lengths = np.array([len(features) for features in features_list], dtype=np.int64)
+    input_dim = features_list[0].shape[1]
+    input_x = np.zeros((len(features_list), int(lengths.max()), input_dim), dtype=np.float32)
+    for row, features in enumerate(features_list):
+        input_x[row, :len(features)] = features
+    return input_x, lengths
+
+def bucket_by_length(lengths, max_batch_size=16, max_batch_units=65536):
+    """
+    Groups sequence indices into batches of similar length so little compute is spent on padding.
+
+    Indices are sorted by length and cut into consecutive batches of at most max_batch_size
+    sequences whose padded size (batch_size * longest length) stays within max_batch_units.
+    A single sequence longer than max_batch_units still gets a batch of its own.
+    """
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    batches = []
+    current = []
+    for index in order:
+        # Sorted ascending, so the newest sequence is always the longest in the batch
+        padded_units = (len(current) + 1) * int(lengths[index])
+        if current and (len(current) == max_batch_size or padded_units > max_batch_units):
+            batches.append(current)
+            current = []
+        current.append(int(index))
+    if current:
+        batches.append(current)
+    return batches
+
+class SegbotBatchSegmenter:
+    """
+    Segments many documents per inference call with segbot_segmenter.onnx.
+
+    Documents are bucketed by length, padded, and run together; the lengths input keeps
+    padded positions out of the pointer softmax, so results match one-by-one inference.
+    """
+    def __init__(self, onnx_file_path="segbot_segmenter.onnx", max_batch_size=16, max_batch_units=65536, session_options=None):
+        self.session = create_shared_session(onnx_file_path, session_options)
+        self.max_batch_size = max_batch_size
+        self.max_batch_units = max_batch_units
+
+    def segment(self, features_list, start_unit=0):
+        """
+        Returns the boundary unit indices of every document, in input order.
+        Each entry of features_list is a (seq_len, input_dim) array of unit features.
+        """
+        lengths = [len(features) for features in features_list]
+        results = [None] * len(features_list)
+        for batch in bucket_by_length(lengths, self.max_batch_size, self.max_batch_units):
+            input_x, batch_lengths = pad_batch([features_list[index] for index in batch])
+            boundaries = self.session.run(["boundaries"], {
+                "input_x": input_x,
+                "start_units": np.array(start_unit, dtype=np.int64),
+                "lengths": batch_lengths,
+            })[0]
+            for row, index in enumerate(batch):
+                # Rows are padded with -1 once their document is fully segmented
+                results[index] = boundaries[row][boundaries[row] >= 0]
+        return results
+
+class StreamingSegbotSegmenter:
+    """
+    Segments an unbounded stream of unit features with bounded memory, using the staged
+    export (segbot_encoder.onnx + segbot_step.onnx) from convert_segbot_to_onnx.py.
+
+    Units are encoded in windows of window_size units. Each window starts `overlap` units
+    before the open segment so the bidirectional encoder has left context, and its last
+    `overlap` units only provide right context: a boundary that lands there is provisional
+    and is decided again by the next window, which sees past it. The decoder hidden state
+    is carried from window to window, so decoding continues as if the document were whole.
+
+    A segment longer than window_size - overlap units cannot be seen whole by any window;
+    it is closed at the best-scoring unit the window can commit to.
+    """
+    def __init__(self, encoder_file_path="segbot_encoder.onnx", step_file_path="segbot_step.onnx",
+                 window_size=512, overlap=128, session_options=None):
+        if overlap < 0 or overlap * 2 >= window_size:
+            raise ValueError("overlap must be non-negative and less than half of window_size")
+        self.encoder = create_shared_session(encoder_file_path, session_options)
+        self.step = create_shared_session(step_file_path, session_options)
+        self.window_size = window_size
+        self.overlap = overlap
+        decoder_hidden_input = next(i for i in self.step.get_inputs() if i.name == "decoder_hidden")
+        self.decoder_hidden_dim = decoder_hidden_input.shape[2]
+
+    def segment_stream(self, feature_chunks):
+        """
+        Consumes an iterable of (num_units, input_dim) feature arrays and yields absolute
+        boundary unit indices as soon as they are final.
+        """
+        chunks = iter(feature_chunks)
+        buffer = None # Units from `offset` onwards that are still needed
+        offset = 0 # Absolute index of buffer[0]
+        start = 0 # Absolute index of the first unit of the open segment
+        decoder_hidden = np.zeros((1, 1, self.decoder_hidden_dim), dtype=np.float32)
+        exhausted = False
+
+        while True:
+            # Read until the buffer can fill a window with right context to spare, or the stream ends
+            while not exhausted and (buffer is None or len(buffer) <= self.window_size):
+                chunk = next(chunks, None)
+                if chunk is None:
+                    exhausted = True
+                else:
+                    chunk = np.asarray(chunk, dtype=np.float32)
+                    buffer = chunk if buffer is None else np.concatenate([buffer, chunk])
+            if buffer is None or start - offset >= len(buffer):
+                return
+
+            final = exhausted and len(buffer) <= self.window_size
+            window = buffer[:self.window_size]
+            # Boundaries at or past commit_limit only have partial right context in this window
+            commit_limit = len(window) if final else len(window) - self.overlap
+            boundaries, start, decoder_hidden = self._decode_window(window, start - offset, commit_limit, final, decoder_hidden)
+            for boundary in boundaries:
+                yield offset + boundary
+            start += offset
+
+            if final:
+                return
+            # Keep `overlap` units of left context before the open segment
+            next_offset = max(start - self.overlap, offset)
+            buffer = buffer[next_offset - offset:]
+            offset = next_offset
+
+    def _decode_window(self, window, relative_start, commit_limit, final, decoder_hidden):
+        lengths = np.array([len(window)], dtype=np.int64)
+        encoder_outputs, encoder_projection = self.encoder.run(None, {"input_x": window[np.newaxis], "lengths": lengths})
+        boundaries = []
+        while relative_start < commit_limit:
+            attention_weights, next_hidden = self.step.run(None, {
+                "encoder_outputs": encoder_outputs,
+                "encoder_projection": encoder_projection,
+                "start_units": np.array([relative_start], dtype=np.int64),
+                "decoder_hidden": decoder_hidden,
+                "lengths": lengths,
+            })
+            # A boundary can never lie before the unit the segment starts at
+            weights = attention_weights[0, :, 0]
+            boundary = relative_start + int(np.argmax(weights[relative_start:]))
+            if boundary >= commit_limit and not final:
+                if boundaries:
+                    break # Provisional; the next window decides it with full right context
+                # Nothing committed yet, so close the segment where this window can still commit
+                boundary = relative_start + int(np.argmax(weights[relative_start:commit_limit]))
+            boundaries.append(boundary)
+            decoder_hidden = next_hidden
+            relative_start = boundary + 1
+        return boundaries, relative_start, decoder_hidden
@@ -3,47 +3,204 @@ import subprocess
 import shutil
 import platform
 import os
+import re
+import argparse
 import textwrap
 import urllib.request
 import tempfile
 import json
+import hashlib
+import threading
+import time
+import statistics
+from datetime import datetime, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from pathlib import Path
+from types import SimpleNamespace
 from typing import List, Dict, Optional
 
-# Install third-party packages if missing
-for pkg in ["rich", "questionary"]:
+STATE_FILE = ".vibe.json"
+FIREBASE_CLI = "firebase.cmd" if platform.system() == "Windows" else "firebase"
+NPM_CLI = "npm.cmd" if platform.system() == "Windows" else "npm"
+OUTPUT_TAIL_LINES = 20 # Lines of a background step's output kept for the progress table and error reports
+HISTORY_LIMIT = 50 # Setup runs kept in the state file for timing trends
+SPARKLINE = "▁▂▃▄▅▆▇█"
+ENVIRONMENTS = ["Development", "Production"]
+
+# Resolved by main() from flags, environment variables and the optional config file
+SETTINGS = {"headless": False, "environment": None, "mongodb_uri": None}
+
+# ------------------ UI (loaded lazily) ------------------
+
+def ensure_package(pkg: str):
+    # Install third-party packages if missing, the first time they are needed
     try:
         __import__(pkg)
     except ImportError:
         subprocess.check_call([sys.executable, "-m", "pip", "install", pkg])
 
-from rich.console import Console
-from rich.panel import Panel
-from rich.text import Text
-from rich.align import Align
-from rich import box
-from rich.markdown import Markdown
-from rich.table import Table
-from rich.progress import Progress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn
-import questionary
+def ui():
+    """
+    The rich classes the wizard draws with. Imported on first use so headless runs and
+    --summary do not pay for the full UI stack.
+    """
+    ensure_package("rich")
+    from rich.console import Console
+    from rich.panel import Panel
+    from rich.text import Text
+    from rich.align import Align
+    from rich import box
+    from rich.table import Table
+    from rich.live import Live
+    return SimpleNamespace(Console=Console, Panel=Panel, Text=Text, Align=Align, box=box, Table=Table, Live=Live)
+
+def prompts():
+    ensure_package("questionary")
+    import questionary
+    return questionary
+
+MARKUP_PATTERN = re.compile(r"\[/?(?:bold|red|green|yellow|cyan|blue|white|link)[^\]]*\]|\[/\]")
+
+def strip_markup(message) -> str:
+    return MARKUP_PATTERN.sub("", str(message))
+
+class PlainTable:
+    """
+    Stand-in for rich's Table in headless mode, rendered as aligned plain-text columns.
+    """
+    def __init__(self, title: str):
+        self.title = title
+        self.columns = []
+        self.rows = []
+
+    def add_column(self, header: str, **kwargs):
+        self.columns.append(header)
+
+    def add_row(self, *cells):
+        self.rows.append([strip_markup(cell) for cell in cells])
+
+    def __str__(self):
+        widths = [max([len(header)] + [len(row[i]) for row in self.rows]) for i, header in enumerate(self.columns)]
+        lines = [self.title]
+        for row in [self.columns] + self.rows:
+            lines.append("  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip())
+        return "\n".join(lines)
+
+class PlainConsole:
+    """
+    Stand-in for rich's Console in headless mode: one plain log line per message.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
 
-console = Console()
+    def print(self, *objects, **kwargs):
+        with self.lock:
+            print(*(strip_markup(obj) for obj in objects), flush=True)
 
-STATE_FILE = ".vibe.json"
-FIREBASE_CLI = "firebase.cmd" if platform.system() == "Windows" else "firebase"
-NPM_CLI = "npm.cmd" if platform.system() == "Windows" else "npm"
+    def clear(self):
+        pass
+
+class LazyConsole:
+    # Creates the real console on first use, once main() has decided between rich and plain output
+    def __init__(self):
+        self.console = None
+
+    def get(self):
+        if self.console is None:
+            self.console = PlainConsole() if SETTINGS["headless"] else ui().Console()
+        return self.console
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+console = LazyConsole()
+
+class PlainLive:
+    """
+    Headless stand-in for rich's Live: steps log their progress line by line instead.
+    """
+    def __init__(self):
+        self.console = console
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def update(self, renderable):
+        pass
+
+def make_table(title: str):
+    if SETTINGS["headless"]:
+        return PlainTable(title)
+    rich = ui()
+    return rich.Table(title=title, box=rich.box.ROUNDED)
+
+_tool_versions = {}
+
+def tool_version(command: str) -> str:
+    # `command --version`, looked up once per run since several steps share tools
+    if command not in _tool_versions:
+        if shutil.which(command) is None:
+            _tool_versions[command] = "missing"
+        else:
+            result = subprocess.run([command, "--version"], capture_output=True, text=True, shell=(platform.system() == "Windows"))
+            _tool_versions[command] = result.stdout.strip() or f"exit {result.returncode}"
+    return _tool_versions[command]
+
+def file_digest(path: str) -> str:
+    if not os.path.isfile(path):
+        return "missing"
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+# CPU time of child processes reaped by background steps, which os.times() also counts
+_background_child_cpu = 0.0
+_background_child_lock = threading.Lock()
+
+def children_cpu_seconds() -> float:
+    times = os.times()
+    return times.children_user + times.children_system
+
+def wait_child(process) -> float:
+    """
+    Waits for a Popen process and returns the CPU time it used. os.wait4 reports it for
+    this child alone, so steps running side by side are not charged for each other.
+    """
+    global _background_child_cpu
+    if not hasattr(os, "wait4"): # Windows
+        process.wait()
+        return 0.0
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    cpu = usage.ru_utime + usage.ru_stime
+    with _background_child_lock:
+        _background_child_cpu += cpu
+    return cpu
+
+def format_seconds(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+    if seconds < 60:
+        return f"{seconds:.1f}s"
+    return f"{int(seconds // 60)}m{int(seconds % 60):02d}s"
 
 def clear_screen():
-    if platform.system() == "Windows":
-        subprocess.run(["cls"], shell=True)
-    else:
-        subprocess.run(["clear"], shell=True)
+    # An escape sequence instead of a `clear`/`cls` subprocess; headless logs are never cleared
+    if not SETTINGS["headless"]:
+        console.clear()
 
 # ------------------ Pipeline State Manager ------------------
 
 class SetupState:
     def __init__(self):
         self.state = {}
+        self.lock = threading.Lock() # Steps running in parallel update the state file concurrently
         self.load()
 
     def load(self):
@@ -56,8 +213,9 @@ class SetupState:
             json.dump(self.state, f, indent=2)
 
     def update(self, key: str, value):
-        self.state[key] = value
-        self.save()
+        with self.lock:
+            self.state[key] = value
+            self.save()
 
     def get(self, key: str, default=None):
         return self.state.get(key, default)
@@ -65,9 +223,73 @@ class SetupState:
     def show_summary(self):
         console.print("\n[bold cyan]Setup Summary[/bold cyan]")
         self.print_final_progress_table()
+        self.print_timing_report()
+
+    def record_run(self, run: Dict):
+        history = self.get("history", []) + [run]
+        self.update("history", history[-HISTORY_LIMIT:])
+
+    def timing_stats(self) -> Dict[str, Dict]:
+        """
+        Per-step wall-clock statistics over the recorded runs that completed the step.
+        trend compares the latest duration with the median of the earlier ones.
+        """
+        durations = {}
+        for run in self.get("history", []):
+            for name, timing in run["steps"].items():
+                if timing["status"] == "ok":
+                    durations.setdefault(name, []).append(timing["wall_seconds"])
+        stats = {}
+        for name, values in durations.items():
+            earlier = statistics.median(values[:-1]) if len(values) > 1 else None
+            stats[name] = {
+                "runs": len(values),
+                "last_seconds": values[-1],
+                "median_seconds": round(statistics.median(values), 3),
+                "max_seconds": max(values),
+                "trend": round((values[-1] - earlier) / earlier, 3) if earlier else None,
+                "recent_seconds": values[-10:],
+            }
+        return stats
+
+    def print_timing_report(self):
+        stats = self.timing_stats()
+        if not stats:
+            console.print("[yellow]No timing history recorded yet.[/yellow]")
+            return
+
+        table = make_table("Step Timings")
+        table.add_column("Step", justify="left")
+        table.add_column("Runs", justify="right")
+        table.add_column("Last", justify="right")
+        table.add_column("Median", justify="right")
+        table.add_column("Max", justify="right")
+        table.add_column("Trend", justify="right")
+        table.add_column("Recent", justify="left")
+        for name, step in stats.items():
+            if step["trend"] is None:
+                trend = "-"
+            else:
+                color = "red" if step["trend"] > 0.1 else "green" if step["trend"] < -0.1 else "white"
+                trend = f"[{color}]{step['trend']:+.0%}[/{color}]"
+            peak = max(step["recent_seconds"]) or 1
+            sparkline = "".join(SPARKLINE[min(int(value / peak * (len(SPARKLINE) - 1)), len(SPARKLINE) - 1)] for value in step["recent_seconds"])
+            table.add_row(name, str(step["runs"]), format_seconds(step["last_seconds"]), format_seconds(step["median_seconds"]),
+                          format_seconds(step["max_seconds"]), trend, sparkline)
+        console.print(table)
+
+        slowest = sorted(stats.items(), key=lambda item: item[1]["median_seconds"], reverse=True)[:3]
+        console.print("[bold]Slowest steps:[/bold] " + ", ".join(f"{name} ({format_seconds(step['median_seconds'])})" for name, step in slowest))
+
+    def export_timings(self, path: str):
+        # Machine-readable report for tracking setup-time regressions in CI
+        report = {"history": self.get("history", []), "steps": self.timing_stats()}
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        console.print(f"[green]Timing report written to {path}[/green]")
 
     def print_final_progress_table(self):
-        table = Table(title="ViBe Setup Progress", box=box.ROUNDED)
+        table = make_table("ViBe Setup Progress")
         table.add_column("#", justify="center")
         table.add_column("Step", justify="left")
         table.add_column("Description", justify="left")
@@ -91,20 +313,91 @@ class SetupState:
 # ------------------ Base Step Class ------------------
 
 class PipelineStep:
-    def __init__(self, name: str, description: str, instructions: Optional[str] = None):
+    def __init__(self, name: str, description: str, instructions: Optional[str] = None,
+                 depends_on: Optional[List[str]] = None, interactive: bool = False,
+                 input_files: Optional[List[str]] = None, input_tools: Optional[List[str]] = None,
+                 input_env: Optional[List[str]] = None):
         self.name = name
         self.description = description
         self.instructions = instructions
+        # What the step's result depends on; a change to any of them makes the step run again
+        self.input_files = input_files or []
+        self.input_tools = input_tools or []
+        self.input_env = input_env or []
+        # Names of the steps that must complete before this one starts
+        self.depends_on = depends_on or []
+        # Interactive steps own the terminal and run one at a time; the others run in the background
+        self.interactive = interactive
+        # Set by the pipeline while the step runs in the background, so its output goes to the progress table
+        self.output = None
+        # CPU time of the commands the step ran through run_command in the background
+        self.child_cpu_seconds = 0.0
+
+    def fingerprint(self) -> Optional[str]:
+        """
+        Hash of the step's declared inputs: file contents, tool versions and environment
+        variables. None for steps that declare no inputs, which only ever run once.
+        """
+        if not (self.input_files or self.input_tools or self.input_env):
+            return None
+        digest = hashlib.sha256()
+        for path in sorted(self.input_files):
+            digest.update(f"file:{path}:{file_digest(path)}\n".encode())
+        for command in sorted(self.input_tools):
+            digest.update(f"tool:{command}:{tool_version(command)}\n".encode())
+        for name in sorted(self.input_env):
+            digest.update(f"env:{name}:{os.environ.get(name, '')}\n".encode())
+        return digest.hexdigest()
 
     def should_run(self, state: SetupState) -> bool:
-        return not state.get(self.name)
+        record = state.get(self.name)
+        if not record:
+            return True
+        fingerprint = self.fingerprint()
+        if fingerprint is None:
+            return False
+        if record is True:
+            # Completed before inputs were tracked; take the current inputs as its baseline
+            state.update(self.name, {"done": True, "fingerprint": fingerprint})
+            return False
+        return record.get("fingerprint") != fingerprint
 
     def run(self, state: SetupState):
         raise NotImplementedError("Each step must implement a run method")
 
     def display_instructions(self):
-        if self.instructions:
-            console.print(Panel(self.instructions, title=f"[bold cyan]{self.name} - Instructions[/bold cyan]"))
+        # Instructions are for a person at the terminal, headless runs have none
+        if self.instructions and not SETTINGS["headless"]:
+            console.print(ui().Panel(self.instructions, title=f"[bold cyan]{self.name} - Instructions[/bold cyan]"))
+
+    def echo(self, message: str):
+        if self.output is None:
+            console.print(message)
+        else:
+            self.output.append(strip_markup(message))
+            if SETTINGS["headless"]:
+                console.print(f"{self.name} | {strip_markup(message)}")
+
+    def run_command(self, args, check: bool = True, **kwargs):
+        """
+        subprocess.run for steps: in the background the command's output is collected line
+        by line into self.output instead of being written over other steps' output.
+        """
+        if self.output is None:
+            return subprocess.run(args, check=check, **kwargs)
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, stdin=subprocess.DEVNULL,
+                                   text=True, errors="replace", **kwargs)
+        for line in process.stdout:
+            if line.strip():
+                self.output.append(line.rstrip())
+                if SETTINGS["headless"]:
+                    # Plain logs interleave background steps line by line, prefixed with the step
+                    console.print(f"{self.name} | {line.rstrip()}")
+        self.child_cpu_seconds += wait_child(process)
+        returncode = process.returncode
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, args)
+        return subprocess.CompletedProcess(args, returncode)
 
 # ------------------ Step Implementations ------------------
 
@@ -113,13 +406,20 @@ class WelcomeStep(PipelineStep):
         super().__init__("Welcome", "Select environment")
 
     def run(self, state):
-        title = Text("🚀 ViBe Setup Wizard 🚀", style="bold white on blue", justify="center")
-        console.print(Align.center(title))
-        panel = Panel("[green]Welcome to the ViBe backend setup process![/green]", title="[bold cyan]Welcome[/bold cyan]", border_style="green", box=box.ROUNDED)
-        console.print("\n")
-        console.print(panel)
-        console.print("\n")
-        environment = questionary.select("Choose environment:", choices=["Development", "Production"]).ask()
+        if SETTINGS["headless"]:
+            environment = SETTINGS["environment"] or "Development"
+            console.print(f"ViBe setup (headless), environment: {environment}")
+        elif SETTINGS["environment"]:
+            environment = SETTINGS["environment"]
+        else:
+            rich = ui()
+            title = rich.Text("🚀 ViBe Setup Wizard 🚀", style="bold white on blue", justify="center")
+            console.print(rich.Align.center(title))
+            panel = rich.Panel("[green]Welcome to the ViBe backend setup process![/green]", title="[bold cyan]Welcome[/bold cyan]", border_style="green", box=rich.box.ROUNDED)
+            console.print("\n")
+            console.print(panel)
+            console.print("\n")
+            environment = prompts().select("Choose environment:", choices=ENVIRONMENTS).ask()
         state.update("environment", environment)
         if environment == "Development":
             pass
@@ -129,9 +429,14 @@ class WelcomeStep(PipelineStep):
         state.update(self.name, True)
         return environment
 
+# Manifests of the pnpm workspace (pnpm-workspace.yaml); the root install below installs all of them
+WORKSPACE_MANIFESTS = ["package.json", "pnpm-lock.yaml", "pnpm-workspace.yaml",
+                       os.path.join("backend", "package.json"), os.path.join("frontend", "package.json")]
+
 class ToolchainCheckStep(PipelineStep):
     def __init__(self):
-        super().__init__("ToolChain Check", "Verify Node.js, npm, pnpm, and firebase-tools are installed")
+        super().__init__("ToolChain Check", "Verify Node.js, npm, pnpm, and firebase-tools are installed", interactive=True,
+                         input_files=WORKSPACE_MANIFESTS, input_tools=["node", "npm", "pnpm", "firebase"])
 
     def run(self, state):
         def check_command_exists(command):
@@ -163,7 +468,8 @@ class ToolchainCheckStep(PipelineStep):
 
         console.print(":white_check_mark: [green]Toolchain verified.[/green]")
         
-        # run pnpm install command in the current directory
+        # The one install of the whole workspace: backend/ and frontend/ are members, so this links
+        # their packages too, and the package steps below only check the result
         console.print("[yellow]⚠ Installing pnpm dependencies...[/yellow]")
         subprocess.run(["pnpm", "install"], check=True, shell=(platform.system() == "Windows"))
         console.print("[green]✅ pnpm dependencies installed successfully.[/green]")
@@ -171,21 +477,39 @@ class ToolchainCheckStep(PipelineStep):
 
 class FirebaseLoginStep(PipelineStep):
     def __init__(self):
-        super().__init__("Firebase Login", "Ensure Firebase CLI is logged in")
+        super().__init__("Firebase Login", "Ensure Firebase CLI is logged in",
+                         depends_on=["ToolChain Check"], interactive=True)
 
     def run(self, state):
         result = subprocess.run([FIREBASE_CLI, "login:list"], capture_output=True, text=True, shell=(platform.system() == "Windows"))
         if "No authorized accounts" in result.stdout:
-            subprocess.run([FIREBASE_CLI, "login"], check=True, shell=(platform.system() == "Windows"))
+            if SETTINGS["headless"]:
+                # `firebase login` opens a browser; unattended builds authenticate with a token instead
+                if not os.environ.get("FIREBASE_TOKEN"):
+                    console.print("[red]❌ Firebase CLI is not logged in. Set FIREBASE_TOKEN for headless setup.[/red]")
+                    sys.exit(1)
+            else:
+                subprocess.run([FIREBASE_CLI, "login"], check=True, shell=(platform.system() == "Windows"))
         state.update(self.name, True)
 
 class FirebaseEmulatorsStep(PipelineStep):
     def __init__(self, backend_dir):
         super().__init__("Emulators", "Initialize Firebase emulators",
-                                    instructions="Please choose ONLY the following emulators when prompted:\n\n✔ Authentication Emulator\n✔ Functions Emulator\n✔ Emulator UI [optional but recommended]")
+                                    instructions="Please choose ONLY the following emulators when prompted:\n\n✔ Authentication Emulator\n✔ Functions Emulator\n✔ Emulator UI [optional but recommended]",
+                                    depends_on=["Firebase Login"], interactive=True)
         self.backend_dir = backend_dir
 
     def run(self, state):
+        if SETTINGS["headless"]:
+            # `firebase init` is a questionnaire; headless setup relies on the committed emulator config
+            config_path = os.path.join(self.backend_dir, "firebase.json")
+            if os.path.exists(config_path):
+                with open(config_path) as f:
+                    if "emulators" in json.load(f):
+                        state.update(self.name, True)
+                        return
+            console.print(f"[red]❌ No emulator configuration in {config_path}. Run setup interactively once.[/red]")
+            sys.exit(1)
         subprocess.run([FIREBASE_CLI, "init", "emulators"], cwd=self.backend_dir, check=True, shell=(platform.system() == "Windows"))
         state.update(self.name, True)
 
@@ -204,34 +528,63 @@ class EnvFileStep(PipelineStep):
                                     7.  Copy the connection string.
                                     8.  [bold red]Replace '<password>' in the copied string with the actual password[/bold red] you created for the database user.
                                     9.  Paste the modified connection string below.
-                                    """)
+                                    """,
+                                    interactive=True, input_files=[os.path.join(backend_dir, ".env")])
         self.backend_dir = backend_dir
 
     def run(self, state):
         env_path = os.path.join(self.backend_dir, ".env")
         if not os.path.exists(env_path):
-            uri = questionary.text("Paste your MongoDB URI:").ask()
+            uri = SETTINGS["mongodb_uri"]
+            if not uri and SETTINGS["headless"]:
+                console.print("[red]❌ backend/.env is missing. Pass --mongodb-uri or set VIBE_MONGODB_URI.[/red]")
+                sys.exit(1)
+            if not uri:
+                uri = prompts().text("Paste your MongoDB URI:").ask()
             with open(env_path, "w") as f:
                 f.write(f"DB_URL=\"{uri}\"\n")
         state.update(self.name, True)
 
+def missing_packages(package_dir: str) -> List[str]:
+    """
+    Dependencies in a workspace member's package.json that are not linked into its
+    node_modules. Only reads the file system, so package steps can run side by side.
+    """
+    with open(os.path.join(package_dir, "package.json")) as f:
+        manifest = json.load(f)
+    names = {**manifest.get("dependencies", {}), **manifest.get("devDependencies", {})}
+    return sorted(name for name in names if not os.path.isdir(os.path.join(package_dir, "node_modules", *name.split("/"))))
+
+def check_workspace_packages(step: PipelineStep, package_dir: str, label: str):
+    # A second pnpm install here would reinstall the whole workspace, racing the other package steps
+    missing = missing_packages(package_dir)
+    if missing:
+        raise RuntimeError(f"{len(missing)} {label} package(s) are not installed ({', '.join(missing[:5])}); "
+                           "run `pnpm install` in the repository root and re-run the setup")
+    step.echo(f"[green]✅ {label.capitalize()} dependencies installed by the workspace install.[/green]")
+
 class PackageInstallStep(PipelineStep):
     def __init__(self, backend_dir):
-        super().__init__("Backend Packages", "Install backend dependencies")
+        # The workspace lockfile at the repository root pins the backend's packages
+        super().__init__("Backend Packages", "Check backend dependencies", depends_on=["ToolChain Check"],
+                         input_files=[os.path.join(backend_dir, "package.json"), "pnpm-lock.yaml"],
+                         input_tools=["node", "pnpm"])
         self.backend_dir = backend_dir
 
     def run(self, state):
-        with console.status("Installing backend dependencies..."):
-            subprocess.run(["pnpm", "install"], cwd=self.backend_dir, check=True, shell=(platform.system() == "Windows"))
-            state.update(self.name, True)
+        check_workspace_packages(self, self.backend_dir, "backend")
+        state.update(self.name, True)
 
 class MongoDBBinaryStep(PipelineStep):
     def __init__(self, backend_dir):
-        super().__init__("MongoDB Test Binaries", "Ensure MongoDB binaries for in-memory server are downloaded")
+        # mongodb-memory-server itself comes from the backend packages, which the workspace install provides
+        super().__init__("MongoDB Test Binaries", "Ensure MongoDB binaries for in-memory server are downloaded",
+                         depends_on=["ToolChain Check"],
+                         input_files=["pnpm-lock.yaml"], input_env=["MONGOMS_VERSION", "MONGOMS_DOWNLOAD_DIR"])
         self.backend_dir = backend_dir
 
     def run(self, state):
-        console.print("[cyan]Ensuring MongoDB binaries are downloaded for mongodb-memory-server...[/cyan]")
+        self.echo("[cyan]Ensuring MongoDB binaries are downloaded for mongodb-memory-server...[/cyan]")
         script = textwrap.dedent("""
         import { MongoMemoryServer } from 'mongodb-memory-server';
 
@@ -242,83 +595,247 @@ class MongoDBBinaryStep(PipelineStep):
         })();
         """)
         try:
-            subprocess.run(["pnpx", "ts-node", "-e", script], check=True, cwd=self.backend_dir, shell=(platform.system() == "Windows"))
+            self.run_command(["pnpx", "ts-node", "-e", script], cwd=self.backend_dir, shell=(platform.system() == "Windows"))
             state.update(self.name, True)
         except subprocess.CalledProcessError as e:
-            console.print(f"[red]❌ Failed to download MongoDB binaries: {e}[/red]")
+            self.echo(f"[red]❌ Failed to download MongoDB binaries: {e}[/red]")
             sys.exit(1)
 
 class TestStep(PipelineStep):
     def __init__(self, backend_dir):
-        super().__init__("Backend Tests", "Run backend tests")
+        super().__init__("Backend Tests", "Run backend tests",
+                         depends_on=["Emulators", "Env Variables", "Backend Packages", "MongoDB Test Binaries"],
+                         input_files=[os.path.join(backend_dir, "package.json"), os.path.join(backend_dir, ".env"), "pnpm-lock.yaml"],
+                         input_tools=["node"])
         self.backend_dir = backend_dir
 
     def run(self, state):
-        with console.status("Running backend tests..."):
-            result = subprocess.run(["pnpm", "run", "test:ci"], cwd=self.backend_dir, shell=(platform.system() == "Windows"))
-            if result.returncode == 0:
-                console.print("[green]✅ All tests passed! Backend setup complete.")
-                state.update(self.name, True)
-            else:
-                console.print("[red]❌ Tests failed. Please fix and re-run the setup.")
-                sys.exit(1)
+        self.echo("Running backend tests...")
+        result = self.run_command(["pnpm", "run", "test:ci"], check=False, cwd=self.backend_dir, shell=(platform.system() == "Windows"))
+        if result.returncode == 0:
+            self.echo("[green]✅ All tests passed! Backend setup complete.")
+            state.update(self.name, True)
+        else:
+            self.echo("[red]❌ Tests failed. Please fix and re-run the setup.")
+            sys.exit(1)
 
 class FrontendPackageInstallStep(PipelineStep):
     def __init__(self, frontend_dir):
-        super().__init__("Frontend Packages", "Install frontend dependencies")
+        # pnpm ignores lockfiles inside workspace members; the root one pins the frontend's packages
+        super().__init__("Frontend Packages", "Check frontend dependencies", depends_on=["ToolChain Check"],
+                         input_files=[os.path.join(frontend_dir, "package.json"), "pnpm-lock.yaml"],
+                         input_tools=["node", "pnpm"])
         self.frontend_dir = frontend_dir
 
     def run(self, state):
-        subprocess.run(["pnpm", "install"], cwd=self.frontend_dir, check=True, shell=(platform.system() == "Windows"))
+        check_workspace_packages(self, self.frontend_dir, "frontend")
         state.update(self.name, True)
 
 # ------------------ Pipeline Manager ------------------
 
 class SetupPipeline:
-    def __init__(self, steps: List[PipelineStep], state: SetupState):
+    """
+    Runs the steps as a dependency graph. Background steps whose dependencies are done run
+    in parallel on a worker pool while interactive steps take the terminal one at a time.
+    The progress table shows the latest output line of every running background step.
+    """
+    def __init__(self, steps: List[PipelineStep], state: SetupState, max_workers: int = 4):
         self.steps = steps
         self.state = state
+        self.max_workers = max_workers
+        self.running = set()
+        self.failed = set()
+        self.timings = {}
 
-    def print_progress_table(self, current_step_name):
-        table = Table(title="ViBe Setup Progress", box=box.ROUNDED)
+    def progress_table(self):
+        table = make_table("ViBe Setup Progress")
         table.add_column("#", justify="center")
         table.add_column("Step", justify="left")
         table.add_column("Description", justify="left")
         table.add_column("Status", justify="center")
+        table.add_column("Time", justify="right")
+        table.add_column("Output", justify="left", overflow="ellipsis", no_wrap=True, max_width=60)
 
         for index, step in enumerate(self.steps, 1):
             if self.state.get(step.name):
                 status = "✅"
-            elif step.name == current_step_name:
+            elif step.name in self.failed:
+                status = "❌"
+            elif step.name in self.running:
                 status = "🔄"
             else:
                 status = "⏳"
-            table.add_row(str(index), step.name, step.description, status)
+            last_line = step.output[-1] if step.output and step.name in self.running else ""
+            timing = self.timings.get(step.name)
+            duration = format_seconds(timing["wall_seconds"]) if timing else ""
+            table.add_row(str(index), step.name, step.description, status, duration, last_line)
+        return table
 
-        console.print(table)
+    def print_progress_table(self):
+        console.print(self.progress_table())
+
+    def is_ready(self, step: PipelineStep) -> bool:
+        # Dependencies on steps outside this pipeline are assumed to be handled elsewhere
+        names = {s.name for s in self.steps}
+        return all(self.state.get(dep) or dep not in names for dep in step.depends_on)
 
     def run(self):
         serializable_steps = [{"name": step.name, "description": step.description} for step in self.steps]
         self.state.update("steps", serializable_steps)
 
-        for step in self.steps:
-            if step.should_run(self.state):
-                clear_screen()
-                self.print_progress_table(step.name)
-                if step.instructions:
-                    step.display_instructions()
-                step.run(self.state)
+        started = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        started_clock = time.perf_counter()
+        pending = [step for step in self.steps if step.should_run(self.state)]
+        for step in pending:
+            # A stale step counts as not done until it has run again, so its dependents wait for it
+            if self.state.get(step.name):
+                self.state.update(step.name, False)
+        futures = {}
+        failure = None
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            if SETTINGS["headless"]:
+                live = PlainLive()
+            else:
+                live = ui().Live(self.progress_table(), console=console.get(), refresh_per_second=4, transient=True)
+            live.start()
+            try:
+                while pending or futures:
+                    if failure is None:
+                        for step in [s for s in pending if not s.interactive and self.is_ready(s)]:
+                            pending.remove(step)
+                            step.output = deque(maxlen=OUTPUT_TAIL_LINES)
+                            self.running.add(step.name)
+                            futures[pool.submit(self.run_step, step)] = step
+
+                        interactive = next((s for s in pending if s.interactive and self.is_ready(s)), None)
+                        if interactive is not None:
+                            pending.remove(interactive)
+                            live.stop()
+                            failure = self.run_interactive(interactive)
+                            live.start()
+                            live.update(self.progress_table())
+                            continue
+
+                    if not futures:
+                        if failure is None and pending:
+                            failure = RuntimeError("Steps with unmet dependencies: " + ", ".join(s.name for s in pending))
+                        break
+                    done, _ = wait(futures, timeout=0.25, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        step = futures.pop(future)
+                        self.running.discard(step.name)
+                        try:
+                            future.result()
+                        except BaseException as e:
+                            # Let the other running steps finish, but start nothing new
+                            self.failed.add(step.name)
+                            failure = failure or e
+                            if not SETTINGS["headless"]: # Headless logs already contain the output
+                                live.console.print(ui().Panel("\n".join(step.output), title=f"[red]{step.name} failed[/red]"))
+                    live.update(self.progress_table())
+            finally:
+                live.stop()
+
+        if self.timings:
+            self.state.record_run({"started": started, "host": platform.node(), "platform": platform.platform(),
+                                   "total_seconds": round(time.perf_counter() - started_clock, 3), "steps": self.timings})
+        if failure is not None:
+            self.print_progress_table()
+            raise failure
         clear_screen()
-        self.print_progress_table("done")
+        self.print_progress_table()
         console.print("\n[bold green]🎉 Setup completed![/bold green]")
         console.print("\n[bold blue]👉 Run `pnpm run dev` in the backend and frontend directories to start the servers.[/bold blue]")
 
+    def run_step(self, step: PipelineStep):
+        """
+        Runs a step and records its wall-clock time, the CPU time of its own thread and the
+        CPU time of the child processes it started.
+        """
+        background = step.output is not None
+        step.child_cpu_seconds = 0.0
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        children_start, background_start = children_cpu_seconds(), _background_child_cpu
+        status = "failed"
+        if SETTINGS["headless"]:
+            console.print(f"{step.name} | started")
+        try:
+            step.run(self.state)
+            status = "ok"
+        finally:
+            if background:
+                child_cpu = step.child_cpu_seconds
+            else:
+                # Everything reaped meanwhile, minus the commands of background steps
+                child_cpu = (children_cpu_seconds() - children_start) - (_background_child_cpu - background_start)
+            self.timings[step.name] = {
+                "status": status,
+                "wall_seconds": round(time.perf_counter() - wall_start, 3),
+                "cpu_seconds": round(time.thread_time() - cpu_start, 3),
+                "child_cpu_seconds": round(max(child_cpu, 0.0), 3),
+            }
+            if SETTINGS["headless"]:
+                console.print(f"{step.name} | {status} after {format_seconds(self.timings[step.name]['wall_seconds'])}")
+        if self.state.get(step.name):
+            # Fingerprint after the run: installs may rewrite their own lockfiles
+            self.state.update(step.name, {"done": True, "fingerprint": step.fingerprint()})
+
+    def run_interactive(self, step: PipelineStep):
+        # Background steps keep running; their output only reaches the table, so prompts stay readable
+        clear_screen()
+        self.running.add(step.name)
+        if not SETTINGS["headless"]:
+            self.print_progress_table()
+        if step.instructions:
+            step.display_instructions()
+        try:
+            self.run_step(step)
+        except BaseException as e:
+            self.failed.add(step.name)
+            return e
+        finally:
+            self.running.discard(step.name)
+        return None
+
 # ------------------ Main ------------------
 
+def env_flag(name: str) -> bool:
+    return os.environ.get(name, "").strip().lower() in ("1", "true", "yes")
+
+def load_settings(args):
+    """
+    Fills SETTINGS from, in order of precedence, command-line flags, environment variables
+    and the JSON config file ({"headless": true, "environment": "...", "mongodbUri": "..."}).
+    CI=true, as set by most CI services, also turns on headless mode.
+    """
+    config = {}
+    config_path = args.config or os.environ.get("VIBE_SETUP_CONFIG")
+    if config_path:
+        with open(config_path) as f:
+            config = json.load(f)
+    SETTINGS["headless"] = args.headless or env_flag("VIBE_SETUP_HEADLESS") or env_flag("CI") or bool(config.get("headless"))
+    SETTINGS["environment"] = args.environment or os.environ.get("VIBE_ENVIRONMENT") or config.get("environment")
+    SETTINGS["mongodb_uri"] = args.mongodb_uri or os.environ.get("VIBE_MONGODB_URI") or config.get("mongodbUri")
+    if SETTINGS["environment"] and SETTINGS["environment"] not in ENVIRONMENTS:
+        raise SystemExit(f"Unknown environment '{SETTINGS['environment']}'. Expected one of: {', '.join(ENVIRONMENTS)}")
+
 def main():
-    if len(sys.argv) > 1 and sys.argv[1] == "--summary":
+    parser = argparse.ArgumentParser(description="ViBe setup wizard")
+    parser.add_argument("--summary", action="store_true", help="Show setup progress and step timings, then exit")
+    parser.add_argument("--json", nargs="?", const="setup-timings.json", metavar="PATH",
+                        help="With --summary, also write the timing history as JSON for CI")
+    parser.add_argument("--headless", action="store_true", help="No prompts, plain log output (also VIBE_SETUP_HEADLESS=1 or CI=true)")
+    parser.add_argument("--config", metavar="PATH", help="JSON file with setup answers (also VIBE_SETUP_CONFIG)")
+    parser.add_argument("--environment", choices=ENVIRONMENTS, help="Skip the environment prompt (also VIBE_ENVIRONMENT)")
+    parser.add_argument("--mongodb-uri", help="MongoDB URI for backend/.env (also VIBE_MONGODB_URI)")
+    args = parser.parse_args()
+    load_settings(args)
+
+    if args.summary:
         state = SetupState()
         state.show_summary()
+        if args.json:
+            state.export_timings(args.json)
         return
 
     backend_dir = os.path.join(os.getcwd(), "backend")
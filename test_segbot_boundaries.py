@@ -0,0 +1,30 @@
+# test_segbot_boundaries.py
+# Run with: python -m pytest test_segbot_boundaries.py
+import numpy as np
+import pytest
+
+from segbot_boundaries import decode_boundaries
+
+def test_empty_batch_returns_no_rows():
+    assert decode_boundaries(np.zeros((0, 5))) == []
+    assert decode_boundaries(np.zeros((0, 5, 1)), lengths=np.zeros(0, dtype=np.int64)) == []
+
+def test_max_segment_length_below_twice_the_minimum_is_rejected():
+    # min=8, max=10: an 11-unit segment can only be split into parts shorter than 8
+    with pytest.raises(ValueError):
+        decode_boundaries(np.zeros((1, 11)), min_segment_length=8, max_segment_length=10)
+
+@pytest.mark.parametrize("min_segment_length", [1, 2, 3, 8])
+def test_forced_splits_respect_both_limits(min_segment_length):
+    max_segment_length = 2 * min_segment_length - 1 if min_segment_length > 1 else 1
+    rng = np.random.RandomState(0)
+    lengths = np.arange(1, 41)
+    weights = rng.rand(len(lengths), lengths.max())
+    boundaries = decode_boundaries(weights, lengths, min_segment_length=min_segment_length,
+                                   max_segment_length=max_segment_length)
+    for row, length in zip(boundaries, lengths):
+        segment_lengths = np.diff(np.concatenate([[-1], row]))
+        assert row[-1] == length - 1
+        assert segment_lengths.max() <= max_segment_length
+        # A document shorter than the minimum is a single, necessarily short segment
+        assert segment_lengths.min() >= min(min_segment_length, length)
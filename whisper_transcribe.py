@@ -0,0 +1,295 @@
+# whisper_transcribe.py
+# Long-form transcription with the Whisper ONNX export from convert_whisper_to_onnx.py.
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import wave
+
+import numpy as np
+
+from onnx_external_data import create_shared_session
+
+SAMPLING_RATE = 16000
+WINDOW_SECONDS = 30.0 # Whisper's fixed input length
+TIME_PRECISION = 0.02 # Seconds per timestamp token
+
+def load_audio(path, sampling_rate=SAMPLING_RATE):
+    """
+    Decodes an audio or video file to mono float32 samples at sampling_rate with ffmpeg.
+    Without ffmpeg only PCM WAV files can be read.
+    """
+    if shutil.which("ffmpeg"):
+        command = ["ffmpeg", "-nostdin", "-i", path, "-f", "s16le", "-ac", "1", "-ar", str(sampling_rate), "-loglevel", "error", "-"]
+        pcm = subprocess.run(command, capture_output=True, check=True).stdout
+        return np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+
+    with wave.open(path, "rb") as wav:
+        if wav.getsampwidth() != 2:
+            raise ValueError("Without ffmpeg only 16-bit PCM WAV files are supported")
+        channels = wav.getnchannels()
+        rate = wav.getframerate()
+        samples = np.frombuffer(wav.readframes(wav.getnframes()), dtype=np.int16).astype(np.float32) / 32768.0
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if rate != sampling_rate:
+        # Linear resampling is enough for speech recognition input
+        positions = np.arange(int(len(samples) * sampling_rate / rate)) * rate / sampling_rate
+        samples = np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+def split_windows(num_samples, overlap_seconds=5.0, window_seconds=WINDOW_SECONDS, sampling_rate=SAMPLING_RATE):
+    """
+    Returns the start sample of every window so that consecutive windows overlap by
+    overlap_seconds and the last window reaches the end of the audio.
+    """
+    window = int(window_seconds * sampling_rate)
+    stride = window - int(overlap_seconds * sampling_rate)
+    if stride <= 0:
+        raise ValueError("overlap_seconds must be shorter than the window")
+    starts = list(range(0, max(num_samples - window, 0) + 1, stride))
+    if starts[-1] + window < num_samples:
+        starts.append(starts[-1] + stride)
+    return starts
+
+class WhisperOnnxTranscriber:
+    """
+    Transcribes lecture-length audio with encoder_model.onnx and decoder_model_merged.onnx.
+
+    Audio is cut into 30 s windows that overlap by overlap_seconds. Windows go through the
+    encoder batch_size at a time and are greedily decoded together, reusing the decoder's
+    key/value cache so each new token costs one position instead of the whole prefix.
+    Timestamps are shifted back to the original timeline and each overlap is split down
+    the middle between its two windows, so no speech is transcribed twice.
+
+    With a vad (whisper_vad.VoiceActivityDetector) only the speech regions of each recording
+    are windowed and encoded, and timestamps are mapped back across the removed silence.
+    """
+    def __init__(self, model_dir="whisper_onnx", language="en", batch_size=4, overlap_seconds=5.0,
+                 max_new_tokens=224, session_options=None, vad=None):
+        from transformers import WhisperFeatureExtractor, WhisperTokenizer
+
+        self.encoder = create_shared_session(os.path.join(model_dir, "encoder_model.onnx"), session_options)
+        self.decoder = create_shared_session(os.path.join(model_dir, "decoder_model_merged.onnx"), session_options)
+        self.feature_extractor = WhisperFeatureExtractor.from_pretrained(model_dir)
+        self.tokenizer = WhisperTokenizer.from_pretrained(model_dir)
+        self.batch_size = batch_size
+        self.overlap_seconds = overlap_seconds
+        self.max_new_tokens = max_new_tokens
+        self.vad = vad
+
+        with open(os.path.join(model_dir, "generation_config.json")) as f:
+            generation_config = json.load(f)
+        self.eos_token_id = generation_config["eos_token_id"]
+        self.no_timestamps_token_id = generation_config["no_timestamps_token_id"]
+        self.timestamp_begin = self.no_timestamps_token_id + 1
+        self.suppress_tokens = generation_config.get("suppress_tokens") or []
+        self.begin_suppress_tokens = generation_config.get("begin_suppress_tokens") or []
+        self.max_initial_timestamp_index = generation_config.get("max_initial_timestamp_index", 50)
+        # <|startoftranscript|><|language|><|transcribe|>; leaving out <|notimestamps|> turns timestamps on
+        self.prompt = [generation_config["decoder_start_token_id"]]
+        if generation_config.get("lang_to_id"):
+            self.prompt.append(generation_config["lang_to_id"][f"<|{language}|>"])
+        if generation_config.get("task_to_id"):
+            self.prompt.append(generation_config["task_to_id"]["transcribe"])
+
+        self.past_inputs = [i for i in self.decoder.get_inputs() if i.name.startswith("past_key_values.")]
+        self.present_outputs = [name.replace("past_key_values.", "present.") for name in (i.name for i in self.past_inputs)]
+
+    def transcribe(self, audio):
+        """
+        Transcribes mono float32 samples at 16 kHz into the GenAI transcript shape:
+        {"chunks": [{"timestamp": [start_seconds, end_seconds], "text": "..."}]}
+        """
+        return self.transcribe_many([audio])[0]
+
+    def transcribe_many(self, audios):
+        """
+        Transcribes several recordings at once. Windows from all of them share encoder and
+        decoder batches, so short clips submitted together fill a batch between them.
+        """
+        if self.vad is not None:
+            from whisper_vad import compact_audio, remap_transcript
+            speech = [self.vad.speech_regions(audio) for audio in audios]
+            transcripts = self._transcribe_windows([compact_audio(audio, regions) for audio, regions in zip(audios, speech)])
+            return [remap_transcript(transcript, regions) for transcript, regions in zip(transcripts, speech)]
+        return self._transcribe_windows(audios)
+
+    def _transcribe_windows(self, audios):
+        window = int(WINDOW_SECONDS * SAMPLING_RATE)
+        # (recording, window index, window count, start sample) of every window, recording by recording
+        windows = []
+        for recording, audio in enumerate(audios):
+            if len(audio) == 0: # Nothing to encode, e.g. no speech found
+                continue
+            starts = split_windows(len(audio), self.overlap_seconds)
+            windows.extend((recording, index, len(starts), start) for index, start in enumerate(starts))
+
+        transcripts = [{"chunks": []} for _ in audios]
+        for first in range(0, len(windows), self.batch_size):
+            batch = windows[first:first + self.batch_size]
+            batch_audio = [audios[recording][start:start + window] for recording, _, _, start in batch]
+            input_features = self.feature_extractor(batch_audio, sampling_rate=SAMPLING_RATE, return_tensors="np").input_features
+            encoder_hidden_states = self.encoder.run(["last_hidden_state"], {"input_features": input_features.astype(np.float32)})[0]
+
+            for row, tokens in enumerate(self._decode(encoder_hidden_states)):
+                recording, index, count, start_sample = batch[row]
+                chunks = transcripts[recording]["chunks"]
+                offset = start_sample / SAMPLING_RATE
+                duration = len(batch_audio[row]) / SAMPLING_RATE
+                # This window owns its span minus half of each overlap it shares with a neighbour
+                owned_from = offset + (self.overlap_seconds / 2 if index > 0 else 0.0)
+                owned_to = offset + duration - (self.overlap_seconds / 2 if index < count - 1 else 0.0)
+                for start, end, text_tokens in self._segments(tokens, duration):
+                    text = self.tokenizer.decode(text_tokens, skip_special_tokens=True).strip()
+                    start, end = offset + start, offset + end
+                    if not text or not owned_from <= (start + end) / 2 < owned_to:
+                        continue
+                    if chunks:
+                        # A segment kept from the previous window may run into this window's span
+                        start = max(start, chunks[-1]["timestamp"][1])
+                    chunks.append({"timestamp": [round(float(start), 2), round(float(max(start, end)), 2)], "text": text})
+        return transcripts
+
+    def transcribe_file(self, path):
+        """
+        Returns the transcript and timing stats, including the realtime factor
+        (seconds of audio transcribed per second of wall-clock time).
+        """
+        audio = load_audio(path)
+        started = time.perf_counter()
+        transcript = self.transcribe(audio)
+        elapsed = time.perf_counter() - started
+        audio_seconds = len(audio) / SAMPLING_RATE
+        stats = {
+            "audio_seconds": round(audio_seconds, 2),
+            "elapsed_seconds": round(elapsed, 2),
+            "realtime_factor": round(audio_seconds / elapsed, 2) if elapsed else None,
+        }
+        return transcript, stats
+
+    def _decode(self, encoder_hidden_states):
+        # Greedy decoding of a batch of windows with the merged decoder and its key/value cache
+        batch_size = encoder_hidden_states.shape[0]
+        generated = np.tile(np.array(self.prompt, dtype=np.int64), (batch_size, 1))
+        feeds = {
+            "input_ids": generated,
+            "encoder_hidden_states": encoder_hidden_states,
+            "use_cache_branch": np.array([False]),
+        }
+        # The first step runs the no-cache branch, which ignores these empty caches
+        for past in self.past_inputs:
+            feeds[past.name] = np.zeros((batch_size, past.shape[1], 0, past.shape[3]), dtype=np.float32)
+
+        finished = np.zeros(batch_size, dtype=bool)
+        encoder_cache = {}
+        for step in range(self.max_new_tokens):
+            outputs = self.decoder.run(["logits"] + self.present_outputs, feeds)
+            logits = self._apply_timestamp_rules(outputs[0][:, -1, :].astype(np.float32), generated[:, len(self.prompt):])
+            next_tokens = np.where(finished, self.eos_token_id, logits.argmax(axis=-1))
+            generated = np.concatenate([generated, next_tokens[:, np.newaxis]], axis=1)
+            finished |= next_tokens == self.eos_token_id
+            if finished.all():
+                break
+
+            presents = dict(zip(self.present_outputs, outputs[1:]))
+            if step == 0:
+                # Cross-attention keys/values only depend on the audio, so keep the first step's
+                encoder_cache = {name: value for name, value in presents.items() if ".encoder." in name}
+            feeds = {
+                "input_ids": next_tokens[:, np.newaxis].astype(np.int64),
+                "encoder_hidden_states": encoder_hidden_states,
+                "use_cache_branch": np.array([True]),
+            }
+            for past, present in zip(self.past_inputs, self.present_outputs):
+                feeds[past.name] = encoder_cache[present] if ".encoder." in present else presents[present]
+        return [row[len(self.prompt):] for row in generated]
+
+    def _apply_timestamp_rules(self, logits, generated):
+        # Whisper's timestamp constraints: timestamps come in (start, end) pairs around text
+        # and never go backwards. logits shape: (batch_size, vocab_size)
+        logits[:, self.no_timestamps_token_id] = -np.inf
+        if self.suppress_tokens:
+            logits[:, self.suppress_tokens] = -np.inf
+        if generated.shape[1] == 0:
+            if self.begin_suppress_tokens:
+                logits[:, self.begin_suppress_tokens] = -np.inf
+            # Every window opens with a timestamp near its start
+            logits[:, :self.timestamp_begin] = -np.inf
+            logits[:, self.timestamp_begin + self.max_initial_timestamp_index + 1:] = -np.inf
+            return logits
+
+        for row, tokens in enumerate(generated):
+            is_timestamp = tokens >= self.timestamp_begin
+            last_was_timestamp = bool(is_timestamp[-1])
+            penultimate_was_timestamp = len(tokens) < 2 or bool(is_timestamp[-2])
+            if last_was_timestamp:
+                if penultimate_was_timestamp:
+                    logits[row, self.timestamp_begin:] = -np.inf # A pair just closed, text comes next
+                else:
+                    logits[row, :self.eos_token_id] = -np.inf # Text must be closed by a timestamp
+            timestamps = tokens[is_timestamp]
+            if len(timestamps):
+                # An end timestamp may equal its start; anything else must move forward
+                floor = timestamps[-1] if last_was_timestamp and not penultimate_was_timestamp else timestamps[-1] + 1
+                logits[row, self.timestamp_begin:floor] = -np.inf
+
+        # Prefer a timestamp whenever all timestamps together outweigh the best text token
+        log_probs = logits - logits.max(axis=-1, keepdims=True)
+        log_probs = log_probs - np.log(np.exp(log_probs).sum(axis=-1, keepdims=True))
+        timestamp_log_prob = np.logaddexp.reduce(log_probs[:, self.timestamp_begin:], axis=-1)
+        force_timestamp = timestamp_log_prob > log_probs[:, :self.timestamp_begin].max(axis=-1)
+        logits[force_timestamp, :self.timestamp_begin] = -np.inf
+        return logits
+
+    def _segments(self, tokens, window_duration):
+        # Splits "<|t0|> text <|t1|><|t1|> text <|t2|> ..." into (start, end, text_tokens)
+        segments = []
+        start = None
+        text_tokens = []
+        for token in tokens:
+            if token == self.eos_token_id:
+                break
+            if token >= self.timestamp_begin:
+                timestamp = (token - self.timestamp_begin) * TIME_PRECISION
+                if start is not None and text_tokens:
+                    segments.append((start, min(timestamp, window_duration), text_tokens))
+                    start = None
+                    text_tokens = []
+                else:
+                    start = timestamp
+            else:
+                text_tokens.append(int(token))
+        if text_tokens:
+            # Speech still running when the window ended
+            segments.append((start or 0.0, window_duration, text_tokens))
+        return segments
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe long audio with the Whisper ONNX export")
+    parser.add_argument("audio", help="Audio or video file (anything ffmpeg can decode)")
+    parser.add_argument("--model-dir", default="whisper_onnx")
+    parser.add_argument("--output", help="Transcript JSON path (default: print to stdout)")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--batch-size", type=int, default=4, help="30 s windows per encoder/decoder batch")
+    parser.add_argument("--overlap", type=float, default=5.0, help="Seconds shared by consecutive windows")
+    parser.add_argument("--vad", action="store_true", help="Skip silence: only encode the speech regions of the audio")
+    args = parser.parse_args()
+
+    vad = None
+    if args.vad:
+        from whisper_vad import VoiceActivityDetector
+        vad = VoiceActivityDetector()
+    transcriber = WhisperOnnxTranscriber(args.model_dir, language=args.language, batch_size=args.batch_size,
+                                         overlap_seconds=args.overlap, vad=vad)
+    transcript, stats = transcriber.transcribe_file(args.audio)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(transcript, f, indent=2)
+    else:
+        json.dump(transcript, sys.stdout, indent=2)
+        print()
+    print(f"Transcribed {stats['audio_seconds']} s of audio in {stats['elapsed_seconds']} s "
+          f"(realtime factor {stats['realtime_factor']}x)", file=sys.stderr)
@@ -0,0 +1,279 @@
+# whisper_vad.py
+# Voice-activity pre-filter for whisper_transcribe.py: finds the speech in a recording from
+# frame energy and spectral shape, so only speech reaches the Whisper encoder and the
+# transcript timestamps are mapped back onto the original recording.
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+SAMPLING_RATE = 16000
+FRAME_SECONDS = 0.025
+HOP_SECONDS = 0.01
+SPEECH_BAND = (300.0, 3400.0) # Hz, where most speech energy lies
+DIGITAL_SILENCE_DB = -90.0 # Frames this quiet are exact zeros, not room noise
+FEATURE_BLOCK_FRAMES = 8192 # Frames per FFT batch, about 80 s of audio and 50 MB of spectra
+
+def frame_features(audio, sampling_rate=SAMPLING_RATE, block_frames=FEATURE_BLOCK_FRAMES):
+    """
+    Per-frame features of mono float32 samples, FRAME_SECONDS frames every HOP_SECONDS:
+
+      energy_db   log energy in dBFS
+      flatness    spectral flatness (geometric over arithmetic mean power), near 1 for
+                  noise and low for voiced speech
+      band_ratio  share of the power inside SPEECH_BAND
+
+    Frames are strided views of the audio and go through one batched FFT per block of
+    block_frames frames, so the spectra held at once do not grow with the recording.
+    """
+    frame = int(FRAME_SECONDS * sampling_rate)
+    hop = int(HOP_SECONDS * sampling_rate)
+    audio = np.asarray(audio, dtype=np.float32)
+    if len(audio) < frame:
+        audio = np.pad(audio, (0, frame - len(audio)))
+    frames = np.lib.stride_tricks.sliding_window_view(audio, frame)[::hop]
+
+    window = np.hanning(frame).astype(np.float32)
+    frequencies = np.fft.rfftfreq(frame, 1 / sampling_rate)
+    # Flatness over the voice range only, so low rumble and high hiss do not dominate it
+    voice_band = (frequencies >= 80.0) & (frequencies <= 4000.0)
+    in_band = (frequencies >= SPEECH_BAND[0]) & (frequencies <= SPEECH_BAND[1])
+    energy_db = np.empty(len(frames))
+    flatness = np.empty(len(frames), dtype=np.float32)
+    band_ratio = np.empty(len(frames), dtype=np.float32)
+    for first in range(0, len(frames), block_frames):
+        block = frames[first:first + block_frames]
+        rows = slice(first, first + len(block))
+        energy_db[rows] = 10 * np.log10(np.mean(block.astype(np.float64) ** 2, axis=1) + 1e-10)
+        power = np.abs(np.fft.rfft(block * window, axis=1)) ** 2 + 1e-12
+        voice = power[:, voice_band]
+        flatness[rows] = np.exp(np.mean(np.log(voice), axis=1)) / np.mean(voice, axis=1)
+        band_ratio[rows] = power[:, in_band].sum(axis=1) / power.sum(axis=1)
+    return {"energy_db": energy_db, "flatness": flatness, "band_ratio": band_ratio}
+
+def hysteresis(scores, high, low):
+    """
+    Returns (start, end) frame ranges, end exclusive, of every run of scores >= low that
+    reaches high somewhere: speech starts only on a clear frame but continues through
+    weaker ones.
+    """
+    above_low = np.concatenate([[False], scores >= low, [False]])
+    edges = np.diff(above_low.astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    keep = np.maximum.reduceat(scores, starts) >= high
+    return np.stack([starts[keep], ends[keep]], axis=1).astype(np.int64)
+
+def _merge(regions, max_gap):
+    # Joins regions separated by at most max_gap
+    if len(regions) < 2:
+        return regions
+    separate = regions[1:, 0] - regions[:-1, 1] > max_gap
+    starts = regions[np.concatenate([[True], separate]), 0]
+    ends = regions[np.concatenate([separate, [True]]), 1]
+    return np.stack([starts, ends], axis=1)
+
+class VoiceActivityDetector:
+    """
+    Finds speech regions in mono 16 kHz audio.
+
+    Each frame gets a score in [0, 1]: its energy above the recording's noise floor (the
+    10th percentile of frame energy), how far its spectrum is from flat, and how much of its
+    power lies in the speech band. Scores are smoothed over smoothing_seconds and
+    thresholded with hysteresis (high to start speech, low to end it). Pauses shorter than
+    min_silence_seconds are bridged, regions shorter than min_speech_seconds dropped, and
+    the rest padded by pad_seconds on each side so word onsets and endings survive.
+    """
+    def __init__(self, high=0.6, low=0.4, snr_range=(3.0, 15.0), smoothing_seconds=0.05,
+                 min_silence_seconds=0.5, min_speech_seconds=0.25, pad_seconds=0.2, sampling_rate=SAMPLING_RATE):
+        if low > high:
+            raise ValueError("low must not exceed high")
+        self.high = high
+        self.low = low
+        self.snr_range = snr_range
+        self.smoothing_seconds = smoothing_seconds
+        self.min_silence_seconds = min_silence_seconds
+        self.min_speech_seconds = min_speech_seconds
+        self.pad_seconds = pad_seconds
+        self.sampling_rate = sampling_rate
+
+    def frame_scores(self, audio):
+        features = frame_features(audio, self.sampling_rate)
+        energy_db = features["energy_db"]
+        audible = energy_db > DIGITAL_SILENCE_DB
+        noise_floor = np.percentile(energy_db[audible], 10) if audible.any() else DIGITAL_SILENCE_DB
+        snr_low, snr_high = self.snr_range
+        loudness = np.clip((energy_db - noise_floor - snr_low) / (snr_high - snr_low), 0.0, 1.0)
+        scores = 0.5 * loudness + 0.25 * (1.0 - features["flatness"]) + 0.25 * features["band_ratio"]
+        scores = np.where(audible, scores, 0.0)
+        width = max(int(round(self.smoothing_seconds / HOP_SECONDS)), 1)
+        return np.convolve(scores, np.ones(width) / width, mode="same")
+
+    def speech_regions(self, audio):
+        """
+        Returns an (n, 2) int64 array of [start, end) sample ranges of speech, sorted and
+        non-overlapping.
+        """
+        hop = int(HOP_SECONDS * self.sampling_rate)
+        frame = int(FRAME_SECONDS * self.sampling_rate)
+        regions = hysteresis(self.frame_scores(audio), self.high, self.low)
+        regions = _merge(regions, int(self.min_silence_seconds / HOP_SECONDS))
+        regions = regions[regions[:, 1] - regions[:, 0] >= int(self.min_speech_seconds / HOP_SECONDS)]
+
+        # Frame ranges to samples: the last frame of a region covers frame samples from its start
+        pad = int(self.pad_seconds * self.sampling_rate)
+        samples = np.stack([regions[:, 0] * hop - pad, (regions[:, 1] - 1) * hop + frame + pad], axis=1) if len(regions) else regions
+        samples = np.clip(samples, 0, len(audio)).astype(np.int64)
+        return _merge(samples, 0)
+
+def compact_audio(audio, regions):
+    """
+    Concatenates the speech regions of a recording. Whisper then windows the shorter
+    compacted audio, and remap_times() maps its timestamps back.
+    """
+    if len(regions) == 0:
+        return np.zeros(0, dtype=np.float32)
+    audio = np.asarray(audio, dtype=np.float32)
+    return np.concatenate([audio[start:end] for start, end in regions])
+
+def remap_times(times, regions, is_end=False, sampling_rate=SAMPLING_RATE):
+    """
+    Maps times in seconds on the compacted timeline to the original recording. A time
+    exactly on the join of two regions belongs to the later region, or with is_end to the
+    earlier one, so a segment ending at a join does not stretch across the removed silence.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if len(regions) == 0:
+        return times
+    lengths = (regions[:, 1] - regions[:, 0]) / sampling_rate
+    compact_starts = np.concatenate([[0.0], np.cumsum(lengths)[:-1]])
+    index = np.searchsorted(compact_starts, times, side="left" if is_end else "right") - 1
+    index = np.clip(index, 0, len(regions) - 1)
+    offsets = np.minimum(times - compact_starts[index], lengths[index])
+    return regions[index, 0] / sampling_rate + offsets
+
+def remap_transcript(transcript, regions, sampling_rate=SAMPLING_RATE):
+    """
+    Shifts the chunk timestamps of a transcript of compacted audio back onto the original
+    recording.
+    """
+    chunks = transcript["chunks"]
+    if not chunks:
+        return transcript
+    timestamps = np.array([chunk["timestamp"] for chunk in chunks], dtype=np.float64)
+    starts = remap_times(timestamps[:, 0], regions, sampling_rate=sampling_rate)
+    ends = remap_times(timestamps[:, 1], regions, is_end=True, sampling_rate=sampling_rate)
+    return {**transcript, "chunks": [dict(chunk, timestamp=[round(float(start), 2), round(float(max(start, end)), 2)])
+                                     for chunk, start, end in zip(chunks, starts, ends)]}
+
+def synthetic_mix(minutes=10.0, speech_fraction=0.5, noise_db=-50.0, seed=0, sampling_rate=SAMPLING_RATE):
+    """
+    A lecture-like test recording: bursts of convert_whisper_to_onnx.synthetic_clip()
+    speech between silences of random length, over room noise at noise_db dBFS plus mains
+    hum. Returns the audio and the (n, 2) ground-truth speech sample ranges.
+    """
+    from convert_whisper_to_onnx import synthetic_clip
+
+    rng = np.random.RandomState(seed)
+    total = int(minutes * 60 * sampling_rate)
+    speech = synthetic_clip(20.0, sampling_rate)
+    audio = np.zeros(total, dtype=np.float32)
+    truth = []
+    position = 0
+    while position < total:
+        # Speech bursts of 2-20 s; the silence after each keeps the requested speech share on average
+        burst = int(rng.uniform(2.0, 20.0) * sampling_rate)
+        gap = int(burst * (1 - speech_fraction) / speech_fraction * rng.uniform(0.5, 1.5))
+        gap_start = min(position + gap, total)
+        end = min(gap_start + burst, total)
+        if end > gap_start:
+            offset = rng.randint(0, len(speech) - (end - gap_start) + 1)
+            audio[gap_start:end] = speech[offset:offset + end - gap_start]
+            truth.append((gap_start, end))
+        position = end
+    t = np.arange(total) / sampling_rate
+    audio += (10 ** (noise_db / 20) * (rng.randn(total) + 0.5 * np.sin(2 * np.pi * 50.0 * t))).astype(np.float32)
+    return audio, np.array(truth, dtype=np.int64).reshape(-1, 2)
+
+def _coverage(regions, num_samples):
+    mask = np.zeros(num_samples + 1, dtype=np.int32)
+    np.add.at(mask, regions[:, 0], 1)
+    np.add.at(mask, regions[:, 1], -1)
+    return np.cumsum(mask[:-1]) > 0
+
+def benchmark(speech_fractions=(0.1, 0.3, 0.5, 0.8), minutes=10.0, noise_db=-50.0, overlap_seconds=5.0, model_dir=None):
+    """
+    Runs the detector on synthetic_mix() recordings with different speech shares and
+    reports, scaled to one hour of audio: detector time, 30 s encoder windows with and
+    without the pre-filter, and, when model_dir holds a Whisper export, the encoder time
+    those windows cost (detector time included after filtering). Speech recall and the share of kept audio that is
+    silence are measured against the mix's ground truth.
+    """
+    from whisper_transcribe import WINDOW_SECONDS, split_windows
+
+    encoder_seconds_per_window = None
+    if model_dir is not None:
+        from onnx_external_data import create_shared_session
+        encoder = create_shared_session(os.path.join(model_dir, "encoder_model.onnx"))
+        input_name = encoder.get_inputs()[0].name
+        num_mel_bins = encoder.get_inputs()[0].shape[1] if isinstance(encoder.get_inputs()[0].shape[1], int) else 80
+        features = np.zeros((1, num_mel_bins, int(WINDOW_SECONDS * 100)), dtype=np.float32)
+        encoder.run(None, {input_name: features}) # Warm up
+        started = time.perf_counter()
+        for _ in range(3):
+            encoder.run(None, {input_name: features})
+        encoder_seconds_per_window = (time.perf_counter() - started) / 3
+
+    detector = VoiceActivityDetector()
+    hours = minutes / 60
+    results = []
+    for fraction in speech_fractions:
+        audio, truth = synthetic_mix(minutes, fraction, noise_db)
+        started = time.perf_counter()
+        regions = detector.speech_regions(audio)
+        vad_seconds = time.perf_counter() - started
+
+        kept = _coverage(regions, len(audio))
+        speech = _coverage(truth, len(audio))
+        windows_before = len(split_windows(len(audio), overlap_seconds))
+        windows_after = len(split_windows(int(kept.sum()), overlap_seconds)) if kept.any() else 0
+        result = {
+            "speech_fraction": fraction,
+            "kept_fraction": round(float(kept.mean()), 3),
+            "speech_recall": round(float((kept & speech).sum() / max(speech.sum(), 1)), 4),
+            "silence_in_kept": round(float((kept & ~speech).sum() / max(kept.sum(), 1)), 4),
+            "vad_seconds_per_hour": round(vad_seconds / hours, 2),
+            "windows_per_hour_before": round(windows_before / hours, 1),
+            "windows_per_hour_after": round(windows_after / hours, 1),
+        }
+        if encoder_seconds_per_window is not None:
+            result["encoder_seconds_per_hour_before"] = round(windows_before / hours * encoder_seconds_per_window, 1)
+            result["encoder_seconds_per_hour_after"] = round((windows_after / hours * encoder_seconds_per_window) + vad_seconds / hours, 1)
+        results.append(result)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Find speech in lecture audio, or benchmark the detector on synthetic mixes")
+    parser.add_argument("audio", nargs="?", help="Audio or video file; prints its speech regions in seconds")
+    parser.add_argument("--benchmark", action="store_true", help="Measure compute saved on synthetic speech/silence mixes")
+    parser.add_argument("--minutes", type=float, default=10.0, help="Length of each synthetic mix")
+    parser.add_argument("--speech-fractions", nargs="+", type=float, default=[0.1, 0.3, 0.5, 0.8])
+    parser.add_argument("--noise-db", type=float, default=-50.0, help="Background noise level of the mixes in dBFS")
+    parser.add_argument("--model-dir", help="Whisper export to time encoder passes with")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        json.dump(benchmark(args.speech_fractions, args.minutes, args.noise_db, model_dir=args.model_dir), sys.stdout, indent=2)
+        print()
+    elif args.audio:
+        from whisper_transcribe import load_audio
+        regions = VoiceActivityDetector().speech_regions(load_audio(args.audio))
+        json.dump([[round(start / SAMPLING_RATE, 2), round(end / SAMPLING_RATE, 2)] for start, end in regions], sys.stdout)
+        print()
+    else:
+        parser.error("give an audio file or --benchmark")